@@ -0,0 +1,125 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare wake word detection throughput for many streams when each stream
+runs shared hotword engines itself against streams submitting chunks to a
+`HotwordBatcher`. Streams are split between worker threads, as stream audio
+is processed by `stream_workers`, and every stream processes the same
+generated background noise. Requires the configured hotword plugins, with
+at least one engine shared by `ModelRegistry` (i.e. Precise Lite):
+    python benchmarks/hotword_batching.py --streams 1 10 100 --workers 4
+"""
+
+from argparse import ArgumentParser
+from threading import Thread
+from time import perf_counter
+from typing import List, Optional
+
+import numpy as np
+
+from ovos_dinkum_listener.voice_loop.hotwords import HotwordState
+from ovos_utils.fakebus import FakeBus
+
+from neon_hana.model_registry import model_registry, supports_stream_state
+from neon_hana.streaming_client import HotwordBatcher
+
+CHUNK_BYTES = 4096
+SAMPLE_RATE = 16000
+
+
+def generate_chunks(seconds: float) -> List[bytes]:
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 150, int(seconds * SAMPLE_RATE))
+    audio = audio.clip(-32768, 32767).astype(np.int16).tobytes()
+    return [audio[i:i + CHUNK_BYTES]
+            for i in range(0, len(audio) - CHUNK_BYTES + 1, CHUNK_BYTES)]
+
+
+def run_streams(streams: int, workers: int, chunks: List[bytes],
+                batcher: Optional[HotwordBatcher]) -> float:
+    hotwords = list()
+    for _ in range(streams):
+        stream_hotwords = model_registry.get_hotwords(FakeBus(), batcher)
+        stream_hotwords.state = HotwordState.LISTEN
+        hotwords.append(stream_hotwords)
+    if not any(supports_stream_state(engine)
+               for engine in hotwords[0].plugins):
+        raise RuntimeError("No configured hotword engine is shared")
+
+    def _process(worker_streams):
+        for chunk in chunks:
+            for stream_hotwords in worker_streams:
+                stream_hotwords.update(chunk)
+                stream_hotwords.found()
+
+    threads = [Thread(target=_process, args=(hotwords[i::workers],))
+               for i in range(min(workers, streams))]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = perf_counter() - start
+    for stream_hotwords in hotwords:
+        stream_hotwords.shutdown()
+    return duration
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--streams", type=int, nargs="+",
+                        default=[1, 10, 100])
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Threads processing stream audio")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Maximum chunks in one batch")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="Maximum seconds a chunk waits for a batch")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="Seconds of audio processed by each stream")
+    args = parser.parse_args()
+
+    chunks = generate_chunks(args.seconds)
+    audio_seconds = len(chunks) * CHUNK_BYTES / 2 / SAMPLE_RATE
+    for streams in args.streams:
+        for batched in (False, True):
+            batcher = HotwordBatcher(args.batch_size, args.latency,
+                                     model_registry.hotword_lock) \
+                if batched else None
+            duration = run_streams(streams, args.workers, chunks, batcher)
+            mode = "batched" if batched else "direct"
+            stats = f" mean_batch=" \
+                f"{batcher.stats['requests'] / batcher.stats['batches']:.1f}"\
+                if batched else ""
+            print(f"{mode:8} streams={streams:<4} {duration:.2f}s for "
+                  f"{audio_seconds:.0f}s of audio per stream "
+                  f"({streams * audio_seconds / duration:.0f}x real time)"
+                  f"{stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare blocking `send_mq_request` calls against concurrent `AsyncMQClient`
+requests. A local fake responder answers every request after a fixed delay,
+so the results reflect how many requests can be in flight at once rather
+than backend performance. Requires an MQ server, i.e.:
+    docker run -p 5672:5672 rabbitmq
+    python benchmarks/mq_request_concurrency.py --server localhost
+"""
+
+import asyncio
+import pika
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from time import sleep, time
+
+from neon_mq_connector.utils.client_utils import send_mq_request
+from neon_mq_connector.utils.network_utils import b64_to_dict, dict_to_b64
+
+from neon_hana.mq_client import AsyncMQClient
+
+VHOST = "/"
+INPUT_QUEUE = "hana_benchmark_input"
+
+
+class FakeResponder(Thread):
+    def __init__(self, params: pika.ConnectionParameters, delay: float):
+        """
+        Consume requests from `INPUT_QUEUE` and reply to each request's
+        `routing_key` after `delay` seconds.
+        """
+        Thread.__init__(self, daemon=True)
+        self.params = params
+        self.delay = delay
+        self.ready = Event()
+        self._executor = ThreadPoolExecutor(max_workers=64)
+
+    def run(self):
+        connection = pika.BlockingConnection(self.params)
+        channel = connection.channel()
+        channel.queue_declare(INPUT_QUEUE, auto_delete=False)
+
+        def _reply(request: dict):
+            sleep(self.delay)
+            response = {"message_id": request["message_id"],
+                        "status_code": 200, "content": "{}"}
+            connection.add_callback_threadsafe(
+                lambda: channel.basic_publish(
+                    exchange='', routing_key=request["routing_key"],
+                    body=dict_to_b64(response)))
+
+        def _on_request(_, __, ___, body: bytes):
+            self._executor.submit(_reply, b64_to_dict(body))
+
+        channel.basic_consume(INPUT_QUEUE, _on_request, auto_ack=True)
+        self.ready.set()
+        channel.start_consuming()
+
+
+def run_blocking(num_requests: int, timeout: int) -> float:
+    start = time()
+    for _ in range(num_requests):
+        send_mq_request(VHOST, {"test": True}, INPUT_QUEUE, timeout=timeout)
+    return time() - start
+
+
+async def run_async(client: AsyncMQClient, num_requests: int,
+                    timeout: int) -> float:
+    start = time()
+    await asyncio.gather(*[client.request(VHOST, {"test": True}, INPUT_QUEUE,
+                                          timeout=timeout)
+                           for _ in range(num_requests)])
+    return time() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--server", default="localhost")
+    parser.add_argument("--port", type=int, default=5672)
+    parser.add_argument("--user", default="guest")
+    parser.add_argument("--password", default="guest")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="Seconds the fake responder waits per request")
+    args = parser.parse_args()
+
+    mq_config = {"server": args.server, "port": args.port,
+                 "users": {"mq_handler": {"user": args.user,
+                                          "password": args.password}}}
+    from ovos_config.config import Configuration
+    Configuration()['MQ'] = mq_config
+
+    responder = FakeResponder(pika.ConnectionParameters(
+        host=args.server, port=args.port,
+        credentials=pika.PlainCredentials(args.user, args.password)),
+        args.delay)
+    responder.start()
+    responder.ready.wait()
+
+    blocking = run_blocking(args.requests, 10)
+    print(f"send_mq_request: {args.requests} requests in {blocking:.2f}s "
+          f"({args.requests / blocking:.1f} req/s)")
+    concurrent = asyncio.run(run_async(AsyncMQClient(mq_config),
+                                       args.requests, 10))
+    print(f"AsyncMQClient:   {args.requests} requests in {concurrent:.2f}s "
+          f"({args.requests / concurrent:.1f} req/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure CPU used to decode Opus stream audio and the bandwidth it saves over
+raw PCM. Audio is read from a 16kHz 16-bit mono WAV recording (or generated),
+encoded to raw Opus packets as a client would send them, then decoded by one
+`StreamMicrophone` per simulated stream with packets interleaved across
+streams, i.e.:
+    python benchmarks/opus_decode.py --wav recording.wav --streams 50
+Requires `opuslib` and the system Opus library.
+"""
+
+import wave
+
+from argparse import ArgumentParser
+from time import process_time
+from typing import List
+
+import numpy as np
+import opuslib
+
+from neon_hana.streaming_client import StreamMicrophone
+
+SAMPLE_RATE = 16000
+
+
+def load_audio(wav_path: str) -> bytes:
+    with wave.open(wav_path, "rb") as f:
+        if f.getframerate() != SAMPLE_RATE or f.getsampwidth() != 2 or \
+                f.getnchannels() != 1:
+            raise ValueError("Expected 16kHz 16-bit mono audio")
+        return f.readframes(f.getnframes())
+
+
+def generate_audio(seconds: float) -> bytes:
+    """
+    Generate noise with alternating quiet and loud tones so the encoder sees
+    both silence and signal.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = rng.normal(0, 150, len(t))
+    audio += 3000 * np.sin(2 * np.pi * 220 * t) * (t % 2 < 1)
+    return audio.clip(-32768, 32767).astype(np.int16).tobytes()
+
+
+def encode(audio: bytes, frame_ms: int, bitrate: int) -> List[bytes]:
+    encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+    encoder.bitrate = bitrate
+    frames = SAMPLE_RATE * frame_ms // 1000
+    frame_bytes = frames * 2
+    return [encoder.encode(audio[i:i + frame_bytes], frames)
+            for i in range(0, len(audio) - frame_bytes + 1, frame_bytes)]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--wav", help="16kHz 16-bit mono WAV recording")
+    parser.add_argument("--seconds", type=float, default=60,
+                        help="Seconds of audio to generate without --wav")
+    parser.add_argument("--streams", type=int, default=10,
+                        help="Number of concurrent streams to decode")
+    parser.add_argument("--frame-ms", type=int, default=20,
+                        choices=(10, 20, 40, 60),
+                        help="Duration of each Opus packet")
+    parser.add_argument("--bitrate", type=int, default=24000,
+                        help="Encoder bitrate in bits per second")
+    args = parser.parse_args()
+
+    audio = load_audio(args.wav) if args.wav else \
+        generate_audio(args.seconds)
+    packets = encode(audio, args.frame_ms, args.bitrate)
+    audio_seconds = len(packets) * args.frame_ms / 1000
+    opus_kbps = sum(len(p) for p in packets) * 8 / audio_seconds / 1000
+    pcm_kbps = SAMPLE_RATE * 16 / 1000
+    print(f"{len(packets)} packets, {audio_seconds:.0f}s of audio: "
+          f"opus={opus_kbps:.1f}kbit/s pcm={pcm_kbps:.0f}kbit/s "
+          f"({pcm_kbps / opus_kbps:.1f}x less ingress)")
+
+    mics = [StreamMicrophone(1, codec="opus") for _ in range(args.streams)]
+    start = process_time()
+    for packet in packets:
+        for mic in mics:
+            mic.write(packet)
+            # Consume audio as a stream worker would
+            while mic.read_chunk_nowait() is not None:
+                pass
+    duration = process_time() - start
+    per_stream = duration / args.streams
+    errors = sum(mic.decode_errors for mic in mics)
+    print(f"streams={args.streams}: {per_stream * 1000 / len(packets):.3f}ms "
+          f"CPU/packet, {per_stream / audio_seconds * 100:.2f}% of one core "
+          f"per stream (~{int(audio_seconds / per_stream)} streams per core), "
+          f"{errors} decode errors")
+
+
+if __name__ == "__main__":
+    main()
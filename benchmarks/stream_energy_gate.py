@@ -0,0 +1,125 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare CPU used to process streamed audio with and without `EnergyGate`.
+Audio is read from a 16kHz 16-bit mono WAV recording (or generated as
+background noise with short bursts of louder audio) and processed by a
+`RemoteStreamHandler` in the current thread. Processing requires the
+configured hotword and VAD plugins; the cost and pass rate of the gate alone
+are always reported, i.e.:
+    python benchmarks/stream_energy_gate.py --wav recording.wav
+"""
+
+import wave
+
+from argparse import ArgumentParser
+from time import process_time
+from typing import List
+
+import numpy as np
+
+from neon_hana.streaming_client import (EnergyGate, RemoteStreamHandler,
+                                        StreamMicrophone)
+
+CHUNK_BYTES = 4096
+SAMPLE_RATE = 16000
+
+
+def load_chunks(wav_path: str) -> List[bytes]:
+    with wave.open(wav_path, "rb") as f:
+        if f.getframerate() != SAMPLE_RATE or f.getsampwidth() != 2 or \
+                f.getnchannels() != 1:
+            raise ValueError("Expected 16kHz 16-bit mono audio")
+        audio = f.readframes(f.getnframes())
+    return [audio[i:i + CHUNK_BYTES]
+            for i in range(0, len(audio) - CHUNK_BYTES + 1, CHUNK_BYTES)]
+
+
+def generate_chunks(seconds: float) -> List[bytes]:
+    """
+    Generate background noise with one second of louder audio every ten
+    seconds.
+    """
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 150, int(seconds * SAMPLE_RATE))
+    for start in range(5 * SAMPLE_RATE, len(audio), 10 * SAMPLE_RATE):
+        audio[start:start + SAMPLE_RATE] *= 20
+    audio = audio.clip(-32768, 32767).astype(np.int16).tobytes()
+    return [audio[i:i + CHUNK_BYTES]
+            for i in range(0, len(audio) - CHUNK_BYTES + 1, CHUNK_BYTES)]
+
+
+def run_gate(chunks: List[bytes]):
+    gate = EnergyGate()
+    start = process_time()
+    for chunk in chunks:
+        gate.process(chunk)
+    duration = process_time() - start
+    print(f"gate only: {duration * 1000 / len(chunks):.3f}ms CPU/chunk, "
+          f"passed {gate.passed}/{len(chunks)} chunks")
+
+
+def run_stream(chunks: List[bytes], energy_gate: bool) -> float:
+    # Buffer all of the audio up front so only processing is timed
+    seconds = len(chunks) * CHUNK_BYTES / (2 * SAMPLE_RATE) + 1
+    handler = RemoteStreamHandler(
+        StreamMicrophone(seconds), "benchmark", input_audio_callback=print,
+        client_socket=None, ww_callback=print,
+        energy_gate=EnergyGate() if energy_gate else None)
+    handler.voice_loop.start()
+    handler.voice_loop.prepare()
+    for chunk in chunks:
+        handler.mic.write(chunk)
+    start = process_time()
+    handler.process_audio(len(chunks))
+    return process_time() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--wav", help="16kHz 16-bit mono WAV recording")
+    parser.add_argument("--seconds", type=float, default=60,
+                        help="Seconds of audio to generate without --wav")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.wav) if args.wav else \
+        generate_chunks(args.seconds)
+    audio_seconds = len(chunks) * CHUNK_BYTES / 2 / SAMPLE_RATE
+    run_gate(chunks)
+    try:
+        for energy_gate in (False, True):
+            duration = run_stream(chunks, energy_gate)
+            print(f"stream gate={energy_gate}: {duration:.2f}s CPU for "
+                  f"{audio_seconds:.0f}s of audio "
+                  f"({duration / audio_seconds * 100:.1f}% of one core "
+                  f"per stream)")
+    except Exception as e:
+        print(f"Stream processing skipped; engines could not be loaded: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare memory and connect latency of stream handlers that load hotword and
+VAD engines per stream against handlers getting engines from
+`ModelRegistry`, which shares hotword engines that support per-stream state
+and loads other engines for each stream. Each configuration runs in a new
+process so resident memory is measured from the same baseline. Requires the configured hotword and VAD
+plugins to be installed, i.e.:
+    python benchmarks/stream_model_memory.py --streams 1 10 100
+"""
+
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+from ovos_utils.fakebus import FakeBus
+
+
+class PerStreamModels:
+    """
+    Loads engines for every stream, as stream handlers did before
+    `ModelRegistry`.
+    """
+    @staticmethod
+    def get_hotwords(bus: FakeBus, detector=None):
+        from ovos_dinkum_listener.voice_loop.hotwords import HotwordContainer
+        hotwords = HotwordContainer(bus)
+        hotwords.load_hotword_engines()
+        return hotwords
+
+    @staticmethod
+    def get_vad():
+        from ovos_plugin_manager.vad import OVOSVADFactory
+        return OVOSVADFactory.create()
+
+
+def get_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * 4096 / 1024 / 1024
+
+
+def run_streams(mode: str, streams: int):
+    import neon_hana.streaming_client as streaming_client
+    from neon_hana.streaming_client import (RemoteStreamHandler,
+                                            StreamMicrophone)
+    if mode == "per_stream":
+        streaming_client.model_registry = PerStreamModels()
+    baseline = get_rss_mb()
+    handlers = list()
+    start = perf_counter()
+    first = None
+    for i in range(streams):
+        handlers.append(RemoteStreamHandler(
+            StreamMicrophone(), str(i), input_audio_callback=print,
+            client_socket=None, ww_callback=print))
+        first = first or perf_counter() - start
+    duration = perf_counter() - start
+    used = get_rss_mb() - baseline
+    print(f"{mode:10} streams={streams:<4} rss={used:.1f}MB "
+          f"({used / streams:.2f}MB/stream) first_connect={first:.3f}s "
+          f"mean_connect={duration / streams:.3f}s")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--streams", type=int, nargs="+",
+                        default=[1, 10, 100])
+    parser.add_argument("--mode", choices=("per_stream", "shared"),
+                        help="Run a single configuration in this process")
+    args = parser.parse_args()
+
+    if args.mode:
+        for streams in args.streams:
+            run_streams(args.mode, streams)
+        return
+    for mode in ("per_stream", "shared"):
+        for streams in args.streams:
+            subprocess.run([sys.executable, __file__, "--mode", mode,
+                            "--streams", str(streams)], check=True)
+
+
+if __name__ == "__main__":
+    main()
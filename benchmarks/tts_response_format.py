@@ -0,0 +1,120 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare TTS responses returned as base64 JSON against WAV response bodies for
+payload size, time to first byte and total time including client decoding.
+Routes mirror `/neon/get_tts` and are served by a local uvicorn server, with
+the TTS service replaced by synthetic audio so results reflect only the
+response format, i.e.:
+    python benchmarks/tts_response_format.py --seconds 5
+"""
+
+import json
+import socket
+import uvicorn
+
+from argparse import ArgumentParser
+from base64 import b64decode, b64encode
+from http.client import HTTPConnection
+from os import urandom
+from statistics import median
+from threading import Thread
+from time import perf_counter, sleep
+
+from fastapi import FastAPI, Response
+
+from neon_hana.schema.assist_requests import TTSRequest, TTSResponse
+
+
+def get_app(audio: bytes) -> FastAPI:
+    app = FastAPI()
+    encoded_audio = b64encode(audio).decode("utf-8")
+
+    @app.post("/json")
+    async def get_tts_json(_: TTSRequest) -> TTSResponse:
+        return TTSResponse(encoded_audio=encoded_audio)
+
+    @app.post("/binary")
+    async def get_tts_binary(_: TTSRequest):
+        return Response(content=audio, media_type="audio/wav")
+
+    return app
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(port: int, path: str) -> (int, float, float):
+    """
+    Make one TTS request and decode the audio as a client would.
+    @return: payload bytes, seconds to first byte, seconds to decoded audio
+    """
+    body = json.dumps({"to_speak": "hello", "lang_code": "en-us"})
+    connection = HTTPConnection("127.0.0.1", port)
+    start = perf_counter()
+    connection.request("POST", path, body,
+                       {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    first = response.read(1)
+    first_byte = perf_counter() - start
+    payload = first + response.read()
+    if path == "/json":
+        b64decode(json.loads(payload)["encoded_audio"])
+    total = perf_counter() - start
+    connection.close()
+    return len(payload), first_byte, total
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5,
+                        help="Seconds of 22050Hz 16-bit mono audio")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    audio = urandom(int(args.seconds * 22050 * 2))
+    port = get_free_port()
+    server = uvicorn.Server(uvicorn.Config(get_app(audio), port=port,
+                                           log_level="warning"))
+    Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        sleep(0.1)
+
+    for path in ("/json", "/binary"):
+        request(port, path)  # warm up
+        results = [request(port, path) for _ in range(args.requests)]
+        print(f"{path:8} payload={results[0][0]} bytes "
+              f"ttfb={median(r[1] for r in results) * 1000:.2f}ms "
+              f"total={median(r[2] for r in results) * 1000:.2f}ms")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
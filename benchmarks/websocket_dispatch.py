@@ -0,0 +1,89 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare sending WebSocket messages from an MQ consumer thread with a new event
+loop per message (`asyncio.run`) against `WebSocketDispatcher`, which
+schedules sends on the server's event loop. The WebSocket is replaced with a
+no-op so results reflect dispatch overhead only, i.e.:
+    python benchmarks/websocket_dispatch.py --messages 10000
+"""
+
+import asyncio
+
+from argparse import ArgumentParser
+from threading import Thread
+from time import perf_counter
+
+from neon_hana.websocket_dispatcher import WebSocketDispatcher
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, _: str):
+        self.sent += 1
+
+
+def run_per_message_loop(messages: int) -> float:
+    socket = FakeWebSocket()
+    start = perf_counter()
+    for _ in range(messages):
+        asyncio.run(socket.send_text("{}"))
+    return perf_counter() - start
+
+
+def run_dispatcher(messages: int, loop: asyncio.AbstractEventLoop) -> float:
+    socket = FakeWebSocket()
+    dispatcher = WebSocketDispatcher()
+    dispatcher.bind(loop)
+    start = perf_counter()
+    futures = [dispatcher.dispatch(socket.send_text("{}"))
+               for _ in range(messages)]
+    for future in futures:
+        future.result()
+    return perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+
+    for name, duration in (
+            ("asyncio.run", run_per_message_loop(args.messages)),
+            ("dispatcher", run_dispatcher(args.messages, loop))):
+        print(f"{name:12} {args.messages} messages in {duration:.2f}s "
+              f"({args.messages / duration:.0f} msg/s)")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    main()
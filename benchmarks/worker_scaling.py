@@ -0,0 +1,134 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure how requests per second scale with `server_workers`. For each worker
+count, HANA is started in a subprocess with a temporary configuration and
+loaded by several client processes sending keep-alive requests to an endpoint
+that does not call the backend (rate limits still apply, with a limit high
+enough not to be reached). Starting HANA requires an MQ server, i.e.:
+    docker run -p 5672:5672 rabbitmq
+    python benchmarks/worker_scaling.py --mq-server localhost --workers 1 2 4
+"""
+
+import subprocess
+import sys
+import yaml
+
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from multiprocessing import Pool
+from os import environ, makedirs
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+
+
+def start_server(config_dir: str, port: int, workers: int,
+                 mq_server: str) -> subprocess.Popen:
+    config = {"MQ": {"server": mq_server},
+              "hana": {"port": port, "server_workers": workers,
+                       "requests_per_minute": 10 ** 9,
+                       "rate_limit_db_path": f"{config_dir}/rate_limits.db",
+                       "session_db_path": f"{config_dir}/sessions.db",
+                       "access_token_secret": "benchmark",
+                       "refresh_token_secret": "benchmark"}}
+    with open(f"{config_dir}/neon/diana.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+    env = {**environ, "XDG_CONFIG_HOME": config_dir,
+           "OVOS_CONFIG_BASE_FOLDER": "neon",
+           "OVOS_CONFIG_FILENAME": "diana.yaml"}
+    return subprocess.Popen([sys.executable, "-m", "neon_hana.app"], env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+def wait_for_server(port: int, path: str, timeout: float = 60):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            connection = HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", path)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        sleep(0.5)
+    raise TimeoutError(f"Server did not start on port {port}")
+
+
+def run_client(args: tuple) -> int:
+    port, path, seconds = args
+    connection = HTTPConnection("127.0.0.1", port)
+    requests = 0
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            requests += 1
+    connection.close()
+    return requests
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--mq-server", default="localhost",
+                        help="MQ server for HANA to connect to")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="Worker counts to compare")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="Client processes sending requests")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="Seconds to send requests for")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--path", default="/util/headers",
+                        help="Endpoint to request")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        with TemporaryDirectory() as config_dir:
+            makedirs(f"{config_dir}/neon")
+            server = start_server(config_dir, args.port, workers,
+                                  args.mq_server)
+            try:
+                wait_for_server(args.port, args.path)
+                with Pool(args.clients) as pool:
+                    counts = pool.map(run_client,
+                                      [(args.port, args.path,
+                                        args.seconds)] * args.clients)
+            finally:
+                server.terminate()
+                server.wait()
+        rps = sum(counts) / args.seconds
+        baseline = baseline or rps
+        print(f"workers={workers:<3} {rps:8.0f} requests/s "
+              f"({rps / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 from neon_hana.app.dependencies import client_manager, jwt_bearer, mq_connector
@@ -41,7 +42,14 @@ def create_app(config: dict):
     title = config.get('fastapi_title') or "HANA: HTTP API for Neon Applications"
     summary = config.get('fastapi_summary') or ""
     version = __version__
-    app = FastAPI(title=title, summary=summary, version=version)
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI):
+        yield
+        await mq_connector.shutdown()
+
+    app = FastAPI(title=title, summary=summary, version=version,
+                  lifespan=lifespan)
     app.include_router(auth_route)
     app.include_router(assist_route)
     app.include_router(proxy_route)
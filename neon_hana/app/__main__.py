@@ -32,14 +32,29 @@ environ.setdefault("OVOS_CONFIG_FILENAME", "diana.yaml")
 
 from ovos_config.config import Configuration
 
-from neon_hana.app import create_app
+
+def get_app():
+    """
+    Create the app from configuration. Each worker process calls this to
+    create its own app, with its own MQ connections. The app is only
+    imported here so a supervisor process does not connect to MQ or open
+    session and rate limit storage.
+    """
+    from neon_hana.app import create_app
+    return create_app(Configuration().get("hana", {}))
 
 
 def main():
     config = Configuration().get("hana", {})
-    app = create_app(config)
-    uvicorn.run(app, host=config.get('server_host', "0.0.0.0"),
-                port=config.get('port', 8080), forwarded_allow_ips="*")
+    workers = config.get('server_workers', 1)
+    kwargs = {"host": config.get('server_host', "0.0.0.0"),
+              "port": config.get('port', 8080),
+              "forwarded_allow_ips": "*"}
+    if workers > 1:
+        uvicorn.run("neon_hana.app.__main__:get_app", factory=True,
+                    workers=workers, **kwargs)
+    else:
+        uvicorn.run(get_app(), **kwargs)
 
 
 if __name__ == "__main__":
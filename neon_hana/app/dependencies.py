@@ -33,3 +33,5 @@ config = Configuration().get("hana") or dict()
 mq_connector = MQServiceManager(config)
 client_manager = ClientManager(config)
 jwt_bearer = UserTokenAuth(client_manager)
+# Server statistics are only available to clients with node access
+node_bearer = UserTokenAuth(client_manager, permission="node")
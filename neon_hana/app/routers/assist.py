@@ -24,7 +24,7 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from neon_hana.schema.assist_requests import *
 from neon_hana.app.dependencies import jwt_bearer, mq_connector
 
@@ -35,12 +35,31 @@ assist_route = APIRouter(prefix="/neon", tags=["assist"],
 
 @assist_route.post("/get_stt")
 async def get_stt(audio_in: STTRequest) -> STTResponse:
-    return mq_connector.get_stt(**dict(audio_in))
+    return await mq_connector.get_stt(**dict(audio_in))
 
 
-@assist_route.post("/get_tts")
-async def get_tts(request: TTSRequest) -> TTSResponse:
-    return mq_connector.get_tts(**dict(request))
+@assist_route.post("/get_stt/raw", openapi_extra={"requestBody": {
+    "required": True,
+    "content": {"audio/wav": {"schema": {"type": "string",
+                                         "format": "binary"}}}}})
+async def get_stt_raw(request: Request, lang_code: str) -> STTResponse:
+    audio = await _read_body(request, mq_connector.stt_max_bytes)
+    return await mq_connector.get_stt_audio(audio, lang_code)
+
+
+@assist_route.post("/get_tts", response_model=TTSResponse,
+                   responses={200: {"content": {"audio/wav": {}}}})
+async def get_tts(tts_request: TTSRequest, request: Request,
+                  binary: bool = False):
+    """
+    Synthesize speech. Audio is returned as base64 in JSON unless the request
+    `Accept` header prefers WAV audio or `binary` is set, in which case the
+    WAV audio is returned as the response body.
+    """
+    if binary or _accepts_audio(request):
+        audio = await mq_connector.get_tts_audio(**dict(tts_request))
+        return Response(content=audio, media_type="audio/wav")
+    return await mq_connector.get_tts(**dict(tts_request))
 
 
 @assist_route.post("/get_response")
@@ -48,4 +67,44 @@ async def get_response(skill_request: SkillRequest,
                        request: Request) -> SkillResponse:
     if not skill_request.node_data.networking.public_ip:
         skill_request.node_data.networking.public_ip = request.client.host
-    return mq_connector.get_response(**dict(skill_request))
+    return await mq_connector.get_response(**dict(skill_request))
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """
+    Read a request body, rejecting it as soon as it exceeds `max_bytes`
+    instead of after it has been fully received.
+    @param request: Request to read the body of
+    @param max_bytes: Maximum body size; a value less than 1 means no limit
+    @return: request body bytes
+    """
+    too_large = HTTPException(status_code=413,
+                              detail=f"Audio exceeds maximum length of "
+                                     f"{max_bytes} bytes")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and 0 < max_bytes < int(content_length):
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if 0 < max_bytes < len(body):
+            raise too_large
+    if not body:
+        raise HTTPException(status_code=400, detail="No audio received")
+    return bytes(body)
+
+
+def _accepts_audio(request: Request) -> bool:
+    """
+    Check if a request's `Accept` header explicitly asks for WAV audio.
+    @param request: Request to check
+    @return: True if WAV audio is acceptable and JSON is not preferred
+    """
+    media_types = [media.split(";")[0].strip().lower() for media in
+                   request.headers.get("accept", "").split(",")]
+    for media_type in media_types:
+        if media_type in ("audio/wav", "audio/x-wav", "audio/*"):
+            return True
+        if media_type in ("application/json", "application/*"):
+            return False
+    return False
@@ -35,8 +35,8 @@ auth_route = APIRouter(prefix="/auth", tags=["authentication"])
 @auth_route.post("/login")
 async def check_login(auth_request: AuthenticationRequest,
                       request: Request) -> AuthenticationResponse:
-    return client_manager.check_auth_request(**dict(auth_request),
-                                             origin_ip=request.client.host)
+    return await client_manager.check_auth_request_async(
+        **dict(auth_request), origin_ip=request.client.host)
 
 
 @auth_route.post("/refresh")
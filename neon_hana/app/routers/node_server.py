@@ -29,11 +29,12 @@ from signal import signal, SIGINT
 from time import sleep
 from typing import Optional, Union
 
-from fastapi import APIRouter, WebSocket, HTTPException
+from fastapi import APIRouter, Depends, WebSocket, HTTPException
 from ovos_utils import LOG
 from starlette.websockets import WebSocketDisconnect
 
-from neon_hana.app.dependencies import config, client_manager
+from neon_hana.app.dependencies import config, client_manager, node_bearer
+from neon_hana.audio_codec import SUPPORTED_CODECS
 from neon_hana.mq_websocket_api import MQWebsocketAPI, ClientNotKnown
 
 from neon_hana.schema.node_v1 import (NodeAudioInput, NodeGetStt,
@@ -52,7 +53,7 @@ signal(SIGINT, socket_api.shutdown)
 @node_route.websocket("/v1")
 async def node_v1_endpoint(websocket: WebSocket, token: str):
     client_id = client_manager.get_client_id(token)
-    if not client_manager.validate_auth(token, client_id):
+    if not await client_manager.validate_auth_async(token, client_id):
         raise HTTPException(status_code=403,
                             detail="Invalid or expired token.")
     if not client_manager.get_permissions(client_id).node:
@@ -62,7 +63,7 @@ async def node_v1_endpoint(websocket: WebSocket, token: str):
     await websocket.accept()
     disconnect_event = Event()
 
-    socket_api.new_connection(websocket, client_id)
+    await socket_api.new_connection(websocket, client_id)
     while not disconnect_event.is_set():
         try:
             client_in: dict = await websocket.receive_json()
@@ -73,8 +74,13 @@ async def node_v1_endpoint(websocket: WebSocket, token: str):
 
 
 @node_route.websocket("/v1/stream")
-async def node_v1_stream_endpoint(websocket: WebSocket, token: str):
+async def node_v1_stream_endpoint(websocket: WebSocket, token: str,
+                                  codec: str = "pcm",
+                                  chunked_response: bool = False):
     client_id = client_manager.get_client_id(token)
+    if codec not in SUPPORTED_CODECS:
+        raise HTTPException(status_code=400,
+                            detail=f"Unsupported codec: {codec}")
 
     if not client_manager.check_connect_stream():
         raise HTTPException(status_code=503,
@@ -82,7 +88,8 @@ async def node_v1_stream_endpoint(websocket: WebSocket, token: str):
     try:
         await websocket.accept()
         disconnect_event = Event()
-        socket_api.new_stream(websocket, client_id)
+        await socket_api.new_stream(websocket, client_id, codec,
+                                    chunked_response)
         while not disconnect_event.is_set():
             try:
                 client_in: bytes = await websocket.receive_bytes()
@@ -99,6 +106,14 @@ async def node_v1_stream_endpoint(websocket: WebSocket, token: str):
         client_manager.disconnect_stream()
 
 
+@node_route.get("/v1/stats", dependencies=[Depends(node_bearer)])
+async def node_v1_stats() -> dict:
+    """
+    Outbound message queue depth and counts for all connected nodes.
+    """
+    return socket_api.stats
+
+
 @node_route.get("/v1/doc")
 async def node_v1_doc(_: Optional[Union[NodeAudioInput, NodeGetStt,
                                         NodeGetTts]]) -> \
@@ -112,6 +127,11 @@ async def node_v1_doc(_: Optional[Union[NodeAudioInput, NodeGetStt,
     `msg_type`, `data`, `context`. Only the inputs and responses documented here
     are explicitly supported. Other messages sent or received on this socket are
     not guaranteed to be stable.
+
+    If a `neon.get_tts` input has `binary_audio` set in its context, each audio
+    value in the response is replaced with its length in bytes and the WAV
+    audio is sent as binary messages immediately after the response, in the
+    same order.
     """
     pass
 
@@ -124,11 +144,30 @@ async def node_v1_stream_doc():
         - sample_rate=16000
         - sample_width=2
         - sample_channels=1
-        - chunk_size=4096
+
+    Audio is raw PCM by default. To save bandwidth, a client may instead
+    connect with `codec=opus` and send one raw Opus packet (no Ogg container)
+    per message, encoded at the sample rate and channels above. Opus is only
+    accepted if the server has `opuslib` and libopus installed; otherwise the
+    connection is rejected as an unsupported codec.
+
+    Audio may be sent in messages of any size; the server regroups it into the
+    chunk size its VAD and wake word engines expect (4096 bytes by default).
+    Smaller messages reduce latency, larger ones reduce per-message overhead.
 
     Response audio is WAV audio as raw bytes, with each message containing one
     full audio file. A client should queue all responses for playback.
 
+    A client that connects with `chunked_response=true` instead receives each
+    audio file as a sequence of chunks so playback can start before the whole
+    file arrives. Each chunk is a 9-byte big-endian header followed by the next
+    part of the WAV file (the first chunk includes the WAV header):
+        - response_id (uint32): same for all chunks of one audio file
+        - sequence (uint32): chunk index, starting at 0
+        - flags (uint8): 0x01 marks the last chunk of the file
+    Chunks are sent in order. A client that sees a gap in `sequence` should
+    discard the rest of that response.
+
     Any client accessing the stream endpoint (`/node/v1/stream`), must first
     establish a connection to the node endpoint (`/node/v1`).
     """
@@ -24,21 +24,26 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from starlette.responses import PlainTextResponse
 
-from neon_hana.app.dependencies import client_manager
+from neon_hana.app.dependencies import client_manager, node_bearer, mq_connector
 
 util_route = APIRouter(prefix="/util", tags=["utilities"])
 
 
 @util_route.get("/client_ip", response_class=PlainTextResponse)
 async def api_client_ip(request: Request) -> str:
-    client_manager.validate_auth("", request.client.host)
+    await client_manager.validate_auth_async("", request.client.host)
     return request.client.host
 
 
 @util_route.get("/headers")
 async def api_headers(request: Request):
-    client_manager.validate_auth("", request.client.host)
+    await client_manager.validate_auth_async("", request.client.host)
     return request.headers
+
+
+@util_route.get("/stats", dependencies=[Depends(node_bearer)])
+async def api_stats() -> dict:
+    return mq_connector.stats
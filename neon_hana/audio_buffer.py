@@ -0,0 +1,136 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Lock
+from typing import Optional
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity: int, frame_size: int = 2):
+        """
+        Fixed-capacity buffer of audio bytes, preallocated once. When a write
+        does not fit, the oldest unread audio is dropped. Reads return views
+        into the buffer without copying; a view is only valid until the next
+        read, so a reader that keeps audio must copy it.
+        @param capacity: Buffer size in bytes
+        @param frame_size: Bytes per audio frame; audio is dropped in whole
+            frames so that samples stay aligned
+        """
+        self.frame_size = frame_size
+        self.capacity = capacity - capacity % frame_size
+        self._buffer = bytearray(self.capacity)
+        self._view = memoryview(self._buffer)
+        self._scratch = bytearray()
+        self._read_pos = 0
+        self._unread = 0
+        self._held = 0
+        self._lock = Lock()
+        self.overruns = 0
+        self.dropped_bytes = 0
+
+    @property
+    def unread(self) -> int:
+        """
+        Number of bytes available to read.
+        """
+        return self._unread
+
+    @property
+    def stats(self) -> dict:
+        """
+        Buffer size, usage and counts of dropped audio.
+        """
+        return {"capacity": self.capacity, "buffered": self._unread,
+                "overruns": self.overruns,
+                "dropped_bytes": self.dropped_bytes}
+
+    def _round_up(self, num_bytes: int) -> int:
+        return -(-num_bytes // self.frame_size) * self.frame_size
+
+    def write(self, data: bytes) -> int:
+        """
+        Add audio to the buffer, dropping the oldest audio if it is full.
+        @param data: Audio bytes
+        @return: number of bytes of audio dropped
+        """
+        data = memoryview(data).cast("B")
+        with self._lock:
+            dropped = 0
+            # Never overwrite the region returned by the last read
+            space = self.capacity - self._held
+            if len(data) > space:
+                dropped = self._round_up(len(data) - space)
+                data = data[dropped:]
+            overflow = self._unread + len(data) - space
+            if overflow > 0:
+                overflow = min(self._round_up(overflow), self._unread)
+                self._read_pos = (self._read_pos + overflow) % self.capacity
+                self._unread -= overflow
+                dropped += overflow
+            write_pos = (self._read_pos + self._unread) % self.capacity
+            first = min(len(data), self.capacity - write_pos)
+            self._view[write_pos:write_pos + first] = data[:first]
+            self._view[:len(data) - first] = data[first:]
+            self._unread += len(data)
+            if dropped:
+                self.overruns += 1
+                self.dropped_bytes += dropped
+            return dropped
+
+    def read(self, size: int) -> Optional[memoryview]:
+        """
+        Read audio from the buffer without copying it.
+        @param size: Number of bytes to read
+        @return: view of `size` bytes valid until the next read, or None if
+            fewer than `size` bytes are buffered
+        """
+        with self._lock:
+            self._held = 0
+            if self._unread < size:
+                return None
+            start = self._read_pos
+            end = start + size
+            self._read_pos = end % self.capacity
+            self._unread -= size
+            if end <= self.capacity:
+                self._held = size
+                return self._view[start:end]
+            # Audio wraps around the end of the buffer and must be copied
+            if len(self._scratch) != size:
+                self._scratch = bytearray(size)
+            first = self.capacity - start
+            self._scratch[:first] = self._view[start:]
+            self._scratch[first:] = self._view[:size - first]
+            return memoryview(self._scratch)
+
+    def clear(self):
+        """
+        Drop all buffered audio.
+        """
+        with self._lock:
+            self._read_pos = 0
+            self._unread = 0
+            self._held = 0
@@ -0,0 +1,91 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import Optional, Protocol
+
+from ovos_utils import LOG
+
+
+def _opus_available() -> bool:
+    try:
+        import opuslib
+        return True
+    except Exception as e:
+        # opuslib raises a plain Exception if libopus is not installed
+        LOG.info(f"Opus stream audio is not supported: {e}")
+        return False
+
+
+SUPPORTED_CODECS = ("pcm", "opus") if _opus_available() else ("pcm",)
+
+
+class StreamDecoder(Protocol):
+    def decode(self, packet: bytes) -> bytes:
+        """
+        Decode one packet of compressed audio.
+        @param packet: Compressed audio packet
+        @return: 16-bit PCM audio
+        """
+
+
+class OpusDecoder:
+    # Longest Opus packet duration, in ms
+    max_packet_ms = 120
+
+    def __init__(self, sample_rate: int = 16000, channels: int = 1):
+        """
+        Decode a stream of raw Opus packets to PCM. Decoder state carries over
+        between packets, so each stream needs its own decoder.
+        @param sample_rate: Output sample rate
+        @param channels: Output channels
+        """
+        import opuslib
+        self._decoder = opuslib.Decoder(sample_rate, channels)
+        self._max_frames = sample_rate * self.max_packet_ms // 1000
+
+    def decode(self, packet: bytes) -> bytes:
+        """
+        Decode one Opus packet.
+        @param packet: Opus packet
+        @return: 16-bit PCM audio
+        """
+        return self._decoder.decode(bytes(packet), self._max_frames)
+
+
+def get_decoder(codec: str, sample_rate: int = 16000,
+                channels: int = 1) -> Optional[StreamDecoder]:
+    """
+    Get a decoder for stream audio.
+    @param codec: Codec negotiated with the client, one of `SUPPORTED_CODECS`
+    @param sample_rate: Output sample rate
+    @param channels: Output channels
+    @return: decoder, or None if audio is already PCM
+    """
+    if codec not in SUPPORTED_CODECS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    if codec == "opus":
+        return OpusDecoder(sample_rate, channels)
+    return None
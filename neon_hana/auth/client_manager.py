@@ -23,6 +23,8 @@
 # LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import asyncio
+
 from threading import Lock
 
 import jwt
@@ -37,11 +39,15 @@ from token_throttler import TokenThrottler, TokenBucket
 from token_throttler.storage import RuntimeStorage
 
 from neon_hana.auth.permissions import ClientPermissions
+from neon_hana.auth.rate_limit_storage import get_rate_limit_storage
 
 
 class ClientManager:
     def __init__(self, config: dict):
-        self.rate_limiter = TokenThrottler(cost=1, storage=RuntimeStorage())
+        storage = get_rate_limit_storage(config)
+        self.rate_limiter = TokenThrottler(cost=1, storage=storage)
+        # Rate limits stored outside of this process may wait on I/O
+        self._rate_limit_blocking = not isinstance(storage, RuntimeStorage)
 
         self.authorized_clients: Dict[str, dict] = dict()
         self._access_token_lifetime = config.get("access_token_ttl", 3600 * 24)
@@ -55,6 +61,19 @@ class ClientManager:
         self._node_username = config.get("node_username")
         self._node_password = config.get("node_password")
         self._max_streaming_clients = config.get("max_streaming_clients")
+        workers = config.get("server_workers", 1)
+        if isinstance(self._max_streaming_clients, int) and \
+                self._max_streaming_clients > 0 and workers > 1:
+            # Streams are processed by the worker that accepts them, so each
+            # worker takes an equal share of at least one stream
+            per_worker = max(self._max_streaming_clients // workers, 1)
+            if per_worker * workers != self._max_streaming_clients:
+                LOG.warning(f"max_streaming_clients="
+                            f"{self._max_streaming_clients} is not a "
+                            f"multiple of server_workers={workers}; "
+                            f"allowing {per_worker} streams per worker "
+                            f"({per_worker * workers} total)")
+            self._max_streaming_clients = per_worker
         self._jwt_algo = "HS256"
         self._connected_streams = 0
         self._stream_check_lock = Lock()
@@ -160,6 +179,20 @@ class ClientManager:
         self.authorized_clients[client_id] = auth
         return auth
 
+    async def check_auth_request_async(self, client_id: str, username: str,
+                                       password: Optional[str] = None,
+                                       origin_ip: str = "127.0.0.1") -> dict:
+        """
+        Same as `check_auth_request`, for use on the event loop. If rate
+        limits are shared between processes, the request is checked in a
+        thread so waiting on another process does not block the loop.
+        """
+        if self._rate_limit_blocking:
+            return await asyncio.to_thread(self.check_auth_request, client_id,
+                                           username, password, origin_ip)
+        return self.check_auth_request(client_id, username, password,
+                                       origin_ip)
+
     def check_refresh_request(self, access_token: str, refresh_token: str,
                               client_id: str):
         # Read and validate refresh token
@@ -223,10 +256,41 @@ class ClientManager:
         return False
 
 
+    async def validate_auth_async(self, token: str, origin_ip: str) -> bool:
+        """
+        Same as `validate_auth`, for use on the event loop. If rate limits
+        are shared between processes, the token is validated in a thread so
+        waiting on another process does not block the loop.
+        """
+        if self._rate_limit_blocking:
+            return await asyncio.to_thread(self.validate_auth, token,
+                                           origin_ip)
+        return self.validate_auth(token, origin_ip)
+
+
 class UserTokenAuth(HTTPBearer):
-    def __init__(self, client_manager: ClientManager):
+    def __init__(self, client_manager: ClientManager,
+                 permission: Optional[str] = None):
+        """
+        Validates the bearer token of a request.
+        @param client_manager: ClientManager to validate tokens with
+        @param permission: Optional `ClientPermissions` field the client
+            must have, i.e. `node`
+        """
         HTTPBearer.__init__(self)
         self.client_manager = client_manager
+        self.permission = permission
+
+    def _check_permission(self, token: str):
+        try:
+            client_id = self.client_manager.get_client_id(token)
+        except DecodeError:
+            client_id = None
+        permissions = self.client_manager.get_permissions(client_id)
+        if not getattr(permissions, self.permission):
+            raise HTTPException(status_code=401,
+                                detail=f"Client not authorized for "
+                                       f"{self.permission} access")
 
     async def __call__(self, request: Request):
         credentials: HTTPAuthorizationCredentials = \
@@ -235,10 +299,12 @@ class UserTokenAuth(HTTPBearer):
             if not credentials.scheme == "Bearer":
                 raise HTTPException(status_code=403,
                                     detail="Invalid authentication scheme.")
-            if not self.client_manager.validate_auth(credentials.credentials,
-                                                     request.client.host):
+            if not await self.client_manager.validate_auth_async(
+                    credentials.credentials, request.client.host):
                 raise HTTPException(status_code=403,
                                     detail="Invalid or expired token.")
+            if self.permission:
+                self._check_permission(credentials.credentials)
             return credentials.credentials
         else:
             raise HTTPException(status_code=403,
@@ -0,0 +1,203 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sqlite3
+
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Optional
+
+from ovos_utils import LOG
+from token_throttler import TokenBucket
+from token_throttler.storage import BucketStorage, RuntimeStorage
+
+from neon_hana.sqlite_utils import connect_sqlite, get_storage_backend
+
+
+class SQLiteStorage(BucketStorage):
+    # Number of requests between removing idle buckets
+    prune_interval = 256
+
+    def __init__(self, path: str, table: str = "rate_limits",
+                 timeout: float = 0.5):
+        """
+        Rate limit bucket storage in a SQLite database in WAL mode, shared by
+        worker processes on one host. Each bucket is consumed in a single
+        transaction, so limits hold across processes. If the database stays
+        locked by another process for `timeout` seconds, the request is
+        allowed rather than delayed further.
+        @param path: Path to the database file
+        @param table: Table to store buckets in
+        @param timeout: Seconds to wait for another process's write lock
+        """
+        BucketStorage.__init__(self)
+        self.path = path
+        self.table = table
+        self._lock = Lock()
+        self._requests = 0
+        self._db = connect_sqlite(path, timeout)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                         f"bucket_id TEXT PRIMARY KEY, "
+                         f"tokens INTEGER NOT NULL, "
+                         f"last_replenished REAL NOT NULL, "
+                         f"replenish_time REAL NOT NULL)")
+
+    @staticmethod
+    def _now() -> float:
+        return datetime.now(timezone.utc).timestamp()
+
+    @staticmethod
+    def _bucket_id(identifier: str, bucket_key: str) -> str:
+        return f"{identifier}:{bucket_key}"
+
+    def _load(self, bucket: TokenBucket, bucket_key: str):
+        row = self._db.execute(
+            f"SELECT tokens, last_replenished FROM {self.table} "
+            f"WHERE bucket_id = ?",
+            (self._bucket_id(bucket.identifier, bucket_key),)).fetchone()
+        if row:
+            bucket.tokens, bucket.last_replenished = row
+        else:
+            # Idle buckets are removed once they would be replenished
+            bucket.tokens = bucket.max_tokens
+            bucket.last_replenished = self._now()
+
+    def _save(self, bucket: TokenBucket, bucket_key: str):
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {self.table} "
+            f"(bucket_id, tokens, last_replenished, replenish_time) "
+            f"VALUES (?, ?, ?, ?)",
+            (self._bucket_id(bucket.identifier, bucket_key), bucket.tokens,
+             bucket.last_replenished, bucket.replenish_time))
+
+    def get_bucket(self, identifier: str,
+                   bucket_key: str) -> Optional[TokenBucket]:
+        bucket = self.buckets.get(identifier, {}).get(bucket_key)
+        if bucket:
+            with self._lock:
+                try:
+                    self._load(bucket, bucket_key)
+                except sqlite3.OperationalError as e:
+                    # Report the last known state of the bucket
+                    LOG.warning(f"Rate limit storage busy: {e}")
+        return bucket
+
+    def get_all_buckets(self,
+                        identifier: str) -> Optional[Dict[str, TokenBucket]]:
+        if not self.buckets.get(identifier):
+            return None
+        return {bucket_key: self.get_bucket(identifier, bucket_key)
+                for bucket_key in self.buckets[identifier]}
+
+    def add_bucket(self, bucket: TokenBucket):
+        bucket_key = str(bucket.replenish_time)
+        self.buckets[bucket.identifier][bucket_key] = bucket
+        with self._lock:
+            try:
+                # Keep the state of a bucket another process already added
+                self._db.execute(
+                    f"INSERT OR IGNORE INTO {self.table} "
+                    f"(bucket_id, tokens, last_replenished, replenish_time) "
+                    f"VALUES (?, ?, ?, ?)",
+                    (self._bucket_id(bucket.identifier, bucket_key),
+                     bucket.tokens, bucket.last_replenished,
+                     bucket.replenish_time))
+            except sqlite3.OperationalError as e:
+                # The bucket is stored when it is first consumed
+                LOG.warning(f"Rate limit storage busy: {e}")
+
+    def remove_bucket(self, identifier: str, bucket_key: str):
+        if identifier not in self.buckets:
+            return
+        self.buckets[identifier].pop(bucket_key, None)
+        if not self.buckets[identifier]:
+            del self.buckets[identifier]
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE bucket_id = ?",
+                             (self._bucket_id(identifier, bucket_key),))
+
+    def remove_all_buckets(self, identifier: str):
+        for bucket_key in list(self.buckets.get(identifier, {})):
+            self.remove_bucket(identifier, bucket_key)
+
+    def replenish(self, bucket: TokenBucket):
+        now = self._now()
+        if bucket.last_replenished <= now < \
+                bucket.last_replenished + bucket.replenish_time:
+            return
+        bucket.replenish()
+
+    def consume(self, identifier: str, bucket_key: str) -> bool:
+        bucket = self.buckets[identifier][bucket_key]
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                LOG.warning(f"Rate limit storage busy, allowing request: {e}")
+                return True
+            try:
+                self._load(bucket, bucket_key)
+                self.replenish(bucket)
+                consumed = bucket.consume()
+                self._save(bucket, bucket_key)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._requests += 1
+            if self._requests % self.prune_interval == 0:
+                try:
+                    self._db.execute(
+                        f"DELETE FROM {self.table} "
+                        f"WHERE last_replenished + replenish_time < ?",
+                        (self._now(),))
+                except sqlite3.OperationalError as e:
+                    LOG.warning(f"Rate limit storage busy: {e}")
+        return consumed
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def get_rate_limit_storage(config: dict) -> BucketStorage:
+    """
+    Get the rate limit storage configured by `rate_limit_backend`. Limits
+    are shared between worker processes by default when there are several.
+    @param config: HANA configuration
+    @return: BucketStorage
+    """
+    backend = get_storage_backend(config, "rate_limit_backend")
+    if backend == "memory":
+        return RuntimeStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(config.get("rate_limit_db_path",
+                                        "/tmp/hana/rate_limits.db"),
+                             timeout=config.get("rate_limit_db_timeout", 0.5))
+    raise ValueError(f"Unsupported rate limit backend: {backend}")
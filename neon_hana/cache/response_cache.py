@@ -0,0 +1,281 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from ovos_utils import LOG
+
+from neon_hana.cache.single_flight import SingleFlight
+
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def get_geohash(lat: float, lon: float, precision: int) -> str:
+    """
+    Encode coordinates as a geohash. Coordinates in the same geohash cell
+    share a key; each added character of precision shrinks the cell by a
+    factor of 32 (5 is ~4.9km, 6 is ~1.2km x 0.6km).
+    @param lat: Latitude in degrees
+    @param lon: Longitude in degrees
+    @param precision: Number of geohash characters
+    @return: geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = list()
+    bits = 0
+    num_bits = 0
+    even = True
+    while len(geohash) < precision:
+        value_range, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        num_bits += 1
+        if num_bits == 5:
+            geohash.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            num_bits = 0
+    return "".join(geohash)
+
+
+class CacheEntry:
+    def __init__(self, value: Any, ttl: float, size: int,
+                 exact_key: Optional[Hashable] = None, stale_ttl: float = 0):
+        """
+        A cached value that is fresh for `ttl` seconds and may be served
+        while it is refreshed for `stale_ttl` seconds after that.
+        """
+        self.value = value
+        self.ttl = ttl
+        self.size = size
+        self.exact_key = exact_key
+        self.expiration = monotonic() + ttl
+        self.stale_expiration = self.expiration + stale_ttl
+        self.hits = 0
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024,
+                 single_flight: Optional[SingleFlight] = None,
+                 refresh_ahead: float = 0, refresh_min_hits: int = 2):
+        """
+        In-memory cache of responses with per-entry TTLs. Once the total size
+        of cached entries exceeds `max_bytes`, the least recently used entries
+        are evicted.
+        @param max_bytes: Approximate memory budget for cached responses
+        @param single_flight: SingleFlight used to coalesce fetches of the
+            same key
+        @param refresh_ahead: Fraction of an entry's TTL remaining at which a
+            frequently used entry is refreshed in the background; 0 disables
+        @param refresh_min_hits: Number of hits within its TTL for an entry to
+            be refreshed ahead of expiration
+        """
+        self.max_bytes = max_bytes
+        self.refresh_ahead = refresh_ahead
+        self.refresh_min_hits = refresh_min_hits
+        self._single_flight = single_flight or SingleFlight()
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._refresh_tasks: Dict[Hashable, asyncio.Task] = dict()
+        self._bytes = 0
+        self._evictions = 0
+        self._counters: Dict[str, Dict[str, int]] = dict()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache size and per-namespace hit/miss counts.
+        """
+        return {"entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "refreshing": len(self._refresh_tasks),
+                "namespaces": {namespace: dict(counters) for
+                               namespace, counters in self._counters.items()}}
+
+    def _count(self, namespace: str, counter: str):
+        counters = self._counters.setdefault(namespace,
+                                             {"hits": 0, "misses": 0,
+                                              "approximate_hits": 0,
+                                              "stale_hits": 0,
+                                              "refreshes": 0,
+                                              "refresh_errors": 0})
+        counters[counter] += 1
+
+    def _get_entry(self, namespace: str, key: Hashable,
+                   exact_key: Optional[Hashable],
+                   allow_stale: bool) -> Optional[CacheEntry]:
+        cache_key = (namespace, key)
+        entry = self._entries.get(cache_key)
+        now = monotonic()
+        if entry and entry.stale_expiration < now:
+            self._remove(cache_key)
+            entry = None
+        if not entry or (entry.expiration < now and not allow_stale):
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        if exact_key is not None and exact_key != entry.exact_key:
+            self._count(namespace, "approximate_hits")
+        entry.hits += 1
+        self._entries.move_to_end(cache_key)
+        return entry
+
+    def get(self, namespace: str, key: Hashable,
+            exact_key: Optional[Hashable] = None) -> Optional[Any]:
+        """
+        Get an unexpired cached value.
+        @param namespace: Name to count hits and misses under
+        @param key: Hashable key of the cached value
+        @param exact_key: Optional key of the exact request if `key` is
+            approximate; hits from a different exact request are counted
+            as `approximate_hits`
+        @return: cached value, or None if not cached or expired
+        """
+        entry = self._get_entry(namespace, key, exact_key, False)
+        return entry.value if entry else None
+
+    async def fetch(self, namespace: str, key: Hashable,
+                    fetch: Callable[[], Awaitable[Tuple[Any, int]]],
+                    ttl: float, stale_ttl: float = 0,
+                    exact_key: Optional[Hashable] = None) -> Any:
+        """
+        Get a cached value, or fetch and cache it. Expired entries within
+        their `stale_ttl` are returned immediately and refreshed in the
+        background; only one fetch per key runs at a time.
+        @param namespace: Name to count hits and misses under
+        @param key: Hashable key of the cached value
+        @param fetch: Callable returning an awaitable (value, size in bytes)
+        @param ttl: Seconds a fetched value is fresh
+        @param stale_ttl: Seconds after `ttl` that a value may be served while
+            it is refreshed
+        @param exact_key: Optional key of the exact request if `key` is
+            approximate
+        @return: cached or fetched value
+        """
+        entry = self._get_entry(namespace, key, exact_key, True)
+        if not entry:
+            return await self._fetch(namespace, key, fetch, ttl, stale_ttl,
+                                     exact_key)
+        remaining = entry.expiration - monotonic()
+        if remaining < 0:
+            self._count(namespace, "stale_hits")
+            self._refresh(namespace, key, fetch, ttl, stale_ttl, exact_key)
+        elif self.refresh_ahead and entry.hits >= self.refresh_min_hits and \
+                remaining < entry.ttl * self.refresh_ahead:
+            self._refresh(namespace, key, fetch, ttl, stale_ttl, exact_key)
+        return entry.value
+
+    async def _fetch(self, namespace: str, key: Hashable,
+                     fetch: Callable[[], Awaitable[Tuple[Any, int]]],
+                     ttl: float, stale_ttl: float,
+                     exact_key: Optional[Hashable]) -> Any:
+        async def _fetch_and_cache():
+            value, size = await fetch()
+            self.put(namespace, key, value, ttl, size, exact_key, stale_ttl)
+            return value
+
+        return await self._single_flight.run(namespace, key,
+                                             _fetch_and_cache)
+
+    def _refresh(self, namespace: str, key: Hashable,
+                 fetch: Callable[[], Awaitable[Tuple[Any, int]]],
+                 ttl: float, stale_ttl: float, exact_key: Optional[Hashable]):
+        """
+        Start a background refresh of a cached value if one is not already
+        running.
+        """
+        cache_key = (namespace, key)
+        if cache_key in self._refresh_tasks:
+            return
+        self._count(namespace, "refreshes")
+
+        async def _refresh():
+            try:
+                await self._fetch(namespace, key, fetch, ttl, stale_ttl,
+                                  exact_key)
+            except Exception as e:
+                self._count(namespace, "refresh_errors")
+                LOG.warning(f"Failed to refresh {namespace} response: {e}")
+            finally:
+                self._refresh_tasks.pop(cache_key, None)
+
+        self._refresh_tasks[cache_key] = \
+            asyncio.get_running_loop().create_task(_refresh())
+
+    def put(self, namespace: str, key: Hashable, value: Any, ttl: float,
+            size: int, exact_key: Optional[Hashable] = None,
+            stale_ttl: float = 0):
+        """
+        Add a value to the cache, evicting least recently used entries if
+        the cache exceeds its memory budget.
+        @param namespace: Namespace of the cached value
+        @param key: Hashable key of the cached value
+        @param value: Value to cache
+        @param ttl: Seconds until the cached value expires
+        @param size: Approximate size of the value in bytes
+        @param exact_key: Optional key of the exact request if `key` is
+            approximate
+        @param stale_ttl: Seconds after `ttl` that the value may be served
+            while it is refreshed
+        """
+        if size > self.max_bytes:
+            LOG.debug(f"Not caching {size}B response for {namespace}")
+            return
+        key = (namespace, key)
+        self._remove(key)
+        self._entries[key] = CacheEntry(value, ttl, size, exact_key,
+                                        stale_ttl)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry.size
+
+    def clear(self):
+        """
+        Remove all cached entries and cancel any background refreshes.
+        """
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        self._refresh_tasks.clear()
+        self._entries.clear()
+        self._bytes = 0
@@ -0,0 +1,368 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import json
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, time
+from typing import Optional, Protocol, Tuple
+
+from neon_hana.sqlite_utils import connect_sqlite, get_storage_backend
+
+
+class SessionStore(Protocol):
+    @property
+    def stats(self) -> dict:
+        """
+        Store size and hit/miss/eviction counts.
+        """
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session and renew its TTL.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+
+    def put(self, session_id: str, session: dict):
+        """
+        Store a session.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+
+    async def aget(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session without blocking the event loop.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+
+    async def aput(self, session_id: str, session: dict):
+        """
+        Store a session without blocking the event loop.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+
+    def clear(self):
+        """
+        Remove all sessions.
+        """
+
+
+class MemorySessionStore:
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600):
+        """
+        In-memory store of serialized sessions by session ID. Sessions that
+        are not used for `ttl` seconds expire, and once there are more than
+        `max_entries` sessions the least recently used are evicted.
+        @param max_entries: Maximum number of sessions to keep
+        @param ttl: Seconds after its last use that a session expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Every access renews the TTL, so least recently used entries are
+        # also the first to expire
+        self._sessions: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+        # Sessions are read on the event loop and written from MQ threads
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Store size and hit/miss/eviction counts.
+        """
+        return {"entries": len(self._sessions),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "expirations": self._expirations,
+                "evictions": self._evictions}
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session_id, (expiration, _) = next(iter(self._sessions.items()))
+            if expiration >= now:
+                break
+            self._sessions.pop(session_id)
+            self._expirations += 1
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session and renew its TTL.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if not entry:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._sessions[session_id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def put(self, session_id: str, session: dict):
+        """
+        Store a session, evicting the least recently used sessions if the
+        store is full.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            self._sessions[session_id] = (now + self.ttl, session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self._evictions += 1
+
+    async def aget(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session and renew its TTL. Sessions are in memory, so this does
+        not block.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+        return self.get(session_id)
+
+    async def aput(self, session_id: str, session: dict):
+        """
+        Store a session. Sessions are in memory, so this does not block.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+        self.put(session_id, session)
+
+    def clear(self):
+        """
+        Remove all sessions.
+        """
+        with self._lock:
+            self._sessions.clear()
+
+
+class SQLiteSessionStore:
+    # Number of writes between removing expired and excess sessions
+    prune_interval = 64
+
+    def __init__(self, path: str, table: str = "sessions",
+                 max_entries: int = 10000, ttl: float = 3600,
+                 cache_ttl: float = 1):
+        """
+        Session store in a SQLite database in WAL mode, shared by worker
+        processes on one host. Reads are served from a local cache for up to
+        `cache_ttl` seconds, so a session updated by another process may be
+        read stale for that long. Writes go to the database immediately.
+        @param path: Path to the database file
+        @param table: Table to store sessions in
+        @param max_entries: Approximate maximum number of sessions to keep
+        @param ttl: Seconds after its last use that a session expires
+        @param cache_ttl: Seconds a session read from the database is cached
+        """
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._cache: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+        self._lock = Lock()
+        self._writes = 0
+        self._cache_hits = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._db = connect_sqlite(path)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                         f"session_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                         f"expiration REAL NOT NULL)")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expiration "
+                         f"ON {table} (expiration)")
+        self._entries = self._db.execute(
+            f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    @property
+    def stats(self) -> dict:
+        """
+        Store size and hit/miss/eviction counts.
+        """
+        # Stats are read on the event loop, so the database is not queried;
+        # `entries` is counted when the store is opened and pruned
+        return {"entries": self._entries,
+                "max_entries": self.max_entries,
+                "cached": len(self._cache),
+                "cache_hits": self._cache_hits,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions}
+
+    def _cache_put(self, session_id: str, session: dict):
+        self._cache[session_id] = (monotonic() + self.cache_ttl, session)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session and renew its TTL. The TTL is only renewed in the
+        database when the session is not cached locally.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached and cached[0] >= monotonic():
+                self._cache_hits += 1
+                return cached[1]
+            now = time()
+            row = self._db.execute(
+                f"SELECT data FROM {self.table} "
+                f"WHERE session_id = ? AND expiration >= ?",
+                (session_id, now)).fetchone()
+            if not row:
+                self._cache.pop(session_id, None)
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._db.execute(
+                f"UPDATE {self.table} SET expiration = ? "
+                f"WHERE session_id = ?", (now + self.ttl, session_id))
+            session = json.loads(row[0])
+            self._cache_put(session_id, session)
+            return session
+
+    def put(self, session_id: str, session: dict):
+        """
+        Store a session. Expired sessions and the least recently used
+        sessions over `max_entries` are removed periodically.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+        data = json.dumps(session)
+        with self._lock:
+            now = time()
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} "
+                f"(session_id, data, expiration) VALUES (?, ?, ?)",
+                (session_id, data, now + self.ttl))
+            self._cache_put(session_id, session)
+            self._writes += 1
+            if self._writes % self.prune_interval == 0:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        self._db.execute(f"DELETE FROM {self.table} WHERE expiration < ?",
+                         (now,))
+        # Expiration is renewed on use, so the earliest are least recently
+        # used
+        self._entries = self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE session_id IN ("
+                f"SELECT session_id FROM {self.table} "
+                f"ORDER BY expiration LIMIT ?)", (excess,))
+            self._evictions += excess
+            self._entries = self.max_entries
+
+    async def aget(self, session_id: str) -> Optional[dict]:
+        """
+        Get a session and renew its TTL. Sessions cached locally are returned
+        directly; database reads run in a thread.
+        @param session_id: Session ID to look up
+        @return: serialized session, or None if not stored or expired
+        """
+        # Only check the cache if no thread holds the lock for database I/O,
+        # so the event loop never waits on it
+        if self._lock.acquire(blocking=False):
+            try:
+                cached = self._cache.get(session_id)
+                if cached and cached[0] >= monotonic():
+                    self._cache_hits += 1
+                    return cached[1]
+            finally:
+                self._lock.release()
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aput(self, session_id: str, session: dict):
+        """
+        Store a session, writing to the database in a thread.
+        @param session_id: Session ID to store `session` under
+        @param session: Serialized session
+        """
+        await asyncio.to_thread(self.put, session_id, session)
+
+    def clear(self):
+        """
+        Remove all sessions.
+        """
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table}")
+            self._cache.clear()
+            self._entries = 0
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def get_session_store(config: dict, table: str = "sessions") -> SessionStore:
+    """
+    Get the session store configured by `session_backend`. Sessions are
+    shared between worker processes by default when there are several.
+    @param config: HANA configuration
+    @param table: Name of the store; stores with different names do not
+        share sessions
+    @return: SessionStore
+    """
+    backend = get_storage_backend(config, 'session_backend')
+    max_entries = config.get('session_max_entries', 10000)
+    ttl = config.get('session_ttl', 3600)
+    if backend == "memory":
+        return MemorySessionStore(max_entries, ttl)
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            config.get('session_db_path', "/tmp/hana/sessions.db"), table,
+            max_entries, ttl, config.get('session_cache_ttl', 1))
+    raise ValueError(f"Unsupported session backend: {backend}")
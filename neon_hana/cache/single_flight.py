@@ -0,0 +1,84 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Coalesces concurrent calls with the same key so that only one call is
+        made and every caller receives its result (or exception).
+        """
+        self._in_flight: Dict[Hashable, asyncio.Task] = dict()
+        self._counters: Dict[str, Dict[str, int]] = dict()
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Per-namespace counts of `calls` made and `coalesced` callers that
+        shared the result of an in-flight call.
+        """
+        return {namespace: dict(counters)
+                for namespace, counters in self._counters.items()}
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of calls currently in flight.
+        """
+        return len(self._in_flight)
+
+    async def run(self, namespace: str, key: Hashable,
+                  call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await `call`, or the result of an identical call already in flight.
+        @param namespace: Name to count calls under (i.e. a service name)
+        @param key: Hashable key identifying identical calls
+        @param call: Callable returning an awaitable to make the call
+        @return: result of the call
+        """
+        counters = self._counters.setdefault(namespace, {"calls": 0,
+                                                         "coalesced": 0})
+        key = (namespace, key)
+        if key in self._in_flight:
+            counters["coalesced"] += 1
+        else:
+            counters["calls"] += 1
+            task = asyncio.ensure_future(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        # Shield the shared task so one caller being cancelled does not cancel
+        # the call for every other caller
+        return await asyncio.shield(self._in_flight[key])
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception retrieved in case every caller was cancelled
+            task.exception()
@@ -0,0 +1,350 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import hashlib
+import sqlite3
+
+from collections import OrderedDict
+from os import listdir, makedirs, remove, replace, utime
+from os.path import getmtime, getsize, join
+from threading import Lock
+from time import time
+from typing import Optional, Tuple
+from uuid import uuid4
+
+from ovos_utils import LOG
+
+from neon_hana.cache.response_cache import ResponseCache
+from neon_hana.sqlite_utils import connect_sqlite, get_storage_backend
+
+
+class TTSCache:
+    def __init__(self, memory_max_bytes: int = 32 * 1024 * 1024,
+                 cache_dir: Optional[str] = None,
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        """
+        Two-tier cache of synthesized audio, keyed by a hash of the request.
+        Recently used audio is kept in memory and a larger set is kept on
+        disk; least recently used audio is evicted from each tier.
+        @param memory_max_bytes: Memory budget for cached audio
+        @param cache_dir: Directory to cache audio files in; None to disable
+            the disk tier
+        @param disk_max_bytes: Disk budget for cached audio
+        """
+        self._memory = ResponseCache(memory_max_bytes)
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_index: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if cache_dir:
+            self._load_disk_index()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Hit counts and size of each cache tier.
+        """
+        memory = self._memory.stats
+        entries, disk_bytes = self._get_disk_usage()
+        return {**self._counters,
+                "memory": {"entries": memory["entries"],
+                           "bytes": memory["bytes"],
+                           "max_bytes": memory["max_bytes"]},
+                "disk": {"entries": entries,
+                         "bytes": disk_bytes,
+                         "max_bytes": self.disk_max_bytes
+                         if self.cache_dir else 0}}
+
+    def _get_disk_usage(self) -> Tuple[int, int]:
+        return len(self._disk_index), self._disk_bytes
+
+    @staticmethod
+    def get_key(text: str, lang_code: str, gender: str) -> str:
+        """
+        Get a cache key for a TTS request. Whitespace is normalized so that
+        equivalent requests share a key.
+        @param text: Text to speak
+        @param lang_code: Language of the text
+        @param gender: Requested voice gender
+        @return: hex digest identifying the request
+        """
+        text = " ".join(text.split())
+        request = "\n".join((text, lang_code.lower(), gender.lower()))
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _load_disk_index(self):
+        """
+        Index audio already cached on disk, least recently used first.
+        """
+        makedirs(self.cache_dir, exist_ok=True)
+        files = [f for f in listdir(self.cache_dir) if f.endswith(".wav")]
+        files.sort(key=lambda f: getmtime(join(self.cache_dir, f)))
+        for file in files:
+            size = getsize(join(self.cache_dir, file))
+            self._disk_index[file[:-len(".wav")]] = size
+            self._disk_bytes += size
+        self._evict_disk()
+        LOG.info(f"Loaded {len(self._disk_index)} cached TTS files")
+
+    def _get_path(self, key: str) -> str:
+        return join(self.cache_dir, f"{key}.wav")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Get cached audio.
+        @param key: Cache key from `get_key`
+        @return: WAV audio bytes, or None if not cached
+        """
+        audio = self._memory.get("tts", key)
+        if audio is not None:
+            self._counters["memory_hits"] += 1
+            return audio
+        if self.cache_dir:
+            audio = await self._get_disk(key)
+            if audio is not None:
+                self._counters["disk_hits"] += 1
+                self._memory.put("tts", key, audio, float("inf"), len(audio))
+                return audio
+        self._counters["misses"] += 1
+        return None
+
+    async def put(self, key: str, audio: bytes):
+        """
+        Cache audio in memory and on disk.
+        @param key: Cache key from `get_key`
+        @param audio: WAV audio bytes
+        """
+        self._memory.put("tts", key, audio, float("inf"), len(audio))
+        if self.cache_dir and len(audio) <= self.disk_max_bytes:
+            await self._put_disk(key, audio)
+
+    async def _get_disk(self, key: str) -> Optional[bytes]:
+        if key not in self._disk_index:
+            return None
+        try:
+            audio = await asyncio.to_thread(self._read_file, key)
+        except OSError as e:
+            LOG.warning(f"Failed to read cached TTS: {e}")
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            return None
+        self._disk_index.move_to_end(key)
+        return audio
+
+    async def _put_disk(self, key: str, audio: bytes):
+        if key in self._disk_index:
+            return
+        try:
+            await asyncio.to_thread(self._write_file, key, audio)
+        except OSError as e:
+            LOG.warning(f"Failed to write cached TTS: {e}")
+            return
+        if key not in self._disk_index:
+            self._disk_index[key] = len(audio)
+            self._disk_bytes += len(audio)
+        self._evict_disk()
+
+    def _read_file(self, key: str) -> bytes:
+        path = self._get_path(key)
+        with open(path, "rb") as f:
+            audio = f.read()
+        # Update modification time to persist LRU order across restarts
+        utime(path)
+        return audio
+
+    def _write_file(self, key: str, audio: bytes):
+        # Write to a temporary file so readers never see a partial file
+        tmp_path = join(self.cache_dir, f".{uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        replace(tmp_path, self._get_path(key))
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                remove(self._get_path(key))
+            except OSError as e:
+                LOG.warning(f"Failed to remove cached TTS: {e}")
+
+
+class SharedTTSCache(TTSCache):
+    def __init__(self, memory_max_bytes: int = 32 * 1024 * 1024,
+                 cache_dir: str = "/tmp/hana/tts_cache",
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        """
+        TTS cache with a disk tier shared by worker processes on one host.
+        The disk index is kept in a SQLite database in `cache_dir`, so all
+        processes evict from one least recently used order and stay within
+        one disk budget. Each process keeps its own memory tier.
+        @param memory_max_bytes: Memory budget for cached audio
+        @param cache_dir: Directory to cache audio files in
+        @param disk_max_bytes: Disk budget for cached audio, shared by all
+            processes
+        """
+        self._lock = Lock()
+        self._db = None
+        self._disk_entries = 0
+        TTSCache.__init__(self, memory_max_bytes, cache_dir, disk_max_bytes)
+
+    def _get_disk_usage(self) -> Tuple[int, int]:
+        # Usage as of the last eviction check, to avoid a query per request
+        return self._disk_entries, self._disk_bytes
+
+    def _load_disk_index(self):
+        """
+        Open the shared index and add any audio on disk that is not indexed.
+        """
+        makedirs(self.cache_dir, exist_ok=True)
+        self._db = connect_sqlite(join(self.cache_dir, ".index.db"))
+        self._db.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                         "last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_last_used "
+                         "ON files (last_used)")
+        files = list()
+        for file in listdir(self.cache_dir):
+            if not file.endswith(".wav"):
+                continue
+            path = join(self.cache_dir, file)
+            try:
+                files.append((file[:-len(".wav")], getsize(path),
+                              getmtime(path)))
+            except OSError:
+                # Removed by another process
+                continue
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO files "
+                                 "(key, size, last_used) VALUES (?, ?, ?)",
+                                 files)
+            self._evict_disk()
+        LOG.info(f"Loaded {self._disk_entries} cached TTS files")
+
+    async def _get_disk(self, key: str) -> Optional[bytes]:
+        try:
+            return await asyncio.to_thread(self._read_indexed, key)
+        except sqlite3.Error as e:
+            LOG.warning(f"Failed to read TTS cache index: {e}")
+            return None
+
+    async def _put_disk(self, key: str, audio: bytes):
+        try:
+            await asyncio.to_thread(self._write_indexed, key, audio)
+        except sqlite3.Error as e:
+            LOG.warning(f"Failed to update TTS cache index: {e}")
+
+    def _read_indexed(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if not self._db.execute("SELECT 1 FROM files WHERE key = ?",
+                                    (key,)).fetchone():
+                return None
+        try:
+            audio = self._read_file(key)
+        except OSError as e:
+            # Evicted by another process after it was looked up
+            LOG.debug(f"Failed to read cached TTS: {e}")
+            with self._lock:
+                self._db.execute("DELETE FROM files WHERE key = ?", (key,))
+            return None
+        with self._lock:
+            self._db.execute("UPDATE files SET last_used = ? WHERE key = ?",
+                             (time(), key))
+        return audio
+
+    def _write_indexed(self, key: str, audio: bytes):
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM files WHERE key = ?",
+                                (key,)).fetchone():
+                return
+        try:
+            self._write_file(key, audio)
+        except OSError as e:
+            LOG.warning(f"Failed to write cached TTS: {e}")
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files "
+                             "(key, size, last_used) VALUES (?, ?, ?)",
+                             (key, len(audio), time()))
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Remove least recently used audio until all processes' audio fits in
+        `disk_max_bytes`. Must be called with `_lock` held.
+        """
+        evicted = list()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                "FROM files").fetchone()
+            if total > self.disk_max_bytes:
+                for key, size in self._db.execute(
+                        "SELECT key, size FROM files ORDER BY last_used"):
+                    if total <= self.disk_max_bytes:
+                        break
+                    evicted.append(key)
+                    total -= size
+                self._db.executemany("DELETE FROM files WHERE key = ?",
+                                     [(key,) for key in evicted])
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self._disk_entries = entries - len(evicted)
+        self._disk_bytes = total
+        for key in evicted:
+            try:
+                remove(self._get_path(key))
+            except OSError as e:
+                LOG.warning(f"Failed to remove cached TTS: {e}")
+
+    def close(self):
+        """
+        Close the index database connection.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def get_tts_cache(config: dict) -> TTSCache:
+    """
+    Get the TTS cache configured by `tts_cache_backend`. The disk tier is
+    shared between worker processes by default when there are several.
+    @param config: HANA configuration
+    @return: TTSCache
+    """
+    backend = get_storage_backend(config, 'tts_cache_backend')
+    memory_max_bytes = config.get('tts_cache_max_bytes', 32 * 1024 * 1024)
+    cache_dir = config.get('tts_cache_dir', "/tmp/hana/tts_cache")
+    disk_max_bytes = config.get('tts_cache_disk_max_bytes', 512 * 1024 * 1024)
+    if backend == "memory" or not cache_dir:
+        return TTSCache(memory_max_bytes, cache_dir, disk_max_bytes)
+    if backend == "sqlite":
+        return SharedTTSCache(memory_max_bytes, cache_dir, disk_max_bytes)
+    raise ValueError(f"Unsupported TTS cache backend: {backend}")
@@ -0,0 +1,192 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import Any, List
+
+import numpy as np
+
+from ovos_utils import LOG
+
+
+class PreciseLiteStreamState:
+    def __init__(self, n_features: int, n_mfcc: int, trigger: Any):
+        """
+        Detection state of one stream for a shared Precise Lite model.
+        @param n_features: MFCC frames in the model input
+        @param n_mfcc: MFCC coefficients per frame
+        @param trigger: Precise `TriggerDetector` for this stream
+        """
+        self.audio = b""
+        self.window_audio = np.array([], dtype=np.float32)
+        self.mfccs = np.zeros((n_features, n_mfcc), dtype=np.float32)
+        self.trigger = trigger
+
+
+class SharedPreciseLite:
+    def __init__(self, model: str, chunk_size: int = 2048,
+                 trigger_level: int = 3, sensitivity: float = 0.5):
+        """
+        Precise Lite wake word model shared by all streams. The plugin keeps
+        its audio window, MFCC features and trigger count in the engine and
+        runs a thread per instance; here that state is kept per stream in a
+        `PreciseLiteStreamState`, so one model serves every stream.
+        Predictions for all streams in a `detect_batch` call run in one model
+        invocation where the model accepts a batch. Callers must not run
+        `detect_batch` concurrently.
+        @param model: Path to the `.tflite` model
+        @param chunk_size: Bytes of audio per prediction
+        @param trigger_level: Predictions over the threshold needed to trigger
+        @param sensitivity: Detection sensitivity from 0.0 to 1.0
+        """
+        from precise_lite_runner.params import params
+        from precise_lite_runner.runner import TFLiteRunner
+        from precise_lite_runner.util import ThresholdDecoder
+        self.model = model
+        self.chunk_size = chunk_size
+        self.trigger_level = trigger_level
+        self.sensitivity = sensitivity
+        self._params = params
+        self._decoder = ThresholdDecoder(params.threshold_config,
+                                         params.threshold_center)
+        self._interpreter = TFLiteRunner(model).interpreter
+        self._input = self._interpreter.get_input_details()[0]["index"]
+        self._output = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = \
+            self._interpreter.get_input_details()[0]["shape"][0]
+        self.batched = True
+
+    @classmethod
+    def from_plugin(cls, plugin: Any) -> 'SharedPreciseLite':
+        """
+        Create a shared model with the configuration of a loaded plugin.
+        @param plugin: Loaded `PreciseLiteHotwordPlugin`
+        @return: SharedPreciseLite using the plugin's model
+        """
+        return cls(plugin.precise_model, plugin.chunk_size,
+                   plugin.trigger_level, plugin.sensitivity)
+
+    def new_stream_state(self) -> PreciseLiteStreamState:
+        """
+        Get detection state for a new stream.
+        """
+        from precise_lite_runner.runner import TriggerDetector
+        return PreciseLiteStreamState(
+            self._params.n_features, self._params.n_mfcc,
+            TriggerDetector(self.chunk_size, self.sensitivity,
+                            self.trigger_level))
+
+    def _update_features(self, state: PreciseLiteStreamState,
+                         chunk: bytes) -> np.ndarray:
+        from precise_lite_runner.vectorization import (add_deltas,
+                                                       vectorize_raw)
+        params = self._params
+        audio = np.frombuffer(chunk, dtype="<i2").astype(np.float32) / 32768
+        state.window_audio = np.concatenate((state.window_audio, audio))
+        if len(state.window_audio) >= params.window_samples:
+            features = vectorize_raw(state.window_audio)
+            state.window_audio = \
+                state.window_audio[len(features) * params.hop_samples:]
+            if len(features) > len(state.mfccs):
+                features = features[-len(state.mfccs):]
+            state.mfccs = np.concatenate((state.mfccs[len(features):],
+                                          features))
+        return add_deltas(state.mfccs) if params.use_delta else state.mfccs
+
+    def _invoke(self, inputs: np.ndarray) -> np.ndarray:
+        if len(inputs) != self._batch_size:
+            self._interpreter.resize_tensor_input(self._input,
+                                                  list(inputs.shape))
+            self._interpreter.allocate_tensors()
+            self._batch_size = len(inputs)
+        self._interpreter.set_tensor(self._input, inputs)
+        self._interpreter.invoke()
+        return self._interpreter.get_tensor(self._output)[:, 0].copy()
+
+    def _predict(self, inputs: List[np.ndarray]) -> List[float]:
+        inputs = np.stack(inputs).astype(np.float32)
+        if self.batched and len(inputs) > 1:
+            # Pad to a power of two so the model is rarely resized
+            size = 1 << (len(inputs) - 1).bit_length()
+            padded = np.zeros((size, *inputs.shape[1:]), dtype=np.float32)
+            padded[:len(inputs)] = inputs
+            try:
+                return self._invoke(padded)[:len(inputs)].tolist()
+            except Exception as e:
+                LOG.warning(f"Model does not support batches; predicting "
+                            f"one input at a time: {e}")
+                self.batched = False
+        return [float(self._invoke(features[np.newaxis])[0])
+                for features in inputs]
+
+    def detect_batch(self, states: List[PreciseLiteStreamState],
+                     chunks: List[bytes]) -> List[bool]:
+        """
+        Run wake word detection for one chunk from each of several streams.
+        @param states: Detection state of each stream
+        @param chunks: Audio chunk of each stream
+        @return: True for each stream where the wake word was detected
+        """
+        inputs = list()
+        owners = list()
+        for i, (state, chunk) in enumerate(zip(states, chunks)):
+            state.audio += chunk
+            while len(state.audio) >= self.chunk_size:
+                inputs.append(self._update_features(
+                    state, state.audio[:self.chunk_size]))
+                owners.append(i)
+                state.audio = state.audio[self.chunk_size:]
+        results = [False] * len(states)
+        if not inputs:
+            return results
+        # Predictions are applied in order so each stream triggers as the
+        # plugin would
+        for i, output in zip(owners, self._predict(inputs)):
+            if states[i].trigger.update(self._decoder.decode(output)):
+                results[i] = True
+        return results
+
+
+def get_shared_engine(engine: Any) -> Any:
+    """
+    Replace a hotword plugin engine with one that keeps state per stream, if
+    there is one for the plugin.
+    @param engine: Engine loaded by `HotwordContainer`
+    @return: shared engine, or `engine` if the plugin is not supported
+    """
+    if type(engine).__name__ != "PreciseLiteHotwordPlugin":
+        return engine
+    try:
+        shared = SharedPreciseLite.from_plugin(engine)
+    except Exception as e:
+        LOG.error(f"Failed to share Precise Lite model; streams will load "
+                  f"their own engines: {e}")
+        return engine
+    try:
+        # The plugin's own detection thread is no longer needed
+        engine.stop()
+    except Exception as e:
+        LOG.error(e)
+    return shared
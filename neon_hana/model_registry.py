@@ -0,0 +1,299 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Event, Lock, RLock
+from typing import Any, Dict, List, Optional, Protocol
+
+from ovos_dinkum_listener.voice_loop.hotwords import (HotwordContainer,
+                                                      HotwordState,
+                                                      HotWordException)
+from ovos_plugin_manager.vad import OVOSVADFactory
+from ovos_plugin_manager.wakewords import OVOSWakeWordFactory
+from ovos_utils import LOG
+from ovos_utils.fakebus import FakeBus
+
+from neon_hana.hotword_engines import get_shared_engine
+
+
+def supports_stream_state(engine: Any) -> bool:
+    """
+    Check if a hotword engine keeps detection state outside of the engine, so
+    one instance can serve many streams.
+    @param engine: Hotword engine to check
+    @return: True if the engine implements `new_stream_state` and
+        `detect_batch`
+    """
+    return hasattr(engine, "new_stream_state") and \
+        hasattr(engine, "detect_batch")
+
+
+class HotwordDetector(Protocol):
+    def detect(self, engines: List[Any], states: List[Any],
+               chunk: bytes) -> List[bool]:
+        """
+        Run wake word detection for one chunk of a stream's audio.
+        @param engines: Shared hotword engines to run
+        @param states: Per-stream state for each engine
+        @param chunk: Audio chunk
+        @return: detection result for each engine
+        """
+
+
+class StreamHotwords(HotwordContainer):
+    def __init__(self, plugins: Dict[str, dict], bus: FakeBus, lock: Lock,
+                 detector: Optional[HotwordDetector] = None):
+        """
+        Hotwords for one stream. Engines that support per-stream state are
+        shared with other streams and run with this stream's state; all other
+        engines are owned by this stream.
+        @param plugins: Hotword plugin data by wake word for this stream
+        @param bus: Bus of the stream using these hotwords
+        @param lock: Lock held while running shared engines
+        @param detector: Optional detector that runs shared engines for this
+            stream, i.e. in batches with other streams
+        """
+        HotwordContainer.__init__(self, bus, reload_allowed=False)
+        # Shadow the class-level engines so streams do not replace them
+        self._plugins = plugins
+        self._loaded = Event()
+        self._loaded.set()
+        self._engine_lock = lock
+        self._detector = detector
+        self._engine_states: Dict[str, Any] = dict()
+        self._detections: Dict[str, bool] = dict()
+        self._last_chunk = None
+
+    def load_hotword_engines(self):
+        """
+        Engines are loaded by `ModelRegistry`.
+        """
+
+    @property
+    def owned_engines(self) -> List[Any]:
+        """
+        Engines loaded for this stream only.
+        """
+        return [engine for engine in self.plugins
+                if not supports_stream_state(engine)]
+
+    def _get_active_engines(self) -> Dict[str, Any]:
+        if self.state == HotwordState.LISTEN:
+            return self.listen_words
+        if self.state == HotwordState.WAKEUP:
+            return self.wakeup_words
+        if self.state == HotwordState.RECORDING:
+            return self.stop_words
+        return self.hot_words
+
+    def _get_engine_state(self, word: str, engine: Any) -> Any:
+        if word not in self._engine_states:
+            self._engine_states[word] = engine.new_stream_state()
+        return self._engine_states[word]
+
+    def _detect(self, engines: Dict[str, Any], chunk: bytes):
+        words = list(engines)
+        states = [self._get_engine_state(word, engines[word])
+                  for word in words]
+        if self._detector:
+            results = self._detector.detect(
+                [engines[word] for word in words], states, chunk)
+        else:
+            results = list()
+            with self._engine_lock:
+                for word, state in zip(words, states):
+                    results.append(bool(engines[word].detect_batch(
+                        [state], [chunk])[0]))
+        self._detections = dict(zip(words, results))
+
+    def update(self, chunk: bytes):
+        engines = self._get_active_engines()
+        shared = {word: engine for word, engine in engines.items()
+                  if supports_stream_state(engine)}
+        for word, engine in engines.items():
+            if word in shared:
+                continue
+            try:
+                engine.update(chunk)
+            except Exception as e:
+                LOG.error(e)
+        # The voice loop updates hotwords more than once per chunk; only
+        # run shared engines once for each chunk and state
+        if not shared or (chunk is self._last_chunk and
+                          set(self._detections) == set(shared)):
+            return
+        self._last_chunk = chunk
+        try:
+            self._detect(shared, chunk)
+        except Exception as e:
+            LOG.error(f"Hotword detection failed: {e}")
+            self._detections = dict()
+
+    def found(self) -> Optional[str]:
+        engines = self._get_active_engines()
+        if self.state == HotwordState.LISTEN and not engines:
+            raise HotWordException("Waiting for listen_words but none are "
+                                   "available!")
+        for word, engine in engines.items():
+            try:
+                if supports_stream_state(engine):
+                    detected = self._detections.get(word)
+                else:
+                    detected = engine.found_wake_word()
+            except Exception as e:
+                LOG.error(e)
+                continue
+            if detected:
+                LOG.debug(f"Detected wake_word: {word}")
+                self._detections = dict()
+                return word
+        return None
+
+    def reset(self):
+        self._engine_states = dict()
+        self._detections = dict()
+        self._last_chunk = None
+        for engine in self.owned_engines:
+            try:
+                if hasattr(engine, "reset"):
+                    engine.reset()
+            except Exception as e:
+                LOG.error(e)
+
+    def shutdown(self):
+        """
+        Shut down engines owned by this stream; shared engines keep running.
+        """
+        for engine in self.owned_engines:
+            try:
+                engine.shutdown()
+            except Exception as e:
+                LOG.error(e)
+        self._plugins = dict()
+
+
+class ModelRegistry:
+    def __init__(self):
+        """
+        Process-wide registry of hotword and VAD engines. Hotword engines that
+        support per-stream state are loaded once and shared by all streams;
+        other engines are stateful and are loaded for each stream. Plugins
+        with a shared implementation in `hotword_engines`, i.e. Precise Lite,
+        are replaced with it when hotwords are loaded.
+        """
+        self._lock = RLock()
+        self._hotwords: Optional[Dict[str, dict]] = None
+        self._unclaimed: Dict[str, Any] = dict()
+        self.hotword_lock = Lock()
+        self._counters = {"hotword_loads": 0, "engine_loads": 0,
+                          "vad_loads": 0, "streams": 0}
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counts of engine loads and streams served.
+        """
+        return dict(self._counters)
+
+    def _load_hotwords(self) -> Dict[str, dict]:
+        with self._lock:
+            if self._hotwords is None:
+                container = HotwordContainer(FakeBus())
+                container.load_hotword_engines()
+                self._hotwords = {
+                    word: {**data, "engine": get_shared_engine(data["engine"])}
+                    for word, data in container._plugins.items()}
+                # Engines loaded here go to the first stream that needs them
+                self._unclaimed = {
+                    word: data["engine"]
+                    for word, data in self._hotwords.items()
+                    if not supports_stream_state(data["engine"])}
+                self._counters["hotword_loads"] += 1
+                LOG.info(f"Loaded hotwords: {list(self._hotwords)}")
+            self._counters["streams"] += 1
+            return self._hotwords
+
+    def _get_stream_engine(self, word: str, bus: FakeBus) -> Any:
+        with self._lock:
+            engine = self._unclaimed.pop(word, None)
+        if engine is None:
+            engine = OVOSWakeWordFactory.create_hotword(word)
+            if engine is None:
+                return None
+            with self._lock:
+                self._counters["engine_loads"] += 1
+        if hasattr(engine, "bind"):
+            engine.bind(bus)
+        return engine
+
+    def get_hotwords(self, bus: FakeBus,
+                     detector: Optional[HotwordDetector] = None) -> \
+            StreamHotwords:
+        """
+        Get hotwords for a new stream, loading engines if needed.
+        @param bus: Bus of the stream
+        @param detector: Optional detector to run shared engines for the
+            stream
+        @return: StreamHotwords for the stream
+        """
+        plugins = dict()
+        for word, data in self._load_hotwords().items():
+            if supports_stream_state(data["engine"]):
+                plugins[word] = data
+                continue
+            engine = self._get_stream_engine(word, bus)
+            if engine is None:
+                LOG.error(f"Failed to load hotword for stream: {word}")
+                continue
+            plugins[word] = {**data, "engine": engine}
+        return StreamHotwords(plugins, bus, self.hotword_lock, detector)
+
+    def get_vad(self) -> Any:
+        """
+        Get a VAD engine for a new stream. VAD engines may keep state between
+        chunks, so each stream gets its own instance.
+        @return: VAD engine
+        """
+        vad = OVOSVADFactory.create()
+        with self._lock:
+            self._counters["vad_loads"] += 1
+        return vad
+
+    @staticmethod
+    def release_vad(vad: Any):
+        """
+        Release a VAD engine from `get_vad` when its stream ends.
+        @param vad: VAD engine to release
+        """
+        try:
+            if hasattr(vad, "shutdown"):
+                vad.shutdown()
+            elif hasattr(vad, "stop"):
+                vad.stop()
+        except Exception as e:
+            LOG.error(e)
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,411 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import pika
+
+from typing import Optional, Dict, List, Set
+from uuid import uuid4
+from ovos_config.config import Configuration
+from ovos_utils import LOG
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.channel import Channel
+from neon_mq_connector.utils.client_utils import _default_mq_config
+from neon_mq_connector.utils.network_utils import b64_to_dict, dict_to_b64
+
+
+def get_message_id(message: dict) -> Optional[str]:
+    """
+    Get the `message_id` used to correlate an MQ response with its request.
+    The Messagebus connector generates a unique `message_id` for each response
+    message, so context is checked first before the top-level `message_id`.
+    @param message: Deserialized MQ message
+    @return: `message_id` of the original request, if specified
+    """
+    return message.get('context',
+                       message).get('mq', message).get('message_id')
+
+
+class PooledConnection:
+    def __init__(self, client: 'AsyncMQClient', vhost: str):
+        """
+        A persistent connection to a vhost with a long-lived channel, which is
+        re-established with backoff if it is lost. Responses to all requests
+        on this connection are received on one exclusive reply queue and
+        routed to the waiting request by `message_id`.
+        @param client: AsyncMQClient this connection belongs to
+        @param vhost: MQ vhost to connect to
+        """
+        self.client = client
+        self.vhost = vhost
+        self.connection: Optional[AsyncioConnection] = None
+        self.channel: Optional[Channel] = None
+        self.reply_queue: Optional[str] = None
+        self.reconnects = 0
+        self._pending: Dict[str, asyncio.Future] = dict()
+        self._declared_queues: Set[str] = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_healthy(self) -> bool:
+        """
+        True if the connection and channel are both open.
+        """
+        return all((self.connection, self.channel)) and \
+            self.connection.is_open and self.channel.is_open
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of requests currently awaiting a response on this connection.
+        """
+        return len(self._pending)
+
+    async def get_channel(self) -> Channel:
+        """
+        Get the open channel for this connection, reconnecting if necessary.
+        @return: open channel
+        """
+        if not self.is_healthy:
+            async with self._lock:
+                if not self.is_healthy:
+                    await self._reconnect()
+        return self.channel
+
+    async def _reconnect(self):
+        """
+        (Re-)open the connection and channel, retrying with exponential backoff
+        until `max_reconnect_attempts` is reached.
+        """
+        delay = self.client.reconnect_delay
+        attempt = 0
+        reconnecting = self.channel is not None
+        while True:
+            try:
+                if not (self.connection and self.connection.is_open):
+                    self.connection = await self.client._connect(
+                        self.vhost, on_close=self._on_connection_closed)
+                    # Exclusive queues are removed with their connection
+                    self.reply_queue = None
+                try:
+                    self.channel = await asyncio.wait_for(
+                        self.client._open_channel(self.connection), 10)
+                except asyncio.TimeoutError:
+                    raise ConnectionError(f"Timed out opening channel on "
+                                          f"{self.vhost}")
+                self.channel.add_on_close_callback(self._on_channel_closed)
+                self._declared_queues.clear()
+                self.reply_queue = await self.client._declare_queue(
+                    self.channel, self.reply_queue or '', exclusive=True)
+                self.channel.basic_consume(self.reply_queue, self._on_response,
+                                           auto_ack=True, exclusive=True)
+                if reconnecting:
+                    LOG.info(f"Reconnected to {self.vhost}")
+                    self.reconnects += 1
+                return
+            except ConnectionError as e:
+                attempt += 1
+                if attempt >= self.client.max_reconnect_attempts:
+                    raise e
+                LOG.warning(f"{e}. Retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.client.max_reconnect_delay)
+
+    def _on_connection_closed(self, _: AsyncioConnection, reason: Exception):
+        LOG.warning(f"Connection to {self.vhost} closed: {reason}")
+        self._fail_pending(ConnectionError(f"Connection closed: {reason}"))
+
+    def _on_channel_closed(self, _: Channel, reason: Exception):
+        LOG.warning(f"Channel on {self.vhost} closed: {reason}")
+        self._fail_pending(ConnectionError(f"Channel closed: {reason}"))
+
+    def _fail_pending(self, error: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _on_response(self, _: Channel, __, ___, body: bytes):
+        """
+        Resolve the pending request that a response on the reply queue
+        corresponds to.
+        """
+        api_output = b64_to_dict(body)
+        message_id = get_message_id(api_output)
+        response = self._pending.get(message_id)
+        if response and not response.done():
+            LOG.debug(f"MQ output: {message_id}")
+            response.set_result(api_output)
+        else:
+            # Request timed out or the response is otherwise unexpected
+            LOG.debug(f"Ignoring response to unknown request: {message_id}")
+
+    async def declare_queue(self, queue: str, **kwargs) -> str:
+        """
+        Declare a queue on this connection's channel. Named queues are only
+        declared once per channel.
+        @param queue: Name of the queue to declare; empty string to have the
+            server generate a name
+        @return: name of the declared queue
+        """
+        if queue and queue in self._declared_queues:
+            return queue
+        channel = await self.get_channel()
+        queue = await self.client._declare_queue(channel, queue, **kwargs)
+        self._declared_queues.add(queue)
+        return queue
+
+    async def request(self, request_data: dict, target_queue: str,
+                      expect_response: bool) -> dict:
+        """
+        Publish a request on this connection and await the response.
+        """
+        message_id = request_data['message_id']
+        channel = await self.get_channel()
+        if not expect_response:
+            await self.declare_queue(target_queue, auto_delete=False)
+            self._publish(channel, request_data, target_queue)
+            return dict()
+        if message_id in self._pending:
+            raise ValueError(f"Request already pending for: {message_id}")
+        response = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = response
+        try:
+            request_data['routing_key'] = self.reply_queue
+            await self.declare_queue(target_queue, auto_delete=False)
+            self._publish(channel, request_data, target_queue)
+            return await response
+        finally:
+            self._pending.pop(message_id, None)
+
+    @staticmethod
+    def _publish(channel: Channel, request_data: dict, target_queue: str):
+        channel.basic_publish(exchange='', routing_key=target_queue,
+                              body=dict_to_b64(request_data),
+                              properties=pika.BasicProperties(
+                                  expiration="1000"))
+        LOG.debug(f"Sent request with keys: {request_data.keys()}")
+
+    def close(self):
+        """
+        Close this connection and fail any pending requests.
+        """
+        self._fail_pending(ConnectionError("Connection shutdown"))
+        if self.connection and self.connection.is_open:
+            self.connection.close()
+
+
+class AsyncMQClient:
+    def __init__(self, mq_config: Optional[dict] = None, pool_size: int = 2,
+                 reconnect_delay: float = 1, max_reconnect_delay: float = 30,
+                 max_reconnect_attempts: int = 5,
+                 health_check_interval: float = 30):
+        """
+        Creates an asyncio-native client for MQ requests. A pool of persistent
+        connections is kept for each vhost, so requests do not pay connection
+        setup and awaiting a response never blocks the event loop.
+        @param mq_config: MQ configuration; read from global configuration
+            if not specified
+        @param pool_size: Number of connections to keep open per vhost
+        @param reconnect_delay: Initial seconds to wait between reconnects
+        @param max_reconnect_delay: Max seconds to wait between reconnects
+        @param max_reconnect_attempts: Number of attempts to connect before
+            failing a request
+        @param health_check_interval: Seconds between background checks that
+            re-open any lost connections; 0 to disable
+        """
+        self._mq_config = mq_config
+        self.pool_size = max(pool_size, 1)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_reconnect_attempts = max(max_reconnect_attempts, 1)
+        self.health_check_interval = health_check_interval
+        self._pools: Dict[str, List[PooledConnection]] = dict()
+        self._health_check_task: Optional[asyncio.Task] = None
+
+    @property
+    def mq_config(self) -> dict:
+        """
+        MQ server and credential configuration used for new connections.
+        """
+        if not self._mq_config:
+            self._mq_config = Configuration().get('MQ') or _default_mq_config
+        if not self._mq_config.get('users', {}).get('mq_handler'):
+            LOG.warning("mq_handler not configured, using default credentials")
+            self._mq_config.setdefault('users', dict())
+            self._mq_config['users']['mq_handler'] = \
+                _default_mq_config['users']['mq_handler']
+        return self._mq_config
+
+    @property
+    def stats(self) -> dict:
+        """
+        Connection pool status for each vhost.
+        """
+        return {vhost: {"connections": len(pool),
+                        "healthy": len([c for c in pool if c.is_healthy]),
+                        "in_flight": sum(c.in_flight for c in pool),
+                        "reconnects": sum(c.reconnects for c in pool)}
+                for vhost, pool in self._pools.items()}
+
+    def _get_connection_params(self, vhost: str) -> pika.ConnectionParameters:
+        config = self.mq_config
+        user = config['users']['mq_handler']
+        return pika.ConnectionParameters(
+            host=config.get('server', 'localhost'),
+            port=int(config.get('port', 5672)),
+            virtual_host=vhost,
+            credentials=pika.PlainCredentials(user['user'], user['password']))
+
+    def _get_connection(self, vhost: str) -> PooledConnection:
+        """
+        Get the least busy connection to the specified vhost, preferring
+        connections that are already open.
+        @param vhost: MQ vhost to get a connection for
+        @return: PooledConnection to send a request on
+        """
+        if vhost not in self._pools:
+            self._pools[vhost] = [PooledConnection(self, vhost)
+                                  for _ in range(self.pool_size)]
+        if self.health_check_interval and not self._health_check_task:
+            self._health_check_task = asyncio.get_running_loop().create_task(
+                self._check_health())
+        return min(self._pools[vhost],
+                   key=lambda c: (not c.is_healthy, c.in_flight))
+
+    async def _check_health(self):
+        """
+        Periodically re-open lost connections so that reconnects happen in
+        the background instead of on the request path.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for pool in self._pools.values():
+                for connection in pool:
+                    if connection.connection and not connection.is_healthy:
+                        try:
+                            await connection.get_channel()
+                        except ConnectionError as e:
+                            LOG.error(f"Health check failed: {e}")
+
+    async def _connect(self, vhost: str,
+                       on_close: Optional[callable] = None) -> \
+            AsyncioConnection:
+        """
+        Open a new connection to the specified vhost on the running loop.
+        @param vhost: MQ vhost to connect to
+        @param on_close: Optional callback when an open connection is closed
+        @return: open connection
+        """
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+
+        def _on_open(connection: AsyncioConnection):
+            if not opened.done():
+                opened.set_result(connection)
+
+        def _on_error(_: AsyncioConnection, error: BaseException):
+            if not opened.done():
+                opened.set_exception(
+                    ConnectionError(f"Failed to connect to {vhost}: {error}"))
+
+        def _on_close(connection: AsyncioConnection, reason: BaseException):
+            if not opened.done():
+                _on_error(connection, reason)
+            elif on_close:
+                on_close(connection, reason)
+
+        AsyncioConnection(self._get_connection_params(vhost),
+                          on_open_callback=_on_open,
+                          on_open_error_callback=_on_error,
+                          on_close_callback=_on_close,
+                          custom_ioloop=loop)
+        return await opened
+
+    @staticmethod
+    async def _open_channel(connection: AsyncioConnection) -> Channel:
+        """
+        Open a new channel on the specified connection.
+        @param connection: Open connection to create a channel on
+        @return: open channel
+        """
+        opened = asyncio.get_running_loop().create_future()
+        connection.channel(on_open_callback=opened.set_result)
+        return await opened
+
+    @staticmethod
+    async def _declare_queue(channel: Channel, queue: str = '',
+                             **kwargs) -> str:
+        """
+        Declare a queue on the specified channel.
+        @param channel: Open channel to declare the queue on
+        @param queue: Name of the queue to declare; empty string to have the
+            server generate a name
+        @return: name of the declared queue
+        """
+        declared = asyncio.get_running_loop().create_future()
+        channel.queue_declare(queue, callback=declared.set_result, **kwargs)
+        frame = await declared
+        return frame.method.queue
+
+    async def request(self, vhost: str, request_data: dict, target_queue: str,
+                      timeout: int = 30, expect_response: bool = True) -> dict:
+        """
+        Send a request to an MQ service and asynchronously wait for the
+        response. This mirrors `send_mq_request` without blocking the loop.
+        @param vhost: vhost to target
+        @param request_data: data to post to target_queue
+        @param target_queue: queue to post request to
+        @param timeout: time in seconds to wait for a response
+        @param expect_response: if False, return immediately after publishing
+        @return: response to request (empty if no response is expected)
+        """
+        # Copy request data to prevent modifying the input object
+        request_data = dict(request_data)
+        request_data['message_id'] = request_data.get('message_id') or \
+            request_data.get('context', {}).get('mq', {}).get('message_id') \
+            or uuid4().hex
+        connection = self._get_connection(vhost)
+        try:
+            return await asyncio.wait_for(
+                connection.request(request_data, target_queue,
+                                   expect_response), timeout)
+        except asyncio.TimeoutError:
+            LOG.error(f"Timeout waiting for response to: "
+                      f"{request_data['message_id']} from {target_queue}")
+            raise TimeoutError(f"No response from {target_queue} in "
+                               f"{timeout}s")
+
+    async def shutdown(self):
+        """
+        Stop health checks and close all pooled connections.
+        """
+        if self._health_check_task:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+        for pool in self._pools.values():
+            for connection in pool:
+                connection.close()
+        self._pools = dict()
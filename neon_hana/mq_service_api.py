@@ -26,14 +26,19 @@
 
 import json
 
+from base64 import b64decode, b64encode
 from time import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from uuid import uuid4
 from fastapi import HTTPException
 
+from neon_hana.cache.response_cache import ResponseCache, get_geohash
+from neon_hana.cache.session_store import get_session_store
+from neon_hana.cache.single_flight import SingleFlight
+from neon_hana.cache.tts_cache import TTSCache, get_tts_cache
+from neon_hana.mq_client import AsyncMQClient
 from neon_hana.schema.node_model import NodeData
 from neon_hana.schema.user_profile import UserProfile
-from neon_mq_connector.utils.client_utils import send_mq_request
 
 
 class APIError(HTTPException):
@@ -43,13 +48,41 @@ class APIError(HTTPException):
 
 
 class MQServiceManager:
+    # Default seconds to cache API proxy responses, by `service` or
+    # `service.api`. Wolfram|Alpha answers may be time-sensitive
+    _default_api_cache_ttl = {"open_weather_map": 600,
+                              "alpha_vantage.quote": 30,
+                              "alpha_vantage.symbol": 86400,
+                              "map_maker": 604800,
+                              "wolfram_alpha": 0}
+
     def __init__(self, config: dict):
         self.mq_default_timeout = config.get('mq_default_timeout', 10)
         self.mq_cliend_id = config.get('mq_client_id') or str(uuid4())
         self.stt_max_length = config.get('stt_max_length_encoded') or 500000
         self.tts_max_words = config.get('tts_max_words') or 128
         self.email_enabled = config.get('enable_email')
-        self.sessions_by_id = dict()
+        self.sessions_by_id = get_session_store(config)
+        self._mq_client = AsyncMQClient(
+            config.get('MQ'), pool_size=config.get('mq_pool_size', 2),
+            reconnect_delay=config.get('mq_reconnect_delay', 1),
+            max_reconnect_delay=config.get('mq_max_reconnect_delay', 30),
+            health_check_interval=config.get('mq_health_check_interval', 30))
+        self._single_flight = SingleFlight()
+        self._api_cache = ResponseCache(
+            config.get('api_cache_max_bytes', 16 * 1024 * 1024),
+            self._single_flight,
+            refresh_ahead=config.get('api_cache_refresh_ahead', 0.1),
+            refresh_min_hits=config.get('api_cache_refresh_min_hits', 2))
+        self._api_cache_ttl = {**self._default_api_cache_ttl,
+                               **(config.get('api_cache_ttl') or dict())}
+        # By default, allow serving a response for up to twice its TTL
+        self._api_cache_stale_ttl = {
+            **self._api_cache_ttl,
+            **(config.get('api_cache_stale_ttl') or dict())}
+        self._tts_cache = get_tts_cache(config)
+        self.weather_geohash_precision = \
+            config.get('weather_cache_geohash_precision', 6)
 
     @staticmethod
     def _validate_api_proxy_response(response: dict, query_params: dict):
@@ -77,83 +110,171 @@ class MQServiceManager:
         code = response['status_code'] if response['status_code'] > 200 else 500
         raise APIError(status_code=code, detail=response['content'])
 
-    def get_session(self, node_data: NodeData) -> dict:
+    @property
+    def stats(self) -> dict:
+        """
+        MQ connection, request coalescing, and cache statistics.
+        """
+        return {"mq_connections": self._mq_client.stats,
+                "coalesced_requests": self._single_flight.stats,
+                "api_cache": self._api_cache.stats,
+                "tts_cache": self._tts_cache.stats,
+                "sessions": self.sessions_by_id.stats}
+
+    async def shutdown(self):
+        """
+        Close persistent MQ connections.
+        """
+        self._api_cache.clear()
+        await self._mq_client.shutdown()
+
+    async def _request(self, vhost: str, request_data: dict,
+                       target_queue: str, timeout: int = 30,
+                       expect_response: bool = True) -> dict:
+        """
+        Send a request to an MQ service, raising an `APIError` if the service
+        does not respond or MQ is unavailable.
+        @param vhost: vhost to target
+        @param request_data: data to post to target_queue
+        @param target_queue: queue to post request to
+        @param timeout: time in seconds to wait for a response
+        @param expect_response: if False, return immediately after publishing
+        @return: response to request (empty if no response is expected)
+        """
+        try:
+            return await self._mq_client.request(
+                vhost, request_data, target_queue,
+                timeout=timeout,
+                expect_response=expect_response)
+        except TimeoutError as e:
+            raise APIError(status_code=504, detail=repr(e))
+        except ConnectionError as e:
+            raise APIError(status_code=503, detail=repr(e))
+
+    @staticmethod
+    def _get_api_cache_key(query_params: dict,
+                           geohash_precision: Optional[int] = None) -> str:
+        """
+        Build a cache key for API proxy query params. Aliased params are
+        normalized so equivalent queries share a key.
+        @param query_params: API proxy query params
+        @param geohash_precision: If set, replace `lat` and `lon` with a
+            geohash of this precision so nearby queries share a key
+        @return: string cache key
+        """
+        aliases = {"unit": "units", "lang_code": "lang"}
+        params = {aliases.get(key, key): value for key, value in
+                  query_params.items() if value is not None}
+        if geohash_precision and "lat" in params and "lon" in params:
+            params["geohash"] = get_geohash(float(params.pop("lat")),
+                                            float(params.pop("lon")),
+                                            geohash_precision)
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def _get_api_cache_ttl(self, query_params: dict) -> Tuple[float, float]:
+        """
+        Get the configured cache TTLs for API proxy query params.
+        @param query_params: API proxy query params, including `service`
+        @return: seconds to cache a response (0 to not cache), and seconds
+            after that to serve a stale response while it is refreshed
+        """
+        service = query_params['service']
+        api = query_params.get('api')
+        ttl = self._api_cache_ttl.get(f"{service}.{api}",
+                                      self._api_cache_ttl.get(service))
+        stale_ttl = self._api_cache_stale_ttl.get(
+            f"{service}.{api}", self._api_cache_stale_ttl.get(service))
+        return ttl or 0, stale_ttl or 0
+
+    async def get_session(self, node_data: NodeData) -> dict:
         """
         Get a serialized Session object for the specified Node.
         @param node_data: NodeData received from client
         @returns: Serialized session, possibly cached from previous a response
         """
         session_id = node_data.device_id
-        self.sessions_by_id.setdefault(session_id,
-                                       {"session_id": session_id,
-                                        "site_id": node_data.location.site_id})
-        return self.sessions_by_id[session_id]
+        session = await self.sessions_by_id.aget(session_id)
+        if not session:
+            session = {"session_id": session_id,
+                       "site_id": node_data.location.site_id}
+            await self.sessions_by_id.aput(session_id, session)
+        return session
 
-    def query_api_proxy(self, service_name: str, query_params: dict,
-                        timeout: int = 10):
+    async def query_api_proxy(self, service_name: str, query_params: dict,
+                              timeout: int = 10):
         query_params['service'] = service_name
         if service_name in ("open_weather_map", "wolfram_alpha"):
             query_params['units'] = query_params.pop('unit',
                                                      query_params.get('units'))
-        response = send_mq_request("/neon_api", query_params, "neon_api_input",
-                                   "neon_api_output", timeout)
-        return self._validate_api_proxy_response(response, query_params)
-
-    def query_llm(self, llm_name: str, query: str, history: List[tuple]):
-        response = send_mq_request("/llm", {"query": query,
-                                            "history": history},
-                                   f"{llm_name}_input",
-                                   response_queue=f"{llm_name}_"
-                                                  f"{self.mq_cliend_id}")
+        exact_key = self._get_api_cache_key(query_params)
+        cache_key = exact_key
+        if service_name == "open_weather_map":
+            # Nearby weather queries share a cached response
+            cache_key = self._get_api_cache_key(query_params,
+                                                self.weather_geohash_precision)
+        ttl, stale_ttl = self._get_api_cache_ttl(query_params)
+
+        async def _query() -> Tuple[dict, int]:
+            response = await self._request("/neon_api", query_params,
+                                           "neon_api_input", timeout)
+            resp = self._validate_api_proxy_response(response, query_params)
+            return resp, len(response['content'])
+
+        if ttl > 0:
+            return await self._api_cache.fetch(service_name, cache_key, _query,
+                                               ttl, stale_ttl, exact_key)
+        # Identical concurrent queries share one request
+        resp, _ = await self._single_flight.run(service_name, cache_key,
+                                                _query)
+        return resp
+
+    async def query_llm(self, llm_name: str, query: str, history: List[tuple]):
+        response = await self._request(
+            "/llm", {"query": query, "history": history}, f"{llm_name}_input")
         response = response.get('response') or ""
         history.append(("user", query))
         history.append(("llm", response))
         return {"response": response,
                 "history": history}
 
-    def send_email(self, recipient: str, subject: str, body: str,
-                   attachments: Optional[Dict[str, str]]):
+    async def send_email(self, recipient: str, subject: str, body: str,
+                         attachments: Optional[Dict[str, str]]):
         if not self.email_enabled:
             raise APIError(status_code=503, detail="Email service disabled")
         request_data = {"recipient": recipient,
                         "subject": subject,
                         "body": body,
                         "attachments": attachments}
-        response = send_mq_request("/neon_emails", request_data,
-                                   "neon_emails_input")
+        response = await self._request("/neon_emails", request_data,
+                                       "neon_emails_input")
         if not response.get("success"):
             error = response.get("error") or "Email failed to send"
             raise APIError(status_code=500, detail=error)
 
-    def upload_metric(self, metric_name: str, timestamp: str,
-                      metric_data: Dict[str, Any]):
+    async def upload_metric(self, metric_name: str, timestamp: str,
+                            metric_data: Dict[str, Any]):
         metric_data = {**{"name": metric_name, "timestamp": timestamp},
                        **metric_data}
-        send_mq_request("/neon_metrics", metric_data, "neon_metrics_input",
-                        expect_response=False)
+        await self._request("/neon_metrics", metric_data,
+                            "neon_metrics_input", expect_response=False)
 
-    def parse_ccl_script(self, script: str, metadata: Dict[str, Any]):
-        try:
-            response = send_mq_request("/neon_script_parser",
-                                       {"text": script, "metadata": metadata},
-                                       "neon_script_parser_input",
-                                       "neon_script_parser_output",
-                                       self.mq_default_timeout)
-            return {"ncs": response['parsed_file']}
-        except TimeoutError as e:
-            raise APIError(status_code=500, detail=repr(e))
+    async def parse_ccl_script(self, script: str, metadata: Dict[str, Any]):
+        response = await self._single_flight.run(
+            "ccl_parser",
+            (script, json.dumps(metadata, sort_keys=True, default=str)),
+            lambda: self._request("/neon_script_parser",
+                                  {"text": script, "metadata": metadata},
+                                  "neon_script_parser_input",
+                                  self.mq_default_timeout))
+        return {"ncs": response['parsed_file']}
 
-    def get_coupons(self):
-        try:
-            response = send_mq_request("/neon_coupons", {},
-                                       "neon_coupons_input",
-                                       "neon_coupons_output",
-                                       self.mq_default_timeout)
-            return response
-        except TimeoutError as e:
-            raise APIError(status_code=500, detail=repr(e))
+    async def get_coupons(self):
+        return await self._single_flight.run(
+            "coupons", None,
+            lambda: self._request("/neon_coupons", {}, "neon_coupons_input",
+                                  self.mq_default_timeout))
 
-    def get_stt(self, encoded_audio: str, lang_code: str):
+    async def get_stt(self, encoded_audio: str, lang_code: str):
         if 0 < self.stt_max_length < len(encoded_audio):
             raise APIError(status_code=400,
                            detail=f"Audio exceeds maximum encoded length of "
@@ -165,34 +286,73 @@ class MQServiceManager:
                                     "context": {"source": "hana",
                                                 "ident": f"{self.mq_cliend_id}"
                                                          f"{time()}"}}
-        response = send_mq_request("/neon_chat_api", request_data,
-                                   "neon_chat_api_request",
-                                   timeout=self.mq_default_timeout)
+        response = await self._request("/neon_chat_api", request_data,
+                                       "neon_chat_api_request",
+                                       self.mq_default_timeout)
         return response['data']
 
-    def get_tts(self, to_speak: str, lang_code: str, gender: str):
+    @property
+    def stt_max_bytes(self) -> int:
+        """
+        Maximum size of raw STT audio, equivalent to the maximum encoded
+        length. A value less than 1 means there is no limit.
+        """
+        return self.stt_max_length * 3 // 4
+
+    async def get_stt_audio(self, audio: bytes, lang_code: str):
+        """
+        Get STT for raw audio bytes.
+        @param audio: WAV audio bytes
+        @param lang_code: Language of the audio
+        @return: STT response data
+        """
+        return await self.get_stt(b64encode(audio).decode("utf-8"), lang_code)
+
+    async def get_tts(self, to_speak: str, lang_code: str, gender: str):
+        audio = await self.get_tts_audio(to_speak, lang_code, gender)
+        return {"encoded_audio": b64encode(audio).decode("utf-8")}
+
+    async def get_tts_audio(self, to_speak: str, lang_code: str,
+                            gender: str) -> bytes:
+        """
+        Get WAV audio for the requested text, from cache if available.
+        @param to_speak: Text to synthesize
+        @param lang_code: Language of the text
+        @param gender: Requested voice gender
+        @return: WAV audio bytes
+        """
         if 0 < self.tts_max_words < len(to_speak.split()):
             raise APIError(status_code=400,
                            detail=f"Text exceeds maximum word count of "
                                   f"{self.tts_max_words}")
-        request_data = {"msg_type": "neon.get_tts",
-                        "data": {"text": to_speak,
-                                 "utterance": "",  # TODO: Compat
-                                 "speaker": {"name": "Neon",
-                                             "gender": gender,
-                                             "lang": lang_code},
-                                 "lang": lang_code},
-                        "context": {"source": "hana",
-                                    "ident": f"{self.mq_cliend_id}{time()}"}}
-        response = send_mq_request("/neon_chat_api", request_data,
-                                   "neon_chat_api_request",
-                                   timeout=self.mq_default_timeout)
-        audio = response['data'][lang_code]['audio'][gender]
-        return {"encoded_audio": audio}
-
-    def get_response(self, utterance: str, lang_code: str,
-                     user_profile: UserProfile, node_data: NodeData):
-        session = self.get_session(node_data)
+        cache_key = TTSCache.get_key(to_speak, lang_code, gender)
+        audio = await self._tts_cache.get(cache_key)
+        if audio is not None:
+            return audio
+
+        async def _synthesize() -> bytes:
+            request_data = {"msg_type": "neon.get_tts",
+                            "data": {"text": to_speak,
+                                     "utterance": "",  # TODO: Compat
+                                     "speaker": {"name": "Neon",
+                                                 "gender": gender,
+                                                 "lang": lang_code},
+                                     "lang": lang_code},
+                            "context": {"source": "hana",
+                                        "ident": f"{self.mq_cliend_id}"
+                                                 f"{time()}"}}
+            response = await self._request("/neon_chat_api", request_data,
+                                           "neon_chat_api_request",
+                                           self.mq_default_timeout)
+            wav_audio = b64decode(response['data'][lang_code]['audio'][gender])
+            await self._tts_cache.put(cache_key, wav_audio)
+            return wav_audio
+
+        return await self._single_flight.run("tts", cache_key, _synthesize)
+
+    async def get_response(self, utterance: str, lang_code: str,
+                           user_profile: UserProfile, node_data: NodeData):
+        session = await self.get_session(node_data)
         user_profile.user.username = (user_profile.user.username or
                                       self.mq_cliend_id)
 
@@ -207,12 +367,12 @@ class MQServiceManager:
                                     "node_data": node_data.model_dump(
                                         mode="json"),
                                     "ident": f"{self.mq_cliend_id}{time()}"}}
-        response = send_mq_request("/neon_chat_api", request_data,
-                                   "neon_chat_api_request",
-                                   timeout=self.mq_default_timeout)
+        response = await self._request("/neon_chat_api", request_data,
+                                       "neon_chat_api_request",
+                                       self.mq_default_timeout)
 
         # Update session data for future inputs
-        self.sessions_by_id[session['session_id']] = \
-            response['context']['session']
+        await self.sessions_by_id.aput(session['session_id'],
+                                       response['context']['session'])
         sentence = response['data']['responses'][lang_code]['sentence']
         return {"answer": sentence, "lang_code": lang_code}
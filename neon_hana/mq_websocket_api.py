@@ -24,17 +24,22 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from asyncio import run, get_event_loop
+from asyncio import (Future, TimeoutError, get_event_loop,
+                     get_running_loop, shield, wait_for)
+from base64 import b64decode
 from os import makedirs
-from queue import Queue
-from time import time, sleep
-from typing import Optional
+from time import time
+from typing import Dict, List, Optional
 from fastapi import WebSocket
 from neon_iris.client import NeonAIClient
 from ovos_bus_client.message import Message
 from threading import RLock
 from ovos_utils import LOG
 
+from neon_hana.cache.session_store import get_session_store
+from neon_hana.stream_scheduler import StreamScheduler
+from neon_hana.websocket_dispatcher import WebSocketDispatcher, SessionWriter
+
 
 class ClientNotKnown(RuntimeError):
     """
@@ -52,42 +57,179 @@ class MQWebsocketAPI(NeonAIClient):
         makedirs(config_dir, exist_ok=True)
         NeonAIClient.__init__(self, mq_config, config_dir=config_dir)
         self._sessions = dict()
+        self._registrations: Dict[str, Future] = dict()
         self._session_lock = RLock()
+        self._session_store = get_session_store(config, "node_sessions")
         self._client = "neon_node_websocket"
+        self.dispatcher = WebSocketDispatcher(
+            config.get("websocket_max_pending_sends", 1024))
+        self._max_queued = config.get("websocket_max_queued_messages", 64)
+        self._overflow_policy = config.get("websocket_overflow_policy",
+                                           "drop_oldest")
+        self.stream_scheduler = StreamScheduler(config.get("stream_workers"))
+        self._hotword_batch_size = config.get("hotword_batch_size", 1)
+        self._hotword_batch_latency = config.get("hotword_batch_latency",
+                                                 0.005)
+        self._hotword_batcher = None
+        self._energy_gate = config.get("stream_energy_gate", True)
+        self._energy_gate_ratio = config.get("stream_energy_gate_ratio", 3.0)
+        self._energy_gate_pre_roll = \
+            config.get("stream_energy_gate_pre_roll_chunks", 4)
+        self._max_buffered_seconds = \
+            config.get("stream_max_buffered_seconds", 10)
+        self._stream_chunk_size = config.get("stream_chunk_size", 4096)
+        self._response_chunk_size = \
+            config.get("stream_response_chunk_size", 16384)
+        self._audio_segment_seconds = \
+            config.get("stream_audio_segment_seconds", 0)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Outbound message counts for the dispatcher and all sessions, and
+        inbound audio buffer usage for all streams. Session IDs are not
+        included.
+        """
+        with self._session_lock:
+            sessions = [session["socket"].stats
+                        for session in self._sessions.values()]
+            stream_buffers = [session["stream"].mic.stats
+                              for session in self._sessions.values()
+                              if session.get("stream")]
+        return {"dispatcher": self.dispatcher.stats,
+                "streams": self.stream_scheduler.stats,
+                "hotword_batches": self._hotword_batcher.stats
+                if self._hotword_batcher else None,
+                "stream_buffers": self._aggregate_stats(stream_buffers),
+                "session_store": self._session_store.stats,
+                "sessions": self._aggregate_stats(sessions)}
+
+    @staticmethod
+    def _aggregate_stats(stats: List[dict]) -> dict:
+        """
+        Combine numeric stats of several sessions or streams. Queue depths
+        are reported as the maximum; all other counts are summed.
+        @param stats: Stats of each session or stream
+        @return: count and combined stats
+        """
+        combined = {"count": len(stats)}
+        for entry in stats:
+            for key, value in entry.items():
+                if not isinstance(value, (int, float)) or \
+                        isinstance(value, bool):
+                    continue
+                if "depth" in key:
+                    combined[key] = max(combined.get(key, 0), value)
+                else:
+                    combined[key] = combined.get(key, 0) + value
+        return combined
 
-    def new_connection(self, ws: WebSocket, session_id: str):
+    def _get_hotword_batcher(self):
+        """
+        Get the batcher shared by all streams for wake word detection.
+        @return: HotwordBatcher, or None if batching is disabled
+        """
+        if self._hotword_batch_size <= 1:
+            return None
+        if not self._hotword_batcher:
+            from neon_hana.model_registry import model_registry
+            from neon_hana.streaming_client import HotwordBatcher
+            self._hotword_batcher = HotwordBatcher(
+                self._hotword_batch_size, self._hotword_batch_latency,
+                model_registry.hotword_lock)
+        return self._hotword_batcher
+
+    def _get_energy_gate(self):
+        """
+        Get a new energy gate for a stream.
+        @return: EnergyGate, or None if gating is disabled
+        """
+        if not self._energy_gate:
+            return None
+        from neon_hana.streaming_client import EnergyGate
+        return EnergyGate(self._energy_gate_ratio,
+                          pre_roll_chunks=self._energy_gate_pre_roll)
+
+    def _get_writer(self, ws: WebSocket) -> SessionWriter:
+        """
+        Get a writer that queues outbound messages for a client WebSocket.
+        @param ws: Client WebSocket to write to
+        @return: SessionWriter for `ws`
+        """
+        return SessionWriter(ws, self._max_queued, self._overflow_policy)
+
+    async def new_connection(self, ws: WebSocket, session_id: str):
         """
         Record a new client connection to associate the WebSocket with the
         session_id for response routing.
         @param ws: Client WebSocket object
         @param session_id: Session ID of the client
         """
-        self._sessions[session_id] = {"session": {"session_id": session_id},
-                                      "socket": ws,
-                                      "user": self.user_config}
+        self.dispatcher.bind()
+        # Continue a session from an earlier connection, possibly to another
+        # worker
+        stored = await self._session_store.aget(session_id) or {}
+        with self._session_lock:
+            self._sessions[session_id] = {
+                "session": stored.get("session") or {"session_id": session_id},
+                "socket": self._get_writer(ws),
+                "user": stored.get("user") or self.user_config}
+        registration = self._registrations.pop(session_id, None)
+        if registration and not registration.done():
+            registration.set_result(True)
+
+    async def wait_for_session(self, session_id: str, timeout: float = 5):
+        """
+        Wait for a client connection to be established for a session. This
+        handles clients that don't wait for the Node WS to connect before
+        starting a stream.
+        @param session_id: Session ID to wait for
+        @param timeout: Maximum seconds to wait
+        @raises ClientNotKnown: if the session is not established in time
+        """
+        if session_id in self._sessions:
+            return
+        registration = self._registrations.get(session_id)
+        if not registration:
+            registration = get_running_loop().create_future()
+            self._registrations[session_id] = registration
+        try:
+            await wait_for(shield(registration), timeout)
+        except TimeoutError:
+            if self._registrations.get(session_id) is registration:
+                self._registrations.pop(session_id)
+            raise ClientNotKnown(f"Stream cannot be established for "
+                                 f"{session_id}")
 
-    def new_stream(self, ws: WebSocket, session_id: str):
+    async def new_stream(self, ws: WebSocket, session_id: str,
+                         codec: str = "pcm", chunked_response: bool = False):
         """
         Establish a new streaming connection, associated with an existing session.
         @param ws: Client WebSocket that handles byte audio
         @param session_id: Session ID the websocket is associated with
+        @param codec: Codec the client sends audio in
+        @param chunked_response: If True, send response audio in framed chunks
         """
-        timeout = time() + 5
-        while session_id not in self._sessions and time() < timeout:
-            # Handle problem clients that don't explicitly wait for the Node WS
-            # to connect before starting a stream
-            sleep(1)
+        await self.wait_for_session(session_id)
         with self._session_lock:
             if session_id not in self._sessions:
                 raise ClientNotKnown(f"Stream cannot be established for {session_id}")
             from neon_hana.streaming_client import RemoteStreamHandler, StreamMicrophone
             if not self._sessions[session_id].get('stream'):
                 LOG.info(f"starting stream for session {session_id}")
-                audio_queue = Queue()
-                stream = RemoteStreamHandler(StreamMicrophone(audio_queue), session_id,
+                mic = StreamMicrophone(self._max_buffered_seconds,
+                                       self._stream_chunk_size, codec)
+                stream = RemoteStreamHandler(mic, session_id,
                                              input_audio_callback=self.handle_client_input,
                                              ww_callback=self.handle_ww_detected,
-                                             client_socket=ws)
+                                             client_socket=self._get_writer(ws),
+                                             dispatcher=self.dispatcher,
+                                             scheduler=self.stream_scheduler,
+                                             hotword_batcher=self._get_hotword_batcher(),
+                                             energy_gate=self._get_energy_gate(),
+                                             response_chunk_size=self._response_chunk_size
+                                             if chunked_response else 0,
+                                             audio_segment_seconds=self._audio_segment_seconds)
                 self._sessions[session_id]['stream'] = stream
                 try:
                     stream.start()
@@ -103,8 +245,10 @@ class MQWebsocketAPI(NeonAIClient):
         if not session:
             LOG.error(f"Ended session is not established {session_id}")
             return
+        session["socket"].close()
         stream = session.get('stream')
         if stream:
+            stream.client_socket.close()
             stream.shutdown()
             stream.join()
             LOG.info(f"Ended stream handler for: {session_id}")
@@ -115,8 +259,11 @@ class MQWebsocketAPI(NeonAIClient):
         @param session_id: Session ID to get context for
         @return: dict context for the given session_id (may be empty)
         """
+        # Stored sessions are loaded by `new_connection`; the store is not
+        # read here since this is called on the event loop
         with self._session_lock:
-            sess = dict(self._sessions.get(session_id, {}).get("session", {}))
+            session = self._sessions.get(session_id) or {}
+            sess = dict(session.get("session", {}))
         return sess
 
     def get_user_config(self, session_id: str) -> dict:
@@ -126,8 +273,8 @@ class MQWebsocketAPI(NeonAIClient):
         @return: dict user configuration
         """
         with self._session_lock:
-            config = dict(self._sessions.get(session_id, {}).get("user") or
-                          self.user_config)
+            session = self._sessions.get(session_id) or {}
+            config = dict(session.get("user") or self.user_config)
         return config
 
     def _get_message_context(self, message: Message, session_id: str) -> dict:
@@ -161,18 +308,24 @@ class MQWebsocketAPI(NeonAIClient):
             user_config = message.context.get('user_profiles', [None])[0]
             session_id = session_data.get('session_id')
             with self._session_lock:
-                self._sessions[session_id]['session'] = session_data
+                session = self._sessions[session_id]
+                session['session'] = session_data
                 if user_config:
-                    self._sessions[session_id]['user'] = user_config
+                    session['user'] = user_config
+                user_config = session['user']
+            # Called from the MQ consumer thread; the event loop does not
+            # wait on this write
+            self._session_store.put(session_id, {"session": session_data,
+                                                 "user": user_config})
 
     def handle_audio_input_stream(self, audio: bytes, session_id: str):
-        self._sessions[session_id]['stream'].mic.queue.put(audio)
+        self._sessions[session_id]['stream'].on_audio(audio)
 
     def handle_ww_detected(self, ww_context: dict, session_id: str):
         session = self.get_session(session_id)
         message = Message("neon.ww_detected", ww_context,
                           {"session": session})
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     def handle_client_input(self, data: dict, session_id: str):
         """
@@ -196,7 +349,7 @@ class MQWebsocketAPI(NeonAIClient):
         """
         try:
             self._update_session_data(message)
-            run(self.send_to_client(message))
+            self.dispatcher.dispatch(self.send_to_client(message))
             session_id = message.context.get('session', {}).get('session_id')
             if stream := self._sessions.get(session_id, {}).get('stream'):
                 LOG.info("Stream response audio")
@@ -211,7 +364,7 @@ class MQWebsocketAPI(NeonAIClient):
         @param message: `complete.intent.failure` message from Neon
         """
         self._update_session_data(message)
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     def handle_api_response(self, message: Message):
         """
@@ -221,35 +374,39 @@ class MQWebsocketAPI(NeonAIClient):
         if message.msg_type == "neon.audio_input.response":
             LOG.info(message.data.get("transcripts"))
         LOG.debug(message.context.get("timing"))
-        run(self.send_to_client(message))
+        if message.msg_type == "neon.get_tts.response" and \
+                message.context.get("binary_audio"):
+            self.dispatcher.dispatch(self.send_audio_to_client(message))
+        else:
+            self.dispatcher.dispatch(self.send_to_client(message))
 
     def handle_error_response(self, message: Message):
         """
         Handle an MQ error response to a user input.
         @param message: `klat.error` response message
         """
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     def clear_caches(self, message: Message):
         """
         Handle a Neon request to clear cached data.
         @param message: `neon.clear_data` message from Neon
         """
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     def clear_media(self, message: Message):
         """
         Handle a Neon request to clear media data.
         @param message: `neon.clear_data` message from Neon
         """
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     def handle_alert(self, message: Message):
         """
         Handle an expired alert from Neon.
         @param message: `neon.alert_expired` message from Neon
         """
-        run(self.send_to_client(message))
+        self.dispatcher.dispatch(self.send_to_client(message))
 
     async def send_to_client(self, message: Message):
         """
@@ -258,7 +415,30 @@ class MQWebsocketAPI(NeonAIClient):
         """
         # TODO: Drop context?
         session_id = message.context["session"]["session_id"]
-        await self._sessions[session_id]["socket"].send_text(message.serialize())
+        await self._sessions[session_id]["socket"].send_text(
+            message.serialize(), message.msg_type)
+
+    async def send_audio_to_client(self, message: Message):
+        """
+        Forward a TTS response to a WebSocket client with audio sent as binary
+        WAV messages instead of base64 strings. Each encoded audio value in the
+        response is replaced with its length in bytes and the audio follows the
+        response in the same order.
+        @param message: TTS response to forward to a WebSocket client
+        """
+        audio_messages = list()
+        for response in message.data.values():
+            if not isinstance(response, dict) or \
+                    not isinstance(response.get("audio"), dict):
+                continue
+            for gender, encoded_audio in response["audio"].items():
+                audio = b64decode(encoded_audio)
+                response["audio"][gender] = len(audio)
+                audio_messages.append(audio)
+        session_id = message.context["session"]["session_id"]
+        # Queue the response with its audio so they are never separated
+        await self._sessions[session_id]["socket"].send_group(
+            [message.serialize(), *audio_messages])
 
     def shutdown(self, *_, **__):
         """
@@ -267,4 +447,5 @@ class MQWebsocketAPI(NeonAIClient):
         loop = get_event_loop()
         loop.call_soon_threadsafe(loop.stop)
         LOG.info("Stopped Event Loop")
+        self.stream_scheduler.shutdown()
         super().shutdown()
@@ -31,6 +31,10 @@ from neon_hana.schema.node_model import NodeData
 
 class NodeInputContext(BaseModel):
     node_data: Optional[NodeData] = Field(description="Node Data")
+    binary_audio: Optional[bool] = Field(
+        default=False, description="If True, `neon.get_tts` response audio is "
+                                   "sent as binary WAV messages following "
+                                   "the response")
 
 
 class AudioInputData(BaseModel):
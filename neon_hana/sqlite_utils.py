@@ -0,0 +1,61 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sqlite3
+
+from os import makedirs
+from os.path import dirname
+
+
+def get_storage_backend(config: dict, key: str) -> str:
+    """
+    Get the storage backend configured by `key`. Storage defaults to SQLite,
+    shared between processes, when there are several worker processes and to
+    process memory otherwise.
+    @param config: HANA configuration
+    @param key: Configuration key of the backend
+    @return: name of the storage backend
+    """
+    return config.get(key) or \
+        ("sqlite" if config.get("server_workers", 1) > 1 else "memory")
+
+
+def connect_sqlite(path: str, timeout: float = 5) -> sqlite3.Connection:
+    """
+    Open a SQLite database in WAL mode for use by several threads and
+    processes. The connection is in autocommit mode; callers serialize their
+    own use of it.
+    @param path: Path to the database file, created if it does not exist
+    @param timeout: Seconds to wait for a lock held by another connection
+    @return: database connection
+    """
+    if dirname(path):
+        makedirs(dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                         check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
@@ -0,0 +1,131 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from os import cpu_count
+from queue import Queue
+from threading import Lock, Thread
+from typing import List, Optional, Protocol, Set
+
+from ovos_utils import LOG
+
+
+class ScheduledStream(Protocol):
+    @property
+    def has_audio(self) -> bool:
+        """
+        True if the stream has buffered audio to process.
+        """
+
+    def process_audio(self, max_chunks: int) -> int:
+        """
+        Process up to `max_chunks` chunks of buffered audio.
+        @return: number of chunks processed
+        """
+
+
+class StreamScheduler:
+    def __init__(self, workers: Optional[int] = None,
+                 chunks_per_turn: int = 4):
+        """
+        Processes audio for many streams with a fixed pool of worker threads.
+        A stream is queued when it receives audio and is processed by one
+        worker at a time; streams with more audio than `chunks_per_turn` are
+        queued again so that busy streams do not starve others.
+        @param workers: Number of worker threads; defaults to the CPU count
+        @param chunks_per_turn: Maximum chunks to process for a stream before
+            processing other streams
+        """
+        self.num_workers = workers or cpu_count() or 1
+        self.chunks_per_turn = chunks_per_turn
+        self._ready = Queue()
+        self._scheduled: Set[ScheduledStream] = set()
+        self._lock = Lock()
+        self._workers: List[Thread] = list()
+        self._counters = {"chunks": 0, "turns": 0, "errors": 0}
+
+    @property
+    def stats(self) -> dict:
+        """
+        Worker count, queued streams and counts of processed audio.
+        """
+        return {"workers": self.num_workers,
+                "queued_streams": self._ready.qsize(),
+                **self._counters}
+
+    def notify(self, stream: ScheduledStream):
+        """
+        Queue a stream to be processed. Call this after adding audio to the
+        stream; a stream that is already queued or being processed is not
+        queued again.
+        @param stream: Stream with new audio
+        """
+        with self._lock:
+            if stream in self._scheduled:
+                return
+            self._scheduled.add(stream)
+            if not self._workers:
+                self._start_workers()
+        self._ready.put(stream)
+
+    def _start_workers(self):
+        for i in range(self.num_workers):
+            worker = Thread(target=self._run_worker, daemon=True,
+                            name=f"stream_worker_{i}")
+            worker.start()
+            self._workers.append(worker)
+        LOG.info(f"Started {self.num_workers} stream workers")
+
+    def _run_worker(self):
+        while True:
+            stream = self._ready.get()
+            if stream is None:
+                return
+            try:
+                self._counters["chunks"] += \
+                    stream.process_audio(self.chunks_per_turn)
+            except Exception as e:
+                self._counters["errors"] += 1
+                LOG.exception(f"Failed to process stream audio: {e}")
+            self._counters["turns"] += 1
+            # Checked under the lock so audio added concurrently by `notify`
+            # is either seen here or schedules the stream again
+            with self._lock:
+                if stream.has_audio:
+                    self._ready.put(stream)
+                else:
+                    self._scheduled.discard(stream)
+
+    def shutdown(self):
+        """
+        Stop all workers after they finish processing their current stream.
+        """
+        with self._lock:
+            workers = self._workers
+            self._workers = list()
+        for _ in workers:
+            self._ready.put(None)
+        for worker in workers:
+            worker.join()
@@ -1,71 +1,668 @@
 import io
+import time
+
+import numpy as np
 from asyncio import run
 from base64 import b64encode, b64decode
-from typing import Optional, Callable
+from collections import deque
+from struct import Struct
+from typing import Any, Deque, Iterator, List, Optional, Callable
+from uuid import uuid4
 from mock.mock import Mock
-from threading import Thread
-from queue import Queue
+from threading import Condition, Event, Lock, Thread
 
 from ovos_dinkum_listener.voice_loop import DinkumVoiceLoop
-from ovos_dinkum_listener.voice_loop.hotwords import HotwordContainer
-from ovos_dinkum_listener.voice_loop.voice_loop import ChunkInfo
+from ovos_dinkum_listener.voice_loop.hotwords import HotWordException
+from ovos_dinkum_listener.voice_loop.voice_loop import (ChunkInfo,
+                                                        ListeningMode,
+                                                        ListeningState)
 from ovos_plugin_manager.templates.microphone import Microphone
-from ovos_plugin_manager.vad import OVOSVADFactory
 from ovos_utils.fakebus import FakeBus
 from speech_recognition import AudioData
 from ovos_utils import LOG
-from starlette.websockets import WebSocket
+
+from neon_hana.audio_buffer import AudioRingBuffer
+from neon_hana.audio_codec import get_decoder
+from neon_hana.model_registry import model_registry, supports_stream_state
+from neon_hana.stream_scheduler import StreamScheduler
+from neon_hana.websocket_dispatcher import SessionWriter, WebSocketDispatcher
 
 
 class StreamMicrophone(Microphone):
-    def __init__(self, queue: Queue):
-        self.queue = queue
+    def __init__(self, max_buffered_seconds: float = 10,
+                 chunk_size: int = 4096, codec: str = "pcm"):
+        """
+        Microphone that reads audio streamed from a client. Audio is kept in a
+        fixed-size ring buffer; if the client sends audio faster than it is
+        processed, the oldest audio is dropped. Clients may send audio in
+        messages of any size; it is read back in chunks of exactly
+        `chunk_size` bytes, with any remainder kept for the next chunk.
+        @param max_buffered_seconds: Maximum seconds of audio to buffer
+        @param chunk_size: Bytes of audio passed to VAD and wake word engines
+            at a time
+        @param codec: Codec the client sends audio in; compressed packets
+            are queued as they are received and decoded to PCM when audio is
+            read, so decoding runs on the thread processing the stream
+        """
+        frame_size = self.sample_width * self.sample_channels
+        if chunk_size < frame_size or chunk_size % frame_size:
+            raise ValueError(f"chunk_size must be a multiple of {frame_size}")
+        self.chunk_size = chunk_size
+        capacity = max(int(max_buffered_seconds * self.sample_rate),
+                       self.frames_per_chunk) * frame_size
+        self.buffer = AudioRingBuffer(capacity, frame_size)
+        self.codec = codec
+        self.decoder = get_decoder(codec, self.sample_rate,
+                                   self.sample_channels)
+        self.decode_errors = 0
+        # Bounded to `max_buffered_seconds` of the shortest (2.5ms) Opus
+        # packets; the oldest packets are dropped like buffered audio
+        self._packets: Deque[bytes] = \
+            deque(maxlen=max(int(max_buffered_seconds * 400), 1))
+        self.dropped_packets = 0
+        self._condition = Condition()
+        self._stopped = False
 
     def start(self):
-        pass
+        self._stopped = False
 
     def stop(self):
-        self.queue.put(None)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Input codec and audio buffer usage.
+        """
+        return {"codec": self.codec, "decode_errors": self.decode_errors,
+                "dropped_packets": self.dropped_packets,
+                "queued_packets": len(self._packets), **self.buffer.stats}
+
+    def write(self, audio: bytes):
+        """
+        Buffer audio received from the client.
+        @param audio: Audio bytes, or one compressed packet if `codec` is not
+            "pcm"
+        """
+        if self.decoder:
+            if len(self._packets) == self._packets.maxlen:
+                self.dropped_packets += 1
+                LOG.warning("Stream packet queue full; dropped a packet")
+            self._packets.append(bytes(audio))
+        else:
+            self._buffer_audio(audio)
+        with self._condition:
+            self._condition.notify()
+
+    def _buffer_audio(self, audio: bytes):
+        dropped = self.buffer.write(audio)
+        if dropped:
+            LOG.warning(f"Stream buffer full; dropped {dropped} bytes")
+
+    def decode_pending(self):
+        """
+        Decode compressed packets received since the last read into the
+        audio buffer. Called when audio is read.
+        """
+        while self._packets:
+            packet = self._packets.popleft()
+            try:
+                self._buffer_audio(self.decoder.decode(packet))
+            except Exception as e:
+                self.decode_errors += 1
+                LOG.warning(f"Dropping {self.codec} packet: {e}")
+
+    def read_chunk(self) -> Optional[memoryview]:
+        """
+        Wait for a chunk of audio. The returned view is only valid until the
+        next read.
+        @return: view of `chunk_size` bytes, or None if stopped
+        """
+        with self._condition:
+            while True:
+                self._condition.wait_for(
+                    lambda: self._stopped or self.has_chunks)
+                if self._stopped:
+                    return None
+                chunk = self.read_chunk_nowait()
+                if chunk is not None:
+                    return chunk
+
+    def read_chunk_nowait(self) -> Optional[memoryview]:
+        """
+        Read a chunk of audio if one is buffered. The returned view is only
+        valid until the next read.
+        @return: view of `chunk_size` bytes, or None if no chunk is buffered
+        """
+        self.decode_pending()
+        return self.buffer.read(self.chunk_size)
+
+    @property
+    def has_chunks(self) -> bool:
+        # Undecoded packets may complete a chunk once they are decoded
+        return self.buffer.unread >= self.chunk_size or bool(self._packets)
+
+
+class SteppedVoiceLoop(DinkumVoiceLoop):
+    """
+    DinkumVoiceLoop that can be advanced one chunk at a time by a caller
+    instead of reading from its microphone in a blocking loop.
+    """
+
+    def prepare(self):
+        """
+        Reset loop state before processing audio. This is the setup done by
+        `DinkumVoiceLoop.run` before its read loop.
+        """
+        # Voice command state
+        self.speech_seconds_left = self.speech_seconds
+        self.silence_seconds_left = self.silence_seconds
+        self.timeout_seconds_left = self.timeout_seconds
+        self.timeout_seconds_with_silence_left = \
+            self.timeout_seconds_with_silence
+
+        if self.vad_pre_wake_enabled:
+            self.state = ListeningState.PRE_WAKE_VAD
+        else:
+            self.state = ListeningState.DETECT_WAKEWORD
+
+        # Keep hotword/STT audio so they can (optionally) be saved to disk
+        self.hotword_chunks = deque(maxlen=self.num_hotword_keep_chunks)
+        self.stt_audio_bytes = bytes()
+
+        # Audio from just before the wake word is detected is kept for STT.
+        n = self.num_stt_rewind_chunks + 1
+        if self.listen_mode == ListeningMode.CONTINUOUS:
+            self.stt_chunks: Deque[bytes] = deque(maxlen=3 * n)
+        else:
+            self.stt_chunks: Deque[bytes] = deque(maxlen=n)
+
+    def process_chunk(self, chunk: bytes):
+        """
+        Advance the listening state machine with one chunk of audio. This is
+        the body of the `DinkumVoiceLoop.run` read loop.
+        @param chunk: Audio chunk to process
+        """
+        if self.is_muted:
+            # Soft mute
+            chunk = bytes(self.mic.chunk_size)
+
+        self._chunk_info.is_speech = False
+        self._chunk_info.energy = 0.0
+
+        if self.state == ListeningState.PRE_WAKE_VAD:
+            self._pre_wake_vad(chunk)
+
+        elif self.state == ListeningState.DETECT_WAKEWORD:
+            if self.vad_pre_wake_enabled and not self._vad_window_start:
+                self._vad_window_start = time.time()
+            try:
+                if self.listen_mode == ListeningMode.CONTINUOUS:
+                    self.state = ListeningState.WAITING_CMD
+                elif self._detect_ww(chunk):
+                    LOG.info("Wakeword detected")
+                elif self._detect_hot(chunk):
+                    LOG.info("Hotword detected")
+                else:
+                    self.transformers.feed_audio(chunk)
+                    # handle timeout to return to VAD stage
+                    if self.vad_pre_wake_enabled and \
+                            time.time() - self._vad_window_start > 5:
+                        self.state = ListeningState.PRE_WAKE_VAD
+                        self._vad_window_start = 0
+            except HotWordException as e:
+                if self.hotwords.reload_on_failure:
+                    LOG.warning(e)
+                    self.hotwords.load_hotword_engines()
+                else:
+                    raise e
+
+        if self.state == ListeningState.WAITING_CMD:
+            self._wait_cmd(chunk)
+        elif self.state == ListeningState.RECORDING:
+            self._in_recording(chunk)
+        elif self.state == ListeningState.SLEEPING:
+            self._before_wakeup(chunk)
+        elif self.state == ListeningState.CHECK_WAKE_UP:
+            self._detect_wakeup(chunk)
+        elif self.state == ListeningState.CONFIRMATION:
+            self._confirmation_sound(chunk)
+        elif self.state == ListeningState.BEFORE_COMMAND:
+            self._before_cmd(chunk)
+        elif self.state == ListeningState.IN_COMMAND:
+            self._in_cmd(chunk)
+        elif self.state == ListeningState.AFTER_COMMAND:
+            LOG.info("speech finished")
+            self._after_cmd(chunk)
+
+        if self.chunk_callback is not None:
+            self._chunk_info.energy = \
+                self.debiased_energy(chunk, self.mic.sample_width)
+            self.chunk_callback(self._chunk_info)
+
+    def run(self):
+        self.prepare()
+        while self._is_running:
+            chunk = self.mic.read_chunk()
+            if not self._is_running:
+                break
+            if chunk is not None:
+                self.process_chunk(bytes(chunk))
+
+
+class EnergyGate:
+    def __init__(self, ratio: float = 3.0, min_rms: float = 100,
+                 pre_roll_chunks: int = 4, hangover_chunks: int = 8,
+                 adapt_rate: float = 0.05):
+        """
+        Cheap per-stream RMS gate that holds back clearly silent audio. The
+        noise floor adapts to each stream's background noise; a chunk opens
+        the gate when its RMS exceeds `ratio` times the noise floor and the
+        gate closes after `hangover_chunks` quiet chunks.
+        @param ratio: RMS relative to the noise floor that opens the gate
+        @param min_rms: Minimum RMS that opens the gate, for very quiet streams
+        @param pre_roll_chunks: Quiet chunks kept and released when the gate
+            opens, so speech onset is not lost
+        @param hangover_chunks: Quiet chunks passed after the gate opens
+        @param adapt_rate: Weight of each quiet chunk in the noise floor
+        """
+        self.ratio = ratio
+        self.min_rms = min_rms
+        self.hangover_chunks = hangover_chunks
+        self.adapt_rate = adapt_rate
+        self.noise_floor: Optional[float] = None
+        self._pre_roll: Deque[bytes] = deque(maxlen=pre_roll_chunks)
+        self._hangover = 0
+        self.passed = 0
+        self.gated = 0
+
+    @staticmethod
+    def get_rms(chunk: bytes) -> float:
+        """
+        Get the RMS of 16-bit PCM audio.
+        @param chunk: Audio bytes
+        @return: RMS amplitude
+        """
+        samples = np.frombuffer(chunk, dtype=np.int16, count=len(chunk) // 2)
+        if not samples.size:
+            return 0.0
+        samples = samples.astype(np.float32)
+        return float(np.sqrt(np.dot(samples, samples) / samples.size))
+
+    @property
+    def is_open(self) -> bool:
+        return self._hangover > 0
+
+    def process(self, chunk: bytes) -> List[bytes]:
+        """
+        Gate a chunk of audio.
+        @param chunk: Audio bytes
+        @return: chunks to process; empty if `chunk` is held back as silence
+        """
+        rms = self.get_rms(chunk)
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        if rms > max(self.noise_floor * self.ratio, self.min_rms):
+            # Slowly adapt to a lasting increase in background noise
+            self.noise_floor += (rms - self.noise_floor) * \
+                self.adapt_rate / 10
+            self._hangover = self.hangover_chunks
+            return self.release(chunk)
+        # Follow quiet backgrounds down quickly and louder ones up slowly
+        self.noise_floor = min(rms, self.noise_floor * (1 - self.adapt_rate) +
+                               rms * self.adapt_rate)
+        if self._hangover > 0:
+            self._hangover -= 1
+            self.passed += 1
+            return [chunk]
+        if len(self._pre_roll) == self._pre_roll.maxlen:
+            # The oldest held chunk is dropped without being processed
+            self.gated += 1
+        if self._pre_roll.maxlen:
+            # Copy in case `chunk` is a view of a buffer that will be reused
+            self._pre_roll.append(bytes(chunk))
+        return []
+
+    def release(self, chunk: Optional[bytes] = None) -> List[bytes]:
+        """
+        Release held audio, i.e. when the gate opens or is bypassed.
+        @param chunk: Optional chunk to release after held audio
+        @return: held chunks followed by `chunk`
+        """
+        chunks = list(self._pre_roll)
+        self._pre_roll.clear()
+        if chunk is not None:
+            chunks.append(chunk)
+        self.passed += len(chunks)
+        return chunks
+
+
+class _DetectRequest:
+    def __init__(self, engine: Any, state: Any, chunk: bytes):
+        self.engine = engine
+        self.state = state
+        self.chunk = chunk
+        self.result = False
 
-    def read_chunk(self) -> Optional[bytes]:
-        return self.queue.get()
 
+class HotwordBatcher:
+    def __init__(self, max_batch_size: int = 16, max_latency: float = 0.005,
+                 lock: Optional[Lock] = None):
+        """
+        Runs wake word detection for chunks from many streams in batches.
+        Requests are gathered until `max_batch_size` chunks are pending or the
+        oldest request has waited `max_latency` seconds. Only engines that
+        implement `new_stream_state` and `detect_batch` can be batched; each
+        batch runs in one call with per-stream state.
+        @param max_batch_size: Maximum chunks to detect in one batch
+        @param max_latency: Maximum seconds a chunk waits for a batch to fill
+        @param lock: Lock held while using shared engines
+        """
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._lock = lock or Lock()
+        self._pending = 0
+        self._queued: Deque[tuple] = deque()
+        self._condition = Condition()
+        self._thread = None
+        self._counters = {"batches": 0, "requests": 0, "vectorized": 0,
+                          "errors": 0}
 
-class RemoteStreamHandler(Thread):
+    @property
+    def stats(self) -> dict:
+        """
+        Counts of batches and detection requests.
+        """
+        return dict(self._counters)
+
+    def detect(self, engines: List[Any], states: List[Any],
+               chunk: bytes) -> List[bool]:
+        """
+        Run wake word detection for one chunk of a stream's audio, waiting
+        for the batch including it to complete.
+        @param engines: Shared hotword engines to run
+        @param states: Per-stream state for each engine
+        @param chunk: Audio chunk
+        @return: detection result for each engine
+        """
+        if not engines:
+            return []
+        for engine in engines:
+            if not supports_stream_state(engine):
+                raise ValueError(f"Engine does not support per-stream state: "
+                                 f"{engine}")
+        requests = [_DetectRequest(engine, state, chunk)
+                    for engine, state in zip(engines, states)]
+        done = Event()
+        with self._condition:
+            if not self._thread:
+                self._thread = Thread(target=self._run, daemon=True,
+                                      name="hotword_batcher")
+                self._thread.start()
+            self._pending += len(requests)
+            self._queued.append((requests, done, time.monotonic()))
+            self._condition.notify()
+        done.wait()
+        return [request.result for request in requests]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queued)
+                deadline = self._queued[0][2] + self.max_latency
+                while self._pending < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                # Keep each stream's requests for a chunk in the same batch
+                batch = [self._queued.popleft()]
+                requests = list(batch[0][0])
+                while self._queued and len(requests) + \
+                        len(self._queued[0][0]) <= self.max_batch_size:
+                    batch.append(self._queued.popleft())
+                    requests.extend(batch[-1][0])
+                self._pending -= len(requests)
+            try:
+                self._run_batch(requests)
+            finally:
+                for _, done, _ in batch:
+                    done.set()
+
+    def _run_batch(self, requests: List[_DetectRequest]):
+        self._counters["batches"] += 1
+        self._counters["requests"] += len(requests)
+        by_engine = dict()
+        for request in requests:
+            by_engine.setdefault(id(request.engine), list()).append(request)
+        with self._lock:
+            for engine_requests in by_engine.values():
+                engine = engine_requests[0].engine
+                try:
+                    results = engine.detect_batch(
+                        [r.state for r in engine_requests],
+                        [r.chunk for r in engine_requests])
+                    self._counters["vectorized"] += 1
+                    for request, result in zip(engine_requests, results):
+                        request.result = bool(result)
+                except Exception as e:
+                    self._counters["errors"] += 1
+                    LOG.error(f"Hotword detection failed: {e}")
+
+
+class UtteranceSegmenter:
+    def __init__(self, segment_bytes: int, callback: Callable,
+                 lang: str = "en-us"):
+        """
+        Streaming STT stand-in for the voice loop that forwards utterance
+        audio in segments while the user is still speaking, instead of
+        transcribing it locally.
+        @param segment_bytes: Bytes of audio to collect before forwarding
+        @param callback: Called with (audio, utterance_id, sequence, final)
+        @param lang: Language reported to the voice loop
+        """
+        self.segment_bytes = segment_bytes
+        self.callback = callback
+        self.lang = lang
+        self.utterance_id = None
+        self._sequence = 0
+        self._pending = bytearray()
+
+    def stream_start(self):
+        """
+        Start a new utterance. Called by the voice loop when recording starts.
+        """
+        self.utterance_id = str(uuid4())
+        self._sequence = 0
+        self._pending.clear()
+
+    def stream_data(self, chunk: bytes):
+        """
+        Add utterance audio, forwarding a segment once enough is collected.
+        @param chunk: Audio chunk
+        """
+        if not self.utterance_id:
+            return
+        self._pending += chunk
+        if len(self._pending) >= self.segment_bytes:
+            self._forward(final=False)
+
+    def transcribe(self, *_, **__) -> list:
+        # Transcription is done by the backend
+        return []
+
+    def finish(self) -> bool:
+        """
+        Forward any remaining audio as the final segment of the utterance.
+        @return: True if an utterance was in progress
+        """
+        if not self.utterance_id:
+            return False
+        self._forward(final=True)
+        self.utterance_id = None
+        return True
+
+    def _forward(self, final: bool):
+        audio = bytes(self._pending)
+        self._pending.clear()
+        self.callback(audio, self.utterance_id, self._sequence, final)
+        self._sequence += 1
+
+
+# Response id, sequence number and flags preceding each response audio chunk
+RESPONSE_AUDIO_HEADER = Struct("!IIB")
+RESPONSE_AUDIO_FINAL = 0x01
+
+
+def frame_response_audio(audio: bytes, response_id: int,
+                         chunk_size: int) -> Iterator[bytes]:
+    """
+    Split response audio into chunks that can be played as they arrive. Each
+    chunk starts with `RESPONSE_AUDIO_HEADER`; the last chunk of a response
+    has the `RESPONSE_AUDIO_FINAL` flag set.
+    @param audio: WAV audio bytes
+    @param response_id: ID shared by all chunks of this audio
+    @param chunk_size: Maximum bytes of audio in each chunk
+    @return: framed audio chunks
+    """
+    audio = memoryview(audio)
+    num_chunks = max(-(-len(audio) // chunk_size), 1)
+    for seq in range(num_chunks):
+        flags = RESPONSE_AUDIO_FINAL if seq == num_chunks - 1 else 0
+        yield RESPONSE_AUDIO_HEADER.pack(response_id, seq, flags) + \
+            audio[seq * chunk_size:(seq + 1) * chunk_size]
+
+
+class RemoteStreamHandler:
     def __init__(self, mic: StreamMicrophone, session_id: str,
                  input_audio_callback: Callable,
-                 client_socket: WebSocket,
-                 ww_callback: Callable, lang: str = "en-us"):
-        Thread.__init__(self)
+                 client_socket: SessionWriter,
+                 ww_callback: Callable, lang: str = "en-us",
+                 dispatcher: Optional[WebSocketDispatcher] = None,
+                 scheduler: Optional[StreamScheduler] = None,
+                 hotword_batcher: Optional[HotwordBatcher] = None,
+                 energy_gate: Optional[EnergyGate] = None,
+                 response_chunk_size: int = 0,
+                 audio_segment_seconds: float = 0):
+        """
+        Handles audio streamed from a client. Audio is processed by
+        `scheduler` workers rather than a dedicated thread.
+        @param response_chunk_size: If set, send response audio in framed
+            chunks of this many bytes instead of one message per file
+        @param audio_segment_seconds: If set, forward utterance audio in
+            segments of this many seconds while the user is speaking instead
+            of once the utterance ends
+        """
         self.session_id = session_id
         self.ww_callback = ww_callback
         self.input_audio_callback = input_audio_callback
         self.client_socket = client_socket
+        self.dispatcher = dispatcher
+        self.scheduler = scheduler or StreamScheduler(1)
+        self.energy_gate = energy_gate
+        self.response_chunk_size = response_chunk_size
+        self._response_id = 0
+        self._idle = Event()
+        self._idle.set()
         self.bus = FakeBus()
         self.mic = mic
         self.lang = lang
-        self.hotwords = HotwordContainer(self.bus)
-        self.hotwords.load_hotword_engines()
-        self.vad = OVOSVADFactory.create()
-        self.voice_loop = DinkumVoiceLoop(mic=self.mic,
-                                          vad=self.vad,
-                                          hotwords=self.hotwords,
-                                          listenword_audio_callback=self.on_hotword,
-                                          hotword_audio_callback=self.on_hotword,
-                                          stopword_audio_callback=self.on_hotword,
-                                          wakeupword_audio_callback=self.on_hotword,
-                                          stt_audio_callback=self.on_input_audio,
-                                          stt=Mock(transcribe=Mock(return_value=[])),
-                                          fallback_stt=Mock(transcribe=Mock(return_value=[])),
-                                          transformers=MockTransformers(),
-                                          chunk_callback=self.on_chunk,
-                                          speech_seconds=0.5,
-                                          num_hotword_keep_chunks=0,
-                                          num_stt_rewind_chunks=0)
+        self.hotwords = model_registry.get_hotwords(self.bus,
+                                                    hotword_batcher)
+        self.vad = model_registry.get_vad()
+        if audio_segment_seconds:
+            segment_bytes = int(audio_segment_seconds * mic.sample_rate) * \
+                mic.sample_width * mic.sample_channels
+            self.segmenter = UtteranceSegmenter(segment_bytes,
+                                                self.on_input_segment, lang)
+        else:
+            self.segmenter = None
+        stt = self.segmenter or Mock(transcribe=Mock(return_value=[]))
+        self.voice_loop = SteppedVoiceLoop(mic=self.mic,
+                                           vad=self.vad,
+                                           hotwords=self.hotwords,
+                                           listenword_audio_callback=self.on_hotword,
+                                           hotword_audio_callback=self.on_hotword,
+                                           stopword_audio_callback=self.on_hotword,
+                                           wakeupword_audio_callback=self.on_hotword,
+                                           stt_audio_callback=self.on_input_audio,
+                                           stt=stt,
+                                           fallback_stt=Mock(transcribe=Mock(return_value=[])),
+                                           transformers=MockTransformers(),
+                                           chunk_callback=self.on_chunk,
+                                           speech_seconds=0.5,
+                                           num_hotword_keep_chunks=0,
+                                           num_stt_rewind_chunks=0)
 
-    def run(self):
+    def start(self):
+        """
+        Start processing streamed audio.
+        """
         self.voice_loop.start()
-        self.voice_loop.run()
+        self.voice_loop.prepare()
+        if self.has_audio:
+            self.scheduler.notify(self)
+
+    def on_audio(self, audio: bytes):
+        """
+        Buffer audio received from the client and schedule it for processing
+        once a full chunk is buffered.
+        @param audio: Audio bytes from the client
+        """
+        self.mic.write(audio)
+        if self.voice_loop.running and self.mic.has_chunks:
+            self.scheduler.notify(self)
+
+    @property
+    def has_audio(self) -> bool:
+        return self.voice_loop.running and self.mic.has_chunks
+
+    def process_audio(self, max_chunks: int) -> int:
+        """
+        Process buffered audio. Called by a `scheduler` worker.
+        @param max_chunks: Maximum chunks to process
+        @return: number of chunks processed
+        """
+        self._idle.clear()
+        processed = 0
+        try:
+            while processed < max_chunks and self.voice_loop.running:
+                chunk = self.mic.read_chunk_nowait()
+                if chunk is None:
+                    break
+                for gated_chunk in self._gate(chunk):
+                    self.voice_loop.process_chunk(gated_chunk)
+                processed += 1
+        finally:
+            self._idle.set()
+        return processed
+
+    def _gate(self, chunk: bytes) -> List[bytes]:
+        """
+        Skip VAD and wake word detection for silence while waiting for a
+        wake word. Other states need every chunk, i.e. to detect the silence
+        that ends a command.
+        @param chunk: Audio chunk
+        @return: chunks to pass to the voice loop
+        """
+        if not self.energy_gate:
+            return [bytes(chunk)]
+        if self.voice_loop.state in (ListeningState.DETECT_WAKEWORD,
+                                     ListeningState.PRE_WAKE_VAD):
+            chunks = self.energy_gate.process(chunk)
+        else:
+            chunks = self.energy_gate.release(chunk)
+        # The voice loop keeps chunks, so views of the stream buffer are copied
+        return [bytes(chunk) for chunk in chunks]
+
+    def join(self, timeout: Optional[float] = None):
+        """
+        Wait for audio currently being processed to finish.
+        @param timeout: Maximum seconds to wait
+        """
+        self._idle.wait(timeout)
 
     def on_hotword(self, audio_bytes: bytes, context: dict):
         self.lang = context.get("stt_lang") or self.lang
@@ -74,6 +671,9 @@ class RemoteStreamHandler(Thread):
 
     def on_input_audio(self, audio_bytes: bytes, context: dict):
         LOG.info(f"Audio: {context}")
+        if self.segmenter and self.segmenter.finish():
+            # Earlier audio was already forwarded in segments
+            return
         audio_data = AudioData(audio_bytes, self.mic.sample_rate,
                                self.mic.sample_width).get_wav_data()
         audio_data = b64encode(audio_data).decode("utf-8")
@@ -81,25 +681,62 @@ class RemoteStreamHandler(Thread):
                          "data": {"audio_data": audio_data, "lang": self.lang}}
         self.input_audio_callback(callback_data, self.session_id)
 
-    def on_response_audio(self, data: dict):
-        async def _send_bytes(audio_bytes: bytes):
-            await self.client_socket.send_bytes(audio_bytes)
+    def on_input_segment(self, audio_bytes: bytes, utterance_id: str,
+                         sequence: int, final: bool):
+        """
+        Forward part of an utterance to the backend while it is recorded.
+        @param audio_bytes: Utterance audio since the previous segment
+        @param utterance_id: ID shared by all segments of one utterance
+        @param sequence: Segment index, starting at 0
+        @param final: True for the last segment of the utterance
+        """
+        LOG.debug(f"Audio segment {sequence} of {utterance_id} "
+                  f"(final={final})")
+        audio_data = AudioData(audio_bytes, self.mic.sample_rate,
+                               self.mic.sample_width).get_wav_data()
+        audio_data = b64encode(audio_data).decode("utf-8")
+        callback_data = {"type": "neon.audio_input",
+                         "data": {"audio_data": audio_data, "lang": self.lang,
+                                  "utterance_id": utterance_id,
+                                  "sequence": sequence, "final": final}}
+        self.input_audio_callback(callback_data, self.session_id)
 
+    def on_response_audio(self, data: dict):
         i = 0
         for lang_response in data.get('responses', {}).values():
             for encoded_audio in lang_response.get('audio', {}).values():
                 i += 1
                 wav_audio_bytes = b64decode(encoded_audio)
                 LOG.info(f"Sending {len(wav_audio_bytes)} bytes of audio")
-                run(_send_bytes(wav_audio_bytes))
+                if self.response_chunk_size:
+                    self._response_id = (self._response_id + 1) & 0xFFFFFFFF
+                    messages = frame_response_audio(wav_audio_bytes,
+                                                    self._response_id,
+                                                    self.response_chunk_size)
+                else:
+                    messages = [wav_audio_bytes]
+                # Queue all chunks of a file as one message so the writer
+                # overflow policy never drops part of a response
+                send = self.client_socket.send_group(list(messages))
+                if self.dispatcher:
+                    self.dispatcher.dispatch(send)
+                else:
+                    run(send)
         LOG.info(f"Sent {i} binary audio response(s)")
 
     def on_chunk(self, chunk: ChunkInfo):
         LOG.debug(f"Chunk: {chunk}")
 
     def shutdown(self):
+        """
+        Stop processing audio and release engines loaded for this stream.
+        """
         self.mic.stop()
         self.voice_loop.stop()
+        # Let a worker finish the current chunk before engines are released
+        self.join()
+        self.hotwords.shutdown()
+        model_registry.release_vad(self.vad)
 
 
 class MockTransformers(Mock):
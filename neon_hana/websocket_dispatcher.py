@@ -0,0 +1,237 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+
+from collections import deque
+from concurrent.futures import Future
+from threading import BoundedSemaphore, get_ident
+from typing import Coroutine, List, Optional, Union
+
+from fastapi import WebSocket
+from ovos_utils import LOG
+
+
+class WebSocketDispatcher:
+    def __init__(self, max_pending: int = 1024, put_timeout: float = 5):
+        """
+        Schedules WebSocket sends from any thread onto the event loop that
+        serves the WebSockets.
+        @param max_pending: Maximum sends waiting to complete; callers on other
+            threads block until a send completes when this is reached
+        @param put_timeout: Seconds to wait for a pending send to complete
+            before dropping a new send
+        """
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._slots = BoundedSemaphore(max_pending)
+        self._counters = {"sent": 0, "dropped": 0, "errors": 0}
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counts of dispatched sends.
+        """
+        return dict(self._counters)
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """
+        Bind this dispatcher to the loop serving WebSockets.
+        @param loop: Event loop to schedule sends on; defaults to the running
+            loop
+        """
+        loop = loop or asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        self._loop = loop
+        self._loop_thread = None
+        loop.call_soon_threadsafe(self._set_loop_thread)
+
+    def _set_loop_thread(self):
+        self._loop_thread = get_ident()
+
+    def dispatch(self, send: Coroutine) -> Optional[Future]:
+        """
+        Schedule a send on the bound event loop. This is safe to call from any
+        thread, including the loop's own thread.
+        @param send: Coroutine that sends to a WebSocket
+        @return: Future resolved when the send completes, None if it was
+            dropped
+        """
+        if not self._loop or self._loop.is_closed():
+            LOG.error("Dispatcher is not bound to a running event loop")
+            return self._drop(send)
+        on_loop = get_ident() == self._loop_thread
+        # Never block the loop itself; only other threads wait for a slot
+        if not self._slots.acquire(blocking=not on_loop,
+                                   timeout=None if on_loop else
+                                   self.put_timeout):
+            LOG.warning(f"{self.max_pending} sends pending; dropping send")
+            return self._drop(send)
+        return asyncio.run_coroutine_threadsafe(self._send(send), self._loop)
+
+    def _drop(self, send: Coroutine) -> None:
+        send.close()
+        self._counters["dropped"] += 1
+        return None
+
+    async def _send(self, send: Coroutine):
+        try:
+            await send
+            self._counters["sent"] += 1
+        except Exception as e:
+            self._counters["errors"] += 1
+            LOG.error(f"Failed to send to WebSocket: {e}")
+        finally:
+            self._slots.release()
+
+
+class SessionWriter:
+    overflow_policies = ("drop_oldest", "disconnect", "coalesce")
+
+    def __init__(self, socket: WebSocket, max_queued: int = 64,
+                 overflow_policy: str = "drop_oldest"):
+        """
+        Queues messages for one WebSocket and sends them in order from a single
+        writer task, so a slow client only delays its own messages. Messages
+        are queued with the same `send_text` and `send_bytes` methods as a
+        WebSocket and must be called on the loop serving the WebSocket.
+        @param socket: Client WebSocket to write to
+        @param max_queued: Maximum messages waiting to be sent
+        @param overflow_policy: What to do when the queue is full:
+            `drop_oldest` drops the oldest queued message,
+            `disconnect` closes the WebSocket,
+            `coalesce` replaces a queued message of the same type and
+            otherwise drops the oldest message
+        """
+        if overflow_policy not in self.overflow_policies:
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+        self.socket = socket
+        self.max_queued = max_queued
+        self.overflow_policy = overflow_policy
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._counters = {"sent": 0, "dropped": 0, "coalesced": 0,
+                          "max_depth": 0}
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    @property
+    def stats(self) -> dict:
+        """
+        Queue depth and counts of messages handled for this session.
+        """
+        return {"depth": len(self._queue), **self._counters}
+
+    async def send_text(self, data: str, coalesce_key: Optional[str] = None):
+        """
+        Queue a text message.
+        @param data: Text to send
+        @param coalesce_key: Messages with the same key may replace each other
+            when the queue is full
+        """
+        self._put(data, coalesce_key)
+
+    async def send_bytes(self, data: bytes):
+        """
+        Queue a binary message.
+        @param data: Bytes to send
+        """
+        self._put(data, None)
+
+    async def send_group(self, messages: List[Union[str, bytes]]):
+        """
+        Queue messages that must be sent together and in order, i.e. a
+        response followed by its binary audio. The group counts as one queued
+        message, so the overflow policy drops or keeps all of it.
+        @param messages: Text and binary messages to send
+        """
+        self._put(list(messages), None)
+
+    def _put(self, data: Union[str, bytes, List[Union[str, bytes]]],
+             coalesce_key: Optional[str]):
+        if self._closed:
+            self._counters["dropped"] += 1
+            return
+        if len(self._queue) >= self.max_queued:
+            if self.overflow_policy == "disconnect":
+                LOG.warning(f"Disconnecting slow client with "
+                            f"{len(self._queue)} queued messages")
+                self._counters["dropped"] += len(self._queue) + 1
+                self.close(disconnect=True)
+                return
+            if self.overflow_policy == "coalesce" and coalesce_key:
+                for queued in reversed(self._queue):
+                    if queued[1] == coalesce_key:
+                        queued[0] = data
+                        self._counters["coalesced"] += 1
+                        return
+            self._queue.popleft()
+            self._counters["dropped"] += 1
+        self._queue.append([data, coalesce_key])
+        self._counters["max_depth"] = max(self._counters["max_depth"],
+                                          len(self._queue))
+        self._ready.set()
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+            data, _ = self._queue.popleft()
+            try:
+                for message in data if isinstance(data, list) else [data]:
+                    if isinstance(message, bytes):
+                        await self.socket.send_bytes(message)
+                    else:
+                        await self.socket.send_text(message)
+                self._counters["sent"] += 1
+            except Exception as e:
+                LOG.warning(f"Stopping writer after failed send: {e}")
+                self._counters["dropped"] += len(self._queue) + 1
+                self.close()
+                return
+
+    def close(self, disconnect: bool = False):
+        """
+        Stop sending queued messages.
+        @param disconnect: If True, also close the WebSocket
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.clear()
+        self._task.cancel()
+        if disconnect:
+            asyncio.get_running_loop().create_task(self._disconnect())
+
+    async def _disconnect(self):
+        try:
+            await self.socket.close(code=1008, reason="Client too slow")
+        except Exception as e:
+            LOG.debug(f"Failed to close socket: {e}")
@@ -0,0 +1,149 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+
+class TestAudioRingBuffer(unittest.TestCase):
+    def test_write_read(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(16)
+        self.assertIsNone(buffer.read(4))
+        self.assertEqual(buffer.write(b"abcdef"), 0)
+        self.assertEqual(buffer.unread, 6)
+        self.assertEqual(bytes(buffer.read(4)), b"abcd")
+        self.assertIsNone(buffer.read(4))
+        self.assertEqual(bytes(buffer.read(2)), b"ef")
+        self.assertEqual(buffer.unread, 0)
+
+    def test_read_zero_copy(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(16)
+        buffer.write(b"abcd")
+        view = buffer.read(4)
+        self.assertIsInstance(view, memoryview)
+        self.assertIs(view.obj, buffer._buffer)
+
+    def test_read_wrapped(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(8)
+        buffer.write(b"abcdef")
+        self.assertEqual(bytes(buffer.read(4)), b"abcd")
+        self.assertEqual(bytes(buffer.read(2)), b"ef")
+        buffer.write(b"ghij")
+        view = buffer.read(4)
+        self.assertEqual(bytes(view), b"ghij")
+        self.assertIsNot(view.obj, buffer._buffer)
+        self.assertEqual(buffer.stats["overruns"], 0)
+
+    def test_overrun_drops_oldest(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(8)
+        buffer.write(b"abcdef")
+        self.assertEqual(buffer.write(b"ghij"), 2)
+        self.assertEqual(bytes(buffer.read(8)), b"cdefghij")
+        self.assertEqual(buffer.stats, {"capacity": 8, "buffered": 0,
+                                        "overruns": 1, "dropped_bytes": 2})
+
+        # A write larger than the buffer keeps only the newest audio
+        buffer.clear()
+        self.assertEqual(buffer.write(b"0123456789"), 2)
+        self.assertEqual(bytes(buffer.read(8)), b"23456789")
+
+    def test_overrun_frame_aligned(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(9, frame_size=2)
+        self.assertEqual(buffer.capacity, 8)
+        buffer.write(b"abcdef")
+        self.assertEqual(buffer.write(b"ghi"), 2)
+        self.assertEqual(buffer.unread, 7)
+        self.assertEqual(bytes(buffer.read(7)), b"cdefghi")
+
+    def test_held_view_not_overwritten(self):
+        from neon_hana.audio_buffer import AudioRingBuffer
+        buffer = AudioRingBuffer(8)
+        buffer.write(b"abcd")
+        view = buffer.read(4)
+        self.assertEqual(buffer.write(b"efghijkl"), 4)
+        self.assertEqual(bytes(view), b"abcd")
+        self.assertEqual(bytes(buffer.read(4)), b"ijkl")
+
+
+class TestStreamMicrophone(unittest.TestCase):
+    def test_read_chunk(self):
+        from threading import Thread
+        from neon_hana.streaming_client import StreamMicrophone
+        mic = StreamMicrophone(1)
+        self.assertEqual(mic.buffer.capacity, 32000)
+        self.assertIsNone(mic.read_chunk_nowait())
+        mic.write(bytes(mic.chunk_size - 1))
+        self.assertFalse(mic.has_chunks)
+        mic.write(b"\x01")
+        self.assertTrue(mic.has_chunks)
+        chunk = mic.read_chunk()
+        self.assertEqual(len(chunk), mic.chunk_size)
+        self.assertEqual(chunk[-1], 1)
+
+        # A blocked read returns None when the microphone is stopped
+        chunks = list()
+        thread = Thread(target=lambda: chunks.append(mic.read_chunk()))
+        thread.start()
+        mic.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(chunks, [None])
+
+    def test_reframe(self):
+        from neon_hana.streaming_client import StreamMicrophone
+        with self.assertRaises(ValueError):
+            StreamMicrophone(chunk_size=1023)
+        mic = StreamMicrophone(1, chunk_size=1024)
+        audio = bytes(range(256)) * 12
+        for i in range(0, len(audio), 100):
+            mic.write(audio[i:i + 100])
+        chunks = list()
+        while mic.has_chunks:
+            chunks.append(bytes(mic.read_chunk_nowait()))
+        self.assertEqual(chunks, [audio[:1024], audio[1024:2048],
+                                  audio[2048:]])
+
+        # A remainder is carried over to the next chunk
+        mic.write(audio[:1500])
+        self.assertEqual(bytes(mic.read_chunk_nowait()), audio[:1024])
+        self.assertIsNone(mic.read_chunk_nowait())
+        mic.write(audio[1500:2048])
+        self.assertEqual(bytes(mic.read_chunk_nowait()), audio[1024:2048])
+
+    def test_notify_full_chunks(self):
+        from unittest.mock import Mock
+        from neon_hana.streaming_client import (RemoteStreamHandler,
+                                                StreamMicrophone)
+        handler = Mock(mic=StreamMicrophone(1, chunk_size=1024),
+                       voice_loop=Mock(running=True))
+        RemoteStreamHandler.on_audio(handler, bytes(1000))
+        handler.scheduler.notify.assert_not_called()
+        RemoteStreamHandler.on_audio(handler, bytes(24))
+        handler.scheduler.notify.assert_called_once_with(handler)
@@ -0,0 +1,80 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from unittest.mock import Mock
+
+
+class TestAudioCodec(unittest.TestCase):
+    def test_get_decoder(self):
+        from neon_hana.audio_codec import get_decoder, SUPPORTED_CODECS
+        self.assertIsNone(get_decoder("pcm"))
+        with self.assertRaises(ValueError):
+            get_decoder("mp3")
+        # Opus is only advertised if it can be decoded
+        if "opus" in SUPPORTED_CODECS:
+            self.assertIsNotNone(get_decoder("opus"))
+        else:
+            with self.assertRaises(ValueError):
+                get_decoder("opus")
+
+    def test_stream_decode(self):
+        from neon_hana.streaming_client import StreamMicrophone
+        with self.assertRaises(ValueError):
+            StreamMicrophone(codec="mp3")
+        mic = StreamMicrophone(1, chunk_size=1024)
+        self.assertEqual(mic.stats["codec"], "pcm")
+        mic.decoder = Mock(decode=Mock(return_value=bytes(640)))
+        mic.write(b"packet")
+        mic.write(b"packet")
+        # Packets are decoded when audio is read, not when received
+        mic.decoder.decode.assert_not_called()
+        self.assertTrue(mic.has_chunks)
+        self.assertEqual(mic.stats["queued_packets"], 2)
+        self.assertEqual(len(mic.read_chunk_nowait()), 1024)
+        mic.decoder.decode.assert_called_with(b"packet")
+        self.assertEqual(mic.buffer.unread, 256)
+        self.assertFalse(mic.has_chunks)
+
+        # Packets that fail to decode are dropped
+        mic.decoder.decode.side_effect = ValueError("corrupt packet")
+        mic.write(b"corrupt")
+        self.assertIsNone(mic.read_chunk_nowait())
+        self.assertEqual(mic.buffer.unread, 256)
+        self.assertEqual(mic.stats["decode_errors"], 1)
+
+    def test_packet_queue_limit(self):
+        from neon_hana.streaming_client import StreamMicrophone
+        mic = StreamMicrophone(0.01, chunk_size=1024)
+        mic.decoder = Mock(decode=Mock(side_effect=lambda packet: packet))
+        for i in range(6):
+            mic.write(bytes([i]) * 2)
+        # The oldest packets are dropped when workers fall behind
+        self.assertEqual(mic.stats["dropped_packets"], 2)
+        mic.decode_pending()
+        self.assertEqual(bytes(mic.buffer.read(8)),
+                         b"\x02\x02\x03\x03\x04\x04\x05\x05")
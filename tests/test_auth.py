@@ -232,3 +232,152 @@ class TestClientManager(unittest.TestCase):
         self.client_manager._max_streaming_clients = False
         self.assertTrue(self.client_manager.check_connect_stream())
         self.assertEqual(self.client_manager._connected_streams, 5)
+
+    def test_multiple_workers(self):
+        from tempfile import TemporaryDirectory
+        from neon_hana.auth.rate_limit_storage import SQLiteStorage
+        with TemporaryDirectory() as tmp:
+            client_manager = self.ClientManager(
+                {"server_workers": 4, "max_streaming_clients": 10,
+                 "rate_limit_db_path": f"{tmp}/rate_limits.db"})
+            self.assertIsInstance(client_manager.rate_limiter._storage,
+                                  SQLiteStorage)
+            self.assertEqual(client_manager._max_streaming_clients, 2)
+            client_manager.rate_limiter._storage.close()
+
+            # Each worker allows at least one stream
+            client_manager = self.ClientManager(
+                {"server_workers": 4, "max_streaming_clients": 2,
+                 "rate_limit_db_path": f"{tmp}/rate_limits.db"})
+            self.assertEqual(client_manager._max_streaming_clients, 1)
+            client_manager.rate_limiter._storage.close()
+
+
+class TestClientManagerAsync(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.auth.client_manager import ClientManager
+    secret = "a800445648142061fc238d1f84e96200da87f4f9f784108ac90db8b4391b117b"
+
+    async def test_validate_auth_async(self):
+        from tempfile import TemporaryDirectory
+        from unittest.mock import patch
+        client_manager = self.ClientManager({"access_token_secret":
+                                             self.secret,
+                                             "refresh_token_secret":
+                                             self.secret})
+        auth = await client_manager.check_auth_request_async(
+            str(uuid4()), "guest")
+        with patch("asyncio.to_thread") as to_thread:
+            self.assertTrue(await client_manager.validate_auth_async(
+                auth['access_token'], "127.0.0.1"))
+            # Rate limits in memory are checked on the event loop
+            to_thread.assert_not_called()
+
+        with TemporaryDirectory() as tmp:
+            client_manager = self.ClientManager(
+                {"access_token_secret": self.secret,
+                 "refresh_token_secret": self.secret,
+                 "requests_per_minute": 1, "rate_limit_backend": "sqlite",
+                 "rate_limit_db_path": f"{tmp}/rate_limits.db"})
+            auth = await client_manager.check_auth_request_async(
+                str(uuid4()), "guest")
+            self.assertTrue(await client_manager.validate_auth_async(
+                auth['access_token'], "127.0.0.1"))
+            with self.assertRaises(HTTPException) as e:
+                await client_manager.validate_auth_async(
+                    auth['access_token'], "127.0.0.1")
+            self.assertEqual(e.exception.status_code, 429)
+            client_manager.rate_limiter._storage.close()
+
+
+class TestUserTokenAuth(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.auth.client_manager import ClientManager, UserTokenAuth
+    secret = "a800445648142061fc238d1f84e96200da87f4f9f784108ac90db8b4391b117b"
+
+    async def test_permission(self):
+        from unittest.mock import Mock, patch
+        from fastapi.security import HTTPAuthorizationCredentials
+        client_manager = self.ClientManager(
+            {"access_token_secret": self.secret,
+             "refresh_token_secret": self.secret,
+             "node_username": "node", "node_password": "node"})
+        guest = client_manager.check_auth_request(str(uuid4()), "guest")
+        node = client_manager.check_auth_request(str(uuid4()), "node", "node")
+        request = Mock()
+        request.client.host = "127.0.0.1"
+        any_client = self.UserTokenAuth(client_manager)
+        node_client = self.UserTokenAuth(client_manager, permission="node")
+
+        for auth, token, allowed in (
+                (any_client, guest['access_token'], True),
+                (node_client, guest['access_token'], False),
+                (node_client, node['access_token'], True)):
+            credentials = HTTPAuthorizationCredentials(scheme="Bearer",
+                                                       credentials=token)
+            with patch("fastapi.security.HTTPBearer.__call__",
+                       return_value=credentials):
+                if allowed:
+                    self.assertEqual(await auth(request), token)
+                    continue
+                with self.assertRaises(HTTPException) as e:
+                    await auth(request)
+                self.assertEqual(e.exception.status_code, 401)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def test_shared_limits(self):
+        from tempfile import TemporaryDirectory
+        from token_throttler import TokenBucket, TokenThrottler
+        from neon_hana.auth.rate_limit_storage import SQLiteStorage
+        with TemporaryDirectory() as tmp:
+            storages = [SQLiteStorage(f"{tmp}/rate_limits.db")
+                        for _ in range(2)]
+            workers = [TokenThrottler(cost=1, storage=storage)
+                       for storage in storages]
+            for worker in workers:
+                self.assertIsNone(worker.get_all_buckets("127.0.0.1"))
+                worker.add_bucket("127.0.0.1", TokenBucket(60, 3))
+            self.assertTrue(workers[0].consume("127.0.0.1"))
+            self.assertTrue(workers[1].consume("127.0.0.1"))
+            # Adding a bucket in another process does not reset it
+            workers[1].add_bucket("127.0.0.1", TokenBucket(60, 3))
+            bucket = workers[1].get_bucket("127.0.0.1", "60")
+            self.assertEqual(bucket.tokens, 1)
+            self.assertTrue(workers[0].consume("127.0.0.1"))
+            self.assertFalse(workers[1].consume("127.0.0.1"))
+            self.assertFalse(workers[0].consume("127.0.0.1"))
+
+            # Buckets are replenished for every process
+            bucket = workers[0].get_bucket("127.0.0.1", "60")
+            bucket.last_replenished -= 60
+            storages[0]._save(bucket, "60")
+            self.assertTrue(workers[1].consume("127.0.0.1"))
+
+            workers[0].remove_all_buckets("127.0.0.1")
+            self.assertIsNone(workers[0].get_all_buckets("127.0.0.1"))
+            for storage in storages:
+                storage.close()
+
+    def test_busy_database(self):
+        import sqlite3
+        from tempfile import TemporaryDirectory
+        from time import monotonic
+        from token_throttler import TokenBucket, TokenThrottler
+        from neon_hana.auth.rate_limit_storage import SQLiteStorage
+        with TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(f"{tmp}/rate_limits.db", timeout=0.05)
+            throttler = TokenThrottler(cost=1, storage=storage)
+            throttler.add_bucket("127.0.0.1", TokenBucket(60, 1))
+            self.assertTrue(throttler.consume("127.0.0.1"))
+
+            # Another process holding the write lock does not delay requests
+            # past the timeout
+            other = sqlite3.connect(f"{tmp}/rate_limits.db",
+                                    isolation_level=None)
+            other.execute("BEGIN IMMEDIATE")
+            start = monotonic()
+            self.assertTrue(throttler.consume("127.0.0.1"))
+            self.assertLess(monotonic() - start, 1)
+            other.execute("ROLLBACK")
+            other.close()
+            self.assertFalse(throttler.consume("127.0.0.1"))
+            storage.close()
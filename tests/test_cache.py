@@ -0,0 +1,538 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import unittest
+
+from os import listdir
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.cache.single_flight import SingleFlight
+
+    async def test_run(self):
+        single_flight = self.SingleFlight()
+        calls = list()
+
+        async def _call(value):
+            calls.append(value)
+            await asyncio.sleep(0.1)
+            return value
+
+        results = await asyncio.gather(
+            *[single_flight.run("test", "key", lambda: _call("key"))
+              for _ in range(5)],
+            single_flight.run("test", "other", lambda: _call("other")),
+            single_flight.run("other", "key", lambda: _call("namespace")))
+        self.assertEqual(results, ["key"] * 5 + ["other", "namespace"])
+        self.assertEqual(calls, ["key", "other", "namespace"])
+        self.assertEqual(single_flight.stats,
+                         {"test": {"calls": 2, "coalesced": 4},
+                          "other": {"calls": 1, "coalesced": 0}})
+        self.assertEqual(single_flight.in_flight, 0)
+
+        # Completed calls are not reused
+        self.assertEqual(await single_flight.run("test", "key",
+                                                 lambda: _call("new")), "new")
+
+    async def test_run_exception(self):
+        single_flight = self.SingleFlight()
+
+        async def _call():
+            await asyncio.sleep(0.1)
+            raise TimeoutError("test")
+
+        results = await asyncio.gather(
+            *[single_flight.run("test", "key", _call) for _ in range(3)],
+            return_exceptions=True)
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, TimeoutError)
+        self.assertEqual(single_flight.stats["test"]["calls"], 1)
+
+    async def test_run_cancelled_caller(self):
+        single_flight = self.SingleFlight()
+
+        async def _call():
+            await asyncio.sleep(0.2)
+            return "result"
+
+        first = asyncio.create_task(single_flight.run("test", "key", _call))
+        second = asyncio.create_task(single_flight.run("test", "key", _call))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        self.assertEqual(await second, "result")
+
+
+class TestResponseCache(unittest.TestCase):
+    from neon_hana.cache.response_cache import ResponseCache
+
+    def test_get_put(self):
+        cache = self.ResponseCache(max_bytes=100)
+        self.assertIsNone(cache.get("test", "key"))
+        cache.put("test", "key", {"value": 1}, 60, 10)
+        self.assertEqual(cache.get("test", "key"), {"value": 1})
+        self.assertIsNone(cache.get("other", "key"))
+        self.assertEqual(cache.stats["entries"], 1)
+        self.assertEqual(cache.stats["bytes"], 10)
+        self.assertEqual(cache.stats["namespaces"]["test"]["hits"], 1)
+        self.assertEqual(cache.stats["namespaces"]["test"]["misses"], 1)
+        self.assertEqual(cache.stats["namespaces"]["other"]["hits"], 0)
+        self.assertEqual(cache.stats["namespaces"]["other"]["misses"], 1)
+
+        # Replacing an entry does not double-count its size
+        cache.put("test", "key", {"value": 2}, 60, 20)
+        self.assertEqual(cache.get("test", "key"), {"value": 2})
+        self.assertEqual(cache.stats["bytes"], 20)
+
+        cache.clear()
+        self.assertEqual(cache.stats["entries"], 0)
+        self.assertEqual(cache.stats["bytes"], 0)
+
+    def test_expiration(self):
+        from time import sleep
+        cache = self.ResponseCache()
+        cache.put("test", "key", "value", 0.1, 10)
+        self.assertEqual(cache.get("test", "key"), "value")
+        sleep(0.15)
+        self.assertIsNone(cache.get("test", "key"))
+        self.assertEqual(cache.stats["bytes"], 0)
+
+    def test_lru_eviction(self):
+        cache = self.ResponseCache(max_bytes=30)
+        for key in ("one", "two", "three"):
+            cache.put("test", key, key, 60, 10)
+        # Use "one" so "two" is least recently used
+        self.assertEqual(cache.get("test", "one"), "one")
+        cache.put("test", "four", "four", 60, 10)
+        self.assertIsNone(cache.get("test", "two"))
+        for key in ("one", "three", "four"):
+            self.assertEqual(cache.get("test", key), key)
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(cache.stats["bytes"], 30)
+
+        # Values larger than the cache are not stored
+        cache.put("test", "big", "big", 60, 31)
+        self.assertIsNone(cache.get("test", "big"))
+        self.assertEqual(cache.stats["entries"], 3)
+
+    def test_approximate_hits(self):
+        cache = self.ResponseCache()
+        cache.put("test", "approx", "value", 60, 10, exact_key="exact_1")
+        self.assertEqual(cache.get("test", "approx", "exact_1"), "value")
+        self.assertEqual(cache.get("test", "approx", "exact_2"), "value")
+        self.assertEqual(cache.stats["namespaces"]["test"]["hits"], 2)
+        self.assertEqual(
+            cache.stats["namespaces"]["test"]["approximate_hits"], 1)
+
+    def test_get_geohash(self):
+        from neon_hana.cache.response_cache import get_geohash
+        self.assertEqual(get_geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(get_geohash(47.6815, -122.2087, 6),
+                         get_geohash(47.6825, -122.2090, 6))
+        self.assertNotEqual(get_geohash(47.6815, -122.2087, 6),
+                            get_geohash(47.6815, -122.1087, 6))
+
+
+class TestResponseCacheRefresh(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.cache.response_cache import ResponseCache
+
+    async def test_stale_while_revalidate(self):
+        cache = self.ResponseCache()
+        values = iter(range(10))
+        calls = list()
+
+        async def _fetch():
+            calls.append(True)
+            await asyncio.sleep(0.1)
+            return next(values), 10
+
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2, 10), 0)
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2, 10), 0)
+        self.assertEqual(len(calls), 1)
+
+        # Stale value is returned immediately and refreshed once
+        await asyncio.sleep(0.25)
+        results = await asyncio.gather(
+            *[cache.fetch("test", "key", _fetch, 0.2, 10) for _ in range(3)])
+        self.assertEqual(results, [0, 0, 0])
+        self.assertEqual(cache.stats["refreshing"], 1)
+        await asyncio.sleep(0.15)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats["refreshing"], 0)
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2, 10), 1)
+        stats = cache.stats["namespaces"]["test"]
+        self.assertEqual(stats["stale_hits"], 3)
+        self.assertEqual(stats["refreshes"], 1)
+
+        # Values past the stale window are fetched before returning
+        cache.put("test", "key", "expired", 0.1, 10, stale_ttl=0.1)
+        await asyncio.sleep(0.25)
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2, 10), 2)
+        self.assertEqual(cache.stats["namespaces"]["test"]["stale_hits"], 3)
+
+    async def test_refresh_errors(self):
+        cache = self.ResponseCache()
+
+        async def _fetch():
+            return "value", 10
+
+        async def _fail():
+            raise TimeoutError("test")
+
+        await cache.fetch("test", "key", _fetch, 0.1, 10)
+        await asyncio.sleep(0.15)
+        self.assertEqual(await cache.fetch("test", "key", _fail, 0.1, 10),
+                         "value")
+        await asyncio.sleep(0.05)
+        self.assertEqual(cache.stats["namespaces"]["test"]["refresh_errors"],
+                         1)
+        # Failed refresh leaves the stale value to retry later
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.1, 10),
+                         "value")
+
+    async def test_refresh_ahead(self):
+        cache = self.ResponseCache(refresh_ahead=0.5, refresh_min_hits=2)
+        values = iter(range(10))
+
+        async def _fetch():
+            return next(values), 10
+
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2), 0)
+        await asyncio.sleep(0.12)
+        # Not enough hits to refresh yet
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2), 0)
+        self.assertEqual(cache.stats["refreshing"], 0)
+        # Hot entry is refreshed before it expires
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2), 0)
+        await asyncio.sleep(0.01)
+        self.assertEqual(await cache.fetch("test", "key", _fetch, 0.2), 1)
+        self.assertEqual(cache.stats["namespaces"]["test"]["misses"], 1)
+
+
+class TestTTSCache(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.cache.tts_cache import TTSCache
+
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_get_key(self):
+        key = self.TTSCache.get_key("Hello  world", "en-us", "female")
+        self.assertEqual(key, self.TTSCache.get_key(" Hello world\n",
+                                                    "en-US", "Female"))
+        self.assertNotEqual(key, self.TTSCache.get_key("hello world",
+                                                       "en-us", "female"))
+        self.assertNotEqual(key, self.TTSCache.get_key("Hello world",
+                                                       "en-us", "male"))
+
+    async def test_memory_only(self):
+        cache = self.TTSCache(cache_dir=None)
+        self.assertIsNone(await cache.get("key"))
+        await cache.put("key", b"audio")
+        self.assertEqual(await cache.get("key"), b"audio")
+        self.assertEqual(cache.stats["memory_hits"], 1)
+        self.assertEqual(cache.stats["misses"], 1)
+        self.assertEqual(cache.stats["disk"]["entries"], 0)
+
+    async def test_disk_tier(self):
+        cache = self.TTSCache(cache_dir=self.cache_dir.name)
+        await cache.put("key", b"audio")
+        self.assertEqual(listdir(self.cache_dir.name), ["key.wav"])
+
+        # A new cache (i.e. after restart) is served from disk
+        cache = self.TTSCache(cache_dir=self.cache_dir.name)
+        self.assertEqual(cache.stats["disk"]["entries"], 1)
+        self.assertEqual(await cache.get("key"), b"audio")
+        self.assertEqual(cache.stats["disk_hits"], 1)
+
+        # Disk hits are promoted to memory
+        self.assertEqual(await cache.get("key"), b"audio")
+        self.assertEqual(cache.stats["memory_hits"], 1)
+
+    async def test_disk_eviction(self):
+        cache = self.TTSCache(memory_max_bytes=0,
+                              cache_dir=self.cache_dir.name,
+                              disk_max_bytes=10)
+        await cache.put("first", b"12345")
+        await cache.put("second", b"12345")
+        # Use `first` so that `second` is least recently used
+        self.assertIsNotNone(await cache.get("first"))
+        await cache.put("third", b"12345")
+        self.assertEqual(sorted(listdir(self.cache_dir.name)),
+                         ["first.wav", "third.wav"])
+        self.assertIsNone(await cache.get("second"))
+        self.assertEqual(cache.stats["disk"]["bytes"], 10)
+
+
+class TestSharedTTSCache(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.cache.tts_cache import SharedTTSCache
+
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _get_files(self):
+        return sorted(f for f in listdir(self.cache_dir.name)
+                      if f.endswith(".wav"))
+
+    async def test_shared_disk_tier(self):
+        worker_1 = self.SharedTTSCache(memory_max_bytes=0,
+                                       cache_dir=self.cache_dir.name,
+                                       disk_max_bytes=10)
+        worker_2 = self.SharedTTSCache(memory_max_bytes=0,
+                                       cache_dir=self.cache_dir.name,
+                                       disk_max_bytes=10)
+        await worker_1.put("first", b"12345")
+        await worker_2.put("second", b"12345")
+        # Audio cached by one worker is served to another
+        self.assertEqual(await worker_2.get("first"), b"12345")
+        self.assertEqual(worker_2.stats["disk_hits"], 1)
+
+        # Workers share one budget and evict the least recently used audio
+        await worker_1.put("third", b"12345")
+        self.assertEqual(self._get_files(), ["first.wav", "third.wav"])
+        self.assertEqual(worker_1.stats["disk"]["bytes"], 10)
+        self.assertIsNone(await worker_2.get("second"))
+        self.assertEqual(await worker_2.get("third"), b"12345")
+        for worker in (worker_1, worker_2):
+            worker.close()
+
+    async def test_index_existing_files(self):
+        from neon_hana.cache.tts_cache import TTSCache
+        cache = TTSCache(cache_dir=self.cache_dir.name)
+        await cache.put("key", b"audio")
+        shared = self.SharedTTSCache(cache_dir=self.cache_dir.name)
+        self.assertEqual(shared.stats["disk"]["entries"], 1)
+        self.assertEqual(await shared.get("key"), b"audio")
+        shared.close()
+
+    def test_get_tts_cache(self):
+        from neon_hana.cache.tts_cache import TTSCache, get_tts_cache
+        cache = get_tts_cache({"tts_cache_dir": self.cache_dir.name})
+        self.assertNotIsInstance(cache, self.SharedTTSCache)
+        self.assertIsInstance(get_tts_cache({"server_workers": 2,
+                                             "tts_cache_dir": None}),
+                              TTSCache)
+        cache = get_tts_cache({"server_workers": 2,
+                               "tts_cache_dir": self.cache_dir.name})
+        self.assertIsInstance(cache, self.SharedTTSCache)
+        cache.close()
+        with self.assertRaises(ValueError):
+            get_tts_cache({"tts_cache_backend": "redis"})
+
+
+class TestMemorySessionStore(unittest.TestCase):
+    from neon_hana.cache.session_store import MemorySessionStore
+
+    def test_get_put(self):
+        store = self.MemorySessionStore()
+        self.assertIsNone(store.get("session"))
+        store.put("session", {"session_id": "session"})
+        self.assertEqual(store.get("session"), {"session_id": "session"})
+        store.put("session", {"session_id": "session", "updated": True})
+        self.assertTrue(store.get("session")["updated"])
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats["hits"], 2)
+        self.assertEqual(store.stats["misses"], 1)
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+    def test_expiration(self):
+        from time import sleep
+        store = self.MemorySessionStore(ttl=0.1)
+        store.put("one", {})
+        store.put("two", {})
+        sleep(0.06)
+        # Using a session renews its TTL
+        self.assertEqual(store.get("one"), {})
+        sleep(0.06)
+        self.assertEqual(store.get("one"), {})
+        self.assertIsNone(store.get("two"))
+        self.assertEqual(store.stats["expirations"], 1)
+
+    def test_lru_eviction(self):
+        store = self.MemorySessionStore(max_entries=2)
+        store.put("one", {})
+        store.put("two", {})
+        store.get("one")
+        store.put("three", {})
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get("two"))
+        self.assertIsNotNone(store.get("one"))
+        self.assertIsNotNone(store.get("three"))
+        self.assertEqual(store.stats["evictions"], 1)
+
+    def test_concurrent_access(self):
+        from threading import Thread
+        store = self.MemorySessionStore(max_entries=8, ttl=0.001)
+        errors = list()
+
+        def _use_store(worker):
+            try:
+                for i in range(2000):
+                    store.put(f"{worker}-{i % 16}", {})
+                    store.get(f"{worker}-{(i + 1) % 16}")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=_use_store, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(store), 8)
+
+
+class TestSQLiteSessionStore(unittest.TestCase):
+    from neon_hana.cache.session_store import SQLiteSessionStore
+
+    def setUp(self):
+        self.db_dir = TemporaryDirectory()
+        self.path = f"{self.db_dir.name}/sessions.db"
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def test_shared_sessions(self):
+        from time import sleep
+        worker_1 = self.SQLiteSessionStore(self.path, cache_ttl=0.05)
+        worker_2 = self.SQLiteSessionStore(self.path, cache_ttl=0.05)
+        # Entries are counted when the store is pruned
+        worker_1.prune_interval = 1
+        self.assertIsNone(worker_2.get("session"))
+        worker_1.put("session", {"session_id": "session", "turn": 1})
+        self.assertEqual(worker_2.get("session"),
+                         {"session_id": "session", "turn": 1})
+
+        # Reads are cached locally for `cache_ttl`
+        worker_1.put("session", {"session_id": "session", "turn": 2})
+        self.assertEqual(worker_2.get("session")["turn"], 1)
+        sleep(0.06)
+        self.assertEqual(worker_2.get("session")["turn"], 2)
+        self.assertEqual(worker_2.stats["cache_hits"], 1)
+        self.assertEqual(worker_2.stats["hits"], 2)
+        self.assertEqual(worker_2.stats["misses"], 1)
+        self.assertEqual(worker_1.stats["entries"], 1)
+        # Stats do not query the database
+        reopened = self.SQLiteSessionStore(self.path)
+        self.assertEqual(reopened.stats["entries"], 1)
+        reopened.close()
+        with patch.object(worker_1, "_db") as db:
+            self.assertEqual(worker_1.stats["entries"], 1)
+            db.execute.assert_not_called()
+
+        # Stores with different tables do not share sessions
+        other = self.SQLiteSessionStore(self.path, "other")
+        self.assertIsNone(other.get("session"))
+        for store in (worker_1, worker_2, other):
+            store.close()
+
+    def test_expiration(self):
+        from time import sleep
+        store = self.SQLiteSessionStore(self.path, ttl=0.05, cache_ttl=0)
+        store.put("session", {})
+        sleep(0.06)
+        self.assertIsNone(store.get("session"))
+        self.assertEqual(store.stats["entries"], 0)
+        store.close()
+
+    def test_lru_eviction(self):
+        store = self.SQLiteSessionStore(self.path, max_entries=2,
+                                        cache_ttl=0)
+        store.prune_interval = 1
+        store.put("one", {})
+        store.put("two", {})
+        store.get("one")
+        store.put("three", {})
+        self.assertEqual(store.stats["entries"], 2)
+        self.assertIsNone(store.get("two"))
+        self.assertIsNotNone(store.get("one"))
+        self.assertEqual(store.stats["evictions"], 1)
+        store.clear()
+        self.assertEqual(store.stats["entries"], 0)
+        store.close()
+
+    def test_get_session_store(self):
+        from neon_hana.cache.session_store import (get_session_store,
+                                                   MemorySessionStore)
+        self.assertIsInstance(get_session_store({}), MemorySessionStore)
+        store = get_session_store({"session_backend": "sqlite",
+                                   "session_db_path": self.path})
+        self.assertIsInstance(store, self.SQLiteSessionStore)
+        store.close()
+        # Worker processes share sessions by default
+        store = get_session_store({"server_workers": 2,
+                                   "session_db_path": self.path})
+        self.assertIsInstance(store, self.SQLiteSessionStore)
+        store.close()
+        with self.assertRaises(ValueError):
+            get_session_store({"session_backend": "redis"})
+
+
+class TestSessionStoreAsync(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.cache.session_store import (MemorySessionStore,
+                                               SQLiteSessionStore)
+
+    async def test_memory_store(self):
+        store = self.MemorySessionStore()
+        self.assertIsNone(await store.aget("session"))
+        await store.aput("session", {"session_id": "session"})
+        self.assertEqual(await store.aget("session"),
+                         {"session_id": "session"})
+
+    async def test_sqlite_store(self):
+        with TemporaryDirectory() as db_dir:
+            path = f"{db_dir}/sessions.db"
+            worker_1 = self.SQLiteSessionStore(path)
+            worker_2 = self.SQLiteSessionStore(path)
+            self.assertIsNone(await worker_2.aget("session"))
+            await worker_1.aput("session", {"session_id": "session"})
+            self.assertEqual(await worker_2.aget("session"),
+                             {"session_id": "session"})
+            # Cached sessions are returned without a database read
+            with patch("asyncio.to_thread") as to_thread:
+                self.assertEqual(await worker_2.aget("session"),
+                                 {"session_id": "session"})
+                to_thread.assert_not_called()
+            self.assertEqual(worker_2.stats["cache_hits"], 1)
+
+            # The event loop does not wait while a thread holds the lock
+            worker_2._lock.acquire()
+            task = asyncio.create_task(worker_2.aget("session"))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            worker_2._lock.release()
+            self.assertEqual(await task, {"session_id": "session"})
+            worker_1.close()
+            worker_2.close()
@@ -0,0 +1,158 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import numpy as np
+
+from unittest.mock import Mock, patch
+
+
+def _precise_lite_available() -> bool:
+    try:
+        import precise_lite_runner
+        return True
+    except ImportError:
+        return False
+
+
+class FakeInterpreter:
+    def __init__(self):
+        self.shape = [1, 29, 13]
+        self.inputs = list()
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.shape)}]
+
+    def get_output_details(self):
+        return [{"index": 1}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = shape
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        assert list(value.shape) == list(self.shape)
+        self.inputs.append(value)
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        # Loud audio has a high energy coefficient in the latest frame
+        return (self.inputs[-1][:, -1, 0] > 0).astype(float)[:, np.newaxis]
+
+
+class TestHotwordEngines(unittest.TestCase):
+    def test_get_shared_engine(self):
+        from neon_hana.hotword_engines import get_shared_engine
+        engine = Mock()
+        self.assertIs(get_shared_engine(engine), engine)
+        engine.stop.assert_not_called()
+
+
+@unittest.skipUnless(_precise_lite_available(), "precise-lite not installed")
+class TestSharedPreciseLite(unittest.TestCase):
+    loud = (np.sin(np.arange(2048 * 4) / 5) * 20000).astype("<i2").tobytes()
+    quiet = np.random.default_rng(0).normal(0, 20, 2048 * 4)\
+        .astype("<i2").tobytes()
+
+    def setUp(self):
+        runner_patch = patch("precise_lite_runner.runner.TFLiteRunner")
+        runner = runner_patch.start()
+        self.addCleanup(runner_patch.stop)
+        self.interpreter = FakeInterpreter()
+        runner.return_value = Mock(interpreter=self.interpreter)
+
+    def test_stream_state(self):
+        from neon_hana.hotword_engines import SharedPreciseLite
+        engine = SharedPreciseLite("model.tflite", trigger_level=3)
+        loud_state = engine.new_stream_state()
+        quiet_state = engine.new_stream_state()
+        results = [engine.detect_batch([loud_state, quiet_state],
+                                       [self.loud[i:i + 4096],
+                                        self.quiet[i:i + 4096]])
+                   for i in range(0, len(self.loud), 4096)]
+        # Each chunk is two predictions; the loud stream triggers once
+        # enough predictions are over the threshold
+        self.assertEqual([loud for loud, _ in results],
+                         [False, False, True, False])
+        self.assertFalse(any(quiet for _, quiet in results))
+        # Predictions for both streams run in one model call per chunk
+        self.assertEqual([len(i) for i in self.interpreter.inputs],
+                         [4, 4, 4, 4])
+
+        # Partial chunks are kept until a full prediction chunk is buffered
+        new_state = engine.new_stream_state()
+        self.assertEqual(engine.detect_batch([new_state], [bytes(1024)]),
+                         [False])
+        self.assertEqual(len(self.interpreter.inputs), 4)
+        self.assertEqual(len(new_state.audio), 1024)
+        engine.detect_batch([new_state], [bytes(1024)])
+        self.assertEqual(len(self.interpreter.inputs[-1]), 1)
+        self.assertEqual(new_state.audio, b"")
+
+    def test_batch_padding(self):
+        from neon_hana.hotword_engines import SharedPreciseLite
+        engine = SharedPreciseLite("model.tflite")
+        states = [engine.new_stream_state() for _ in range(3)]
+        engine.detect_batch(states, [self.loud[:2048]] * 3)
+        # Batches are padded to a power of two
+        self.assertEqual(len(self.interpreter.inputs[-1]), 4)
+        engine.detect_batch(states[:2], [self.loud[:2048]] * 2)
+        self.assertEqual(len(self.interpreter.inputs[-1]), 2)
+
+    def test_unbatched_model(self):
+        from neon_hana.hotword_engines import SharedPreciseLite
+        self.interpreter.resize_tensor_input = Mock(
+            side_effect=ValueError("Cannot resize"))
+        engine = SharedPreciseLite("model.tflite", trigger_level=3)
+        loud_state = engine.new_stream_state()
+        quiet_state = engine.new_stream_state()
+        results = [engine.detect_batch([loud_state, quiet_state],
+                                       [self.loud[i:i + 4096],
+                                        self.quiet[i:i + 4096]])
+                   for i in range(0, len(self.loud), 4096)]
+        # Models with a fixed batch size predict one input at a time
+        self.assertFalse(engine.batched)
+        self.assertEqual(results, [[False, False], [False, False],
+                                   [True, False], [False, False]])
+        self.assertEqual(len(self.interpreter.inputs), 16)
+
+    def test_from_plugin(self):
+        from neon_hana.hotword_engines import (SharedPreciseLite,
+                                               get_shared_engine)
+        plugin_class = type("PreciseLiteHotwordPlugin", (Mock,), dict())
+        plugin = plugin_class(precise_model="model.tflite", chunk_size=1024,
+                              trigger_level=5, sensitivity=0.7)
+        engine = get_shared_engine(plugin)
+        self.assertIsInstance(engine, SharedPreciseLite)
+        self.assertEqual((engine.model, engine.chunk_size,
+                          engine.trigger_level, engine.sensitivity),
+                         ("model.tflite", 1024, 5, 0.7))
+        plugin.stop.assert_called_once()
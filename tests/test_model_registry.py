@@ -0,0 +1,242 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from unittest.mock import Mock, patch
+
+from ovos_dinkum_listener.voice_loop.hotwords import (HotwordContainer,
+                                                      HotwordState)
+from ovos_plugin_manager.templates.hotwords import HotWordEngine
+from ovos_utils.fakebus import FakeBus
+
+
+class BufferedEngine(HotWordEngine):
+    def __init__(self):
+        HotWordEngine.__init__(self, "hey neon", {})
+        self.audio = b""
+        self.stopped = False
+
+    def update(self, chunk):
+        self.audio += chunk
+
+    def found_wake_word(self):
+        if self.audio.endswith(b"hey neon"):
+            self.audio = b""
+            return True
+        return False
+
+    def reset(self):
+        self.audio = b""
+
+    def shutdown(self):
+        self.stopped = True
+
+
+class StreamStateEngine(HotWordEngine):
+    def __init__(self):
+        HotWordEngine.__init__(self, "hey neon", {})
+
+    def new_stream_state(self):
+        return list()
+
+    def detect_batch(self, states, chunks):
+        results = list()
+        for state, chunk in zip(states, chunks):
+            state.append(chunk)
+            results.append(b"".join(state).endswith(b"hey neon"))
+        return results
+
+    def update(self, chunk):
+        raise AssertionError("Shared engines are run with stream state")
+
+    def found_wake_word(self):
+        raise AssertionError("Shared engines are run with stream state")
+
+
+class TestModelRegistry(unittest.TestCase):
+    from neon_hana.model_registry import ModelRegistry
+
+    def _patch_load(self, engine):
+        def _load(container):
+            container._plugins = {"hey_neon": {"engine": engine,
+                                               "listen": True}}
+            HotwordContainer._loaded.set()
+
+        load_patch = patch.object(HotwordContainer, "load_hotword_engines",
+                                  autospec=True, side_effect=_load)
+        self.addCleanup(load_patch.stop)
+        return load_patch.start()
+
+    def _patch_create(self):
+        create_patch = patch("neon_hana.model_registry.OVOSWakeWordFactory."
+                             "create_hotword",
+                             side_effect=lambda word: BufferedEngine())
+        self.addCleanup(create_patch.stop)
+        return create_patch.start()
+
+    @staticmethod
+    def _listen(registry, detector=None):
+        hotwords = registry.get_hotwords(FakeBus(), detector)
+        hotwords.state = HotwordState.LISTEN
+        return hotwords
+
+    @staticmethod
+    def _detect(hotwords, chunk):
+        hotwords.update(chunk)
+        return hotwords.found()
+
+    def test_get_hotwords(self):
+        engine = BufferedEngine()
+        load = self._patch_load(engine)
+        create = self._patch_create()
+        registry = self.ModelRegistry()
+        first = registry.get_hotwords(FakeBus())
+        second = registry.get_hotwords(FakeBus())
+        load.assert_called_once()
+        create.assert_called_once_with("hey_neon")
+        self.assertEqual(registry.stats["hotword_loads"], 1)
+        self.assertEqual(registry.stats["engine_loads"], 1)
+        self.assertEqual(registry.stats["streams"], 2)
+
+        # Stateful engines are loaded for each stream
+        self.assertIs(first.listen_words["hey_neon"], engine)
+        self.assertIsInstance(second.listen_words["hey_neon"],
+                              BufferedEngine)
+        self.assertIsNot(second.listen_words["hey_neon"], engine)
+        first.state = HotwordState.LISTEN
+        self.assertEqual(second.state, HotwordState.HOTWORD)
+
+        # Reloading is a no-op; shutdown only stops the stream's own engines
+        first.load_hotword_engines()
+        load.assert_called_once()
+        first.shutdown()
+        self.assertTrue(engine.stopped)
+        self.assertFalse(second.listen_words["hey_neon"].stopped)
+
+    def test_independent_streams(self):
+        self._patch_load(BufferedEngine())
+        self._patch_create()
+        registry = self.ModelRegistry()
+        detector = Mock()
+        first = self._listen(registry, detector)
+        second = self._listen(registry, detector)
+
+        self.assertIsNone(self._detect(first, b"hey "))
+        self.assertIsNone(self._detect(second, b"neon"))
+        self.assertIsNone(self._detect(second, b"hey "))
+        self.assertEqual(self._detect(first, b"neon"), "hey_neon")
+        self.assertIsNone(first.found())
+
+        # Resetting one stream does not reset another
+        first.reset()
+        self.assertEqual(self._detect(second, b"neon"), "hey_neon")
+        # Engines owned by a stream are not batched with other streams
+        detector.detect.assert_not_called()
+
+    def test_shared_engine_stream_state(self):
+        engine = StreamStateEngine()
+        self._patch_load(engine)
+        create = self._patch_create()
+        registry = self.ModelRegistry()
+        first = self._listen(registry)
+        second = self._listen(registry)
+        create.assert_not_called()
+        self.assertIs(first.listen_words["hey_neon"], engine)
+        self.assertIs(second.listen_words["hey_neon"], engine)
+
+        self.assertIsNone(self._detect(first, b"hey "))
+        self.assertIsNone(self._detect(second, b"neon"))
+        self.assertIsNone(self._detect(second, b"hey "))
+        self.assertEqual(self._detect(first, b"neon"), "hey_neon")
+        first.reset()
+        self.assertEqual(self._detect(second, b"neon"), "hey_neon")
+        first.shutdown()
+        self.assertIs(second.listen_words["hey_neon"], engine)
+
+    @patch("neon_hana.model_registry.get_shared_engine")
+    def test_shared_plugin_engine(self, get_shared_engine):
+        plugin_engine = BufferedEngine()
+        shared_engine = StreamStateEngine()
+        get_shared_engine.return_value = shared_engine
+        self._patch_load(plugin_engine)
+        create = self._patch_create()
+        registry = self.ModelRegistry()
+        first = self._listen(registry)
+        second = self._listen(registry)
+        # Plugins with a shared implementation are replaced once at load
+        get_shared_engine.assert_called_once_with(plugin_engine)
+        create.assert_not_called()
+        self.assertIs(first.listen_words["hey_neon"], shared_engine)
+        self.assertIs(second.listen_words["hey_neon"], shared_engine)
+
+    def test_get_hotwords_with_detector(self):
+        engine = StreamStateEngine()
+        self._patch_load(engine)
+        registry = self.ModelRegistry()
+        detector = Mock()
+        detector.detect.return_value = [False]
+        hotwords = self._listen(registry, detector)
+        chunk = b"audio"
+        self.assertIsNone(self._detect(hotwords, chunk))
+        # Detection runs once per chunk
+        hotwords.update(chunk)
+        detector.detect.assert_called_once()
+        engines, states, detected_chunk = detector.detect.call_args[0]
+        self.assertEqual(engines, [engine])
+        self.assertEqual(states, [[]])
+        self.assertIs(detected_chunk, chunk)
+
+        detector.detect.return_value = [True]
+        self.assertEqual(self._detect(hotwords, b"hey neon"), "hey_neon")
+        self.assertIsNone(hotwords.found())
+
+    @patch("neon_hana.model_registry.OVOSVADFactory.create")
+    def test_get_vad(self, create_vad):
+        create_vad.side_effect = lambda: Mock(sample_rate=16000)
+        registry = self.ModelRegistry()
+        first = registry.get_vad()
+        second = registry.get_vad()
+        # VAD engines keep state between chunks, so streams do not share them
+        self.assertIsNot(first, second)
+        self.assertEqual(create_vad.call_count, 2)
+        self.assertEqual(registry.stats["vad_loads"], 2)
+        self.assertEqual(first.sample_rate, 16000)
+
+    def test_release_vad(self):
+        vad = Mock()
+        self.ModelRegistry.release_vad(vad)
+        vad.shutdown.assert_called_once()
+        vad.stop.assert_not_called()
+
+        vad = Mock(spec=["stop"])
+        self.ModelRegistry.release_vad(vad)
+        vad.stop.assert_called_once()
+
+        # VAD engines without a shutdown method are left to be collected
+        self.ModelRegistry.release_vad(object())
+        self.ModelRegistry.release_vad(Mock(shutdown=Mock(
+            side_effect=RuntimeError("Already stopped"))))
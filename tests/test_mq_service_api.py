@@ -24,9 +24,300 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import asyncio
 import unittest
 
+from base64 import b64encode
+from tempfile import TemporaryDirectory
+from time import time
+from unittest.mock import AsyncMock, Mock
 
-class TestMqServiceApi(unittest.TestCase):
-    from neon_hana.mq_service_api import MQServiceManager
-    # TODO
+
+class TestMqServiceApi(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.mq_service_api import MQServiceManager, APIError
+
+    def setUp(self):
+        self.tts_cache_dir = TemporaryDirectory()
+        self.mq_service = self.MQServiceManager(
+            {"mq_default_timeout": 5,
+             "tts_cache_dir": self.tts_cache_dir.name})
+        self.mq_service._mq_client.request = AsyncMock()
+
+    def tearDown(self):
+        self.tts_cache_dir.cleanup()
+
+    async def test_get_tts(self):
+        encoded = b64encode(b"RIFF audio").decode("utf-8")
+        self.mq_service._mq_client.request.return_value = {
+            "data": {"en-us": {"audio": {"female": encoded}}}}
+        resp = await self.mq_service.get_tts("hello", "en-us", "female")
+        self.assertEqual(resp, {"encoded_audio": encoded})
+        args = self.mq_service._mq_client.request.call_args
+        self.assertEqual(args.args[0], "/neon_chat_api")
+        self.assertEqual(args.args[1]["data"]["text"], "hello")
+        self.assertEqual(args.args[2], "neon_chat_api_request")
+        self.assertEqual(args.kwargs["timeout"], 5)
+
+        # Equivalent request is served from cache
+        resp = await self.mq_service.get_tts(" hello ", "en-US", "female")
+        self.assertEqual(resp, {"encoded_audio": encoded})
+        self.mq_service._mq_client.request.assert_awaited_once()
+        self.assertEqual(
+            self.mq_service.stats["tts_cache"]["memory_hits"], 1)
+
+        # Different voice is not
+        self.mq_service._mq_client.request.return_value = {
+            "data": {"en-us": {"audio": {"male": encoded}}}}
+        await self.mq_service.get_tts("hello", "en-us", "male")
+        self.assertEqual(self.mq_service._mq_client.request.await_count, 2)
+
+    async def test_get_stt_audio(self):
+        self.mq_service._mq_client.request.return_value = {
+            "data": {"transcripts": ["hello"], "parser_data": {}}}
+        resp = await self.mq_service.get_stt_audio(b"RIFF audio", "en-us")
+        self.assertEqual(resp["transcripts"], ["hello"])
+        request = self.mq_service._mq_client.request.call_args.args[1]
+        self.assertEqual(request["data"]["audio_data"],
+                         b64encode(b"RIFF audio").decode("utf-8"))
+        self.assertEqual(request["data"]["lang"], "en-us")
+
+        # Raw limit matches the encoded limit
+        self.mq_service.stt_max_length = 8
+        self.assertEqual(self.mq_service.stt_max_bytes, 6)
+        await self.mq_service.get_stt_audio(b"123456", "en-us")
+        with self.assertRaises(self.APIError):
+            await self.mq_service.get_stt_audio(b"1234567", "en-us")
+
+    async def test_get_response_sessions(self):
+        from neon_hana.schema.node_model import NodeData
+        from neon_hana.schema.user_profile import UserProfile
+        self.mq_service.sessions_by_id.max_entries = 2
+        self.mq_service._mq_client.request.side_effect = \
+            lambda _, request, *__, **___: {
+                "context": {"session": {**request["context"]["session"],
+                                        "updated": True}},
+                "data": {"responses": {"en-us": {"sentence": "hi"}}}}
+        node_data = NodeData()
+        for _ in range(2):
+            resp = await self.mq_service.get_response(
+                "hello", "en-us", UserProfile(), node_data)
+            self.assertEqual(resp, {"answer": "hi", "lang_code": "en-us"})
+        session = await self.mq_service.get_session(node_data)
+        self.assertEqual(session["session_id"], node_data.device_id)
+        self.assertTrue(session["updated"])
+
+        # Anonymous requests do not grow the store without limit
+        for _ in range(5):
+            await self.mq_service.get_response("hello", "en-us",
+                                               UserProfile(), NodeData())
+        self.assertEqual(self.mq_service.stats["sessions"]["entries"], 2)
+
+    async def test_query_api_proxy(self):
+        self.mq_service._mq_client.request.return_value = {
+            "status_code": 200, "content": '{"current": {}}'}
+        resp = await self.mq_service.query_api_proxy(
+            "open_weather_map", {"lat": 47.6815, "lon": -122.2087,
+                                 "unit": "imperial"})
+        self.assertEqual(resp, {"current": {}})
+        request = self.mq_service._mq_client.request.call_args.args[1]
+        self.assertEqual(request["units"], "imperial")
+        self.assertEqual(request["service"], "open_weather_map")
+
+    async def test_concurrent_requests(self):
+        async def _slow_response(*_, **__):
+            await asyncio.sleep(0.5)
+            return {"parsed_file": "ncs"}
+
+        self.mq_service._mq_client.request.side_effect = _slow_response
+        start = time()
+        responses = await asyncio.gather(
+            *[self.mq_service.parse_ccl_script("script", dict())
+              for _ in range(10)])
+        # Requests are awaited concurrently rather than serialized
+        self.assertLess(time() - start, 2)
+        self.assertEqual(responses, [{"ncs": "ncs"}] * 10)
+
+    async def test_coalesced_requests(self):
+        async def _slow_response(*_, **__):
+            await asyncio.sleep(0.2)
+            return {"status_code": 200, "content": '{"price": 1}'}
+
+        self.mq_service._mq_client.request.side_effect = _slow_response
+        responses = await asyncio.gather(
+            *[self.mq_service.query_api_proxy("alpha_vantage",
+                                              {"symbol": "GOOG",
+                                               "api": "quote"})
+              for _ in range(5)],
+            self.mq_service.query_api_proxy("alpha_vantage",
+                                            {"api": "quote",
+                                             "symbol": "MSFT"}))
+        self.assertEqual(len(responses), 6)
+        for resp in responses:
+            self.assertEqual(resp["price"], 1)
+        self.assertEqual(self.mq_service._mq_client.request.call_count, 2)
+        self.assertEqual(
+            self.mq_service.stats["coalesced_requests"]["alpha_vantage"],
+            {"calls": 2, "coalesced": 4})
+
+    async def test_api_proxy_cache(self):
+        self.mq_service._mq_client.request.return_value = {
+            "status_code": 200, "content": '{"current": {}}'}
+        query = {"lat": 47.6815, "lon": -122.2087, "unit": "metric",
+                 "lang": "en"}
+        resp = await self.mq_service.query_api_proxy("open_weather_map",
+                                                     dict(query))
+        self.assertEqual(resp, {"current": {}})
+        # Aliased params hit the same cache entry
+        for params in ({**query},
+                       {"lat": 47.6815, "lon": -122.2087, "units": "metric",
+                        "lang_code": "en"}):
+            self.assertEqual(await self.mq_service.query_api_proxy(
+                "open_weather_map", params), resp)
+        self.mq_service._mq_client.request.assert_called_once()
+        stats = self.mq_service.stats["api_cache"]["namespaces"]
+        self.assertEqual(stats["open_weather_map"]["hits"], 2)
+        self.assertEqual(stats["open_weather_map"]["misses"], 1)
+
+        # Nearby coordinates share a cached response
+        self.assertEqual(await self.mq_service.query_api_proxy(
+            "open_weather_map", {**query, "lat": 47.6817}), resp)
+        self.mq_service._mq_client.request.assert_called_once()
+        self.assertEqual(self.mq_service.stats["api_cache"]["namespaces"]
+                         ["open_weather_map"]["approximate_hits"], 1)
+
+        # Different params and errors are not cached
+        self.mq_service._mq_client.request.return_value = {
+            "status_code": 401, "content": "Unauthorized"}
+        with self.assertRaises(self.APIError):
+            await self.mq_service.query_api_proxy(
+                "open_weather_map", {**query, "lat": 0.0})
+        with self.assertRaises(self.APIError):
+            await self.mq_service.query_api_proxy(
+                "open_weather_map", {**query, "lat": 0.0})
+        self.assertEqual(self.mq_service._mq_client.request.call_count, 3)
+
+        # Services with no TTL are not cached
+        self.mq_service._mq_client.request.return_value = {
+            "status_code": 200, "content": "forty two"}
+        for _ in range(2):
+            await self.mq_service.query_api_proxy(
+                "wolfram_alpha", {"api": "spoken", "query": "test"})
+        self.assertEqual(self.mq_service._mq_client.request.call_count, 5)
+
+    def test_get_api_cache_ttl(self):
+        mq_service = self.MQServiceManager(
+            {"tts_cache_dir": self.tts_cache_dir.name,
+             "api_cache_ttl": {"alpha_vantage.quote": 5,
+                               "open_weather_map": 60},
+             "api_cache_stale_ttl": {"map_maker": 60}})
+        # Stale responses are served for up to the configured TTL
+        self.assertEqual(mq_service._get_api_cache_ttl(
+            {"service": "alpha_vantage", "api": "quote"}), (5, 5))
+        self.assertEqual(mq_service._get_api_cache_ttl(
+            {"service": "open_weather_map"}), (60, 60))
+        self.assertEqual(mq_service._get_api_cache_ttl(
+            {"service": "map_maker"}), (604800, 60))
+        self.assertEqual(mq_service._get_api_cache_ttl(
+            {"service": "wolfram_alpha"}), (0, 0))
+
+    async def test_request_timeout(self):
+        from neon_hana.schema.node_model import NodeData
+        from neon_hana.schema.user_profile import UserProfile
+        self.mq_service.email_enabled = True
+        requests = [
+            self.mq_service.get_coupons,
+            lambda: self.mq_service.parse_ccl_script("script", {}),
+            lambda: self.mq_service.query_api_proxy("wolfram_alpha",
+                                                    {"query": "test"}),
+            lambda: self.mq_service.query_llm("chat_gpt", "hello", []),
+            lambda: self.mq_service.send_email("test@neon.ai", "subject",
+                                               "body", None),
+            lambda: self.mq_service.get_stt("audio", "en-us"),
+            lambda: self.mq_service.get_tts("hello", "en-us", "female"),
+            lambda: self.mq_service.get_response(
+                "hello", "en-us", UserProfile(), NodeData())]
+        for error, status_code in ((TimeoutError(), 504),
+                                   (ConnectionError(), 503)):
+            self.mq_service._mq_client.request.side_effect = error
+            for request in requests:
+                with self.assertRaises(self.APIError) as e:
+                    await request()
+                self.assertEqual(e.exception.status_code, status_code)
+
+
+class TestAsyncMQClient(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.mq_client import AsyncMQClient
+
+    async def test_connection_pool(self):
+        client = self.AsyncMQClient(dict(), pool_size=3,
+                                    health_check_interval=0)
+        connection = client._get_connection("/test")
+        self.assertEqual(len(client._pools["/test"]), 3)
+        self.assertFalse(connection.is_healthy)
+        self.assertEqual(client.stats["/test"],
+                         {"connections": 3, "healthy": 0, "in_flight": 0,
+                          "reconnects": 0})
+
+        # Healthy connections are preferred, then least busy
+        for conn in client._pools["/test"]:
+            conn.connection = Mock(is_open=True)
+            conn.channel = Mock(is_open=True)
+        client._pools["/test"][0].channel.is_open = False
+        client._pools["/test"][1]._pending["test"] = asyncio.Future()
+        self.assertEqual(client._get_connection("/test"),
+                         client._pools["/test"][2])
+        self.assertEqual(client.stats["/test"]["healthy"], 2)
+        self.assertEqual(client.stats["/test"]["in_flight"], 1)
+
+        await client.shutdown()
+        self.assertEqual(client.stats, dict())
+
+    async def test_reply_queue_demux(self):
+        from neon_mq_connector.utils.network_utils import dict_to_b64
+        client = self.AsyncMQClient(dict(), pool_size=1,
+                                    health_check_interval=0)
+        connection = client._get_connection("/test")
+        connection.connection = Mock(is_open=True)
+        connection.channel = Mock(is_open=True)
+        connection.reply_queue = "reply_queue"
+        connection._declared_queues.add("target")
+
+        requests = [asyncio.create_task(
+            client.request("/test", {"message_id": f"request_{i}"}, "target",
+                           timeout=5)) for i in range(3)]
+        await asyncio.sleep(0.1)
+        self.assertEqual(connection.in_flight, 3)
+        published = connection.channel.basic_publish.call_args_list
+        self.assertEqual(len(published), 3)
+        for call in published:
+            self.assertEqual(call.kwargs["routing_key"], "target")
+
+        # Responses arrive out of order on the shared queue
+        for i in (2, 0, 1):
+            connection._on_response(None, None, None, dict_to_b64(
+                {"context": {"mq": {"message_id": f"request_{i}"}},
+                 "response": i}))
+        # Unknown responses are ignored
+        connection._on_response(None, None, None,
+                                dict_to_b64({"message_id": "unknown"}))
+        responses = await asyncio.gather(*requests)
+        self.assertEqual([r["response"] for r in responses], [0, 1, 2])
+        self.assertEqual(connection.in_flight, 0)
+
+        # Pending requests fail when the connection is lost
+        request = asyncio.create_task(
+            client.request("/test", {"message_id": "lost"}, "target",
+                           timeout=5))
+        await asyncio.sleep(0.1)
+        connection._on_connection_closed(None, Exception("test"))
+        with self.assertRaises(ConnectionError):
+            await request
+
+    def test_get_message_id(self):
+        from neon_hana.mq_client import get_message_id
+        self.assertEqual(get_message_id({"message_id": "test"}), "test")
+        self.assertEqual(get_message_id({"message_id": "response",
+                                         "context": {"mq": {
+                                             "message_id": "request"}}}),
+                         "request")
+        self.assertIsNone(get_message_id({"context": {}}))
@@ -24,9 +24,100 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import asyncio
+import json
 import unittest
 
+from base64 import b64encode
+from unittest.mock import AsyncMock, Mock, patch
+
 
 class TestMqServiceApi(unittest.TestCase):
     from neon_hana.mq_websocket_api import MQWebsocketAPI
-    # TODO
+
+    def test_send_audio_to_client(self):
+        from ovos_bus_client.message import Message
+        socket = Mock(send_group=AsyncMock())
+        api = Mock(_sessions={"test": {"socket": socket}})
+        message = Message("neon.get_tts.response",
+                          {"en-us": {"sentence": "hello",
+                                     "audio": {"female": b64encode(b"female"),
+                                               "male": b64encode(b"male!")}}},
+                          {"session": {"session_id": "test"},
+                           "binary_audio": True})
+        asyncio.run(self.MQWebsocketAPI.send_audio_to_client(api, message))
+        socket.send_group.assert_called_once()
+        messages = socket.send_group.call_args.args[0]
+        response = json.loads(messages[0])
+        self.assertEqual(response["data"]["en-us"]["audio"],
+                         {"female": 6, "male": 5})
+        self.assertEqual(messages[1:], [b"female", b"male!"])
+
+
+class TestSessionRegistration(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.mq_websocket_api import MQWebsocketAPI, ClientNotKnown
+
+    def setUp(self):
+        with patch("neon_iris.client.NeonAIClient.__init__",
+                   return_value=None):
+            self.api = self.MQWebsocketAPI({})
+        self.api._user_config = Mock(content={"user": {"username": "test"}})
+
+    async def test_stream_before_connection(self):
+        socket = Mock(send_text=AsyncMock())
+        waiter = asyncio.create_task(self.api.wait_for_session("test"))
+        other_traffic = asyncio.create_task(asyncio.sleep(0.01))
+        # Waiting for a session does not block the event loop
+        await other_traffic
+        self.assertFalse(waiter.done())
+        await self.api.new_connection(socket, "test")
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(self.api._registrations, dict())
+        self.api._sessions["test"]["socket"].close()
+
+    async def test_stream_after_connection(self):
+        await self.api.new_connection(Mock(), "test")
+        await asyncio.wait_for(self.api.wait_for_session("test"), 1)
+        self.api._sessions["test"]["socket"].close()
+
+    async def test_session_continued(self):
+        await self.api.new_connection(Mock(), "test")
+        message = Mock(context={"session": {"session_id": "test",
+                                            "turn": 1}})
+        self.api._update_session_data(message)
+        self.api.end_session("test")
+        self.assertEqual(self.api.get_session("test"), {})
+        stored = await self.api._session_store.aget("test")
+        self.assertEqual(stored["session"]["turn"], 1)
+
+        # A new connection continues the stored session
+        await self.api.new_connection(Mock(), "test")
+        self.assertEqual(self.api._sessions["test"]["session"]["turn"], 1)
+        self.assertEqual(self.api.get_user_config("test"),
+                         {"user": {"username": "test"}})
+        self.api._sessions["test"]["socket"].close()
+
+    async def test_stream_timeout(self):
+        with self.assertRaises(self.ClientNotKnown):
+            await self.api.wait_for_session("test", timeout=0.01)
+        self.assertEqual(self.api._registrations, dict())
+
+    async def test_concurrent_streams(self):
+        waiters = [asyncio.create_task(self.api.wait_for_session("test"))
+                   for _ in range(2)]
+        await asyncio.sleep(0)
+        await self.api.new_connection(Mock(), "test")
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        self.api._sessions["test"]["socket"].close()
+
+    async def test_stats(self):
+        for session_id in ("node_1", "node_2"):
+            await self.api.new_connection(Mock(), session_id)
+        await self.api._sessions["node_1"]["socket"].send_text("test")
+        stats = self.api.stats
+        # Stats do not identify connected sessions
+        self.assertNotIn("node_1", json.dumps(stats))
+        self.assertEqual(stats["sessions"]["count"], 2)
+        self.assertEqual(stats["stream_buffers"], {"count": 0})
+        for session_id in ("node_1", "node_2"):
+            self.api._sessions[session_id]["socket"].close()
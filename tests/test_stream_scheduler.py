@@ -0,0 +1,159 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from queue import Empty, Queue
+from threading import Event, Lock, Thread, get_ident
+from time import sleep
+from unittest.mock import Mock
+
+
+class FakeStream:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.queue = Queue()
+        self.processed = list()
+        self.threads = set()
+        self._lock = Lock()
+        self.concurrent = False
+
+    def on_audio(self, audio):
+        self.queue.put(audio)
+        self.scheduler.notify(self)
+
+    @property
+    def has_audio(self):
+        return not self.queue.empty()
+
+    def process_audio(self, max_chunks):
+        if not self._lock.acquire(blocking=False):
+            self.concurrent = True
+            return 0
+        try:
+            self.threads.add(get_ident())
+            processed = 0
+            while processed < max_chunks:
+                try:
+                    self.processed.append(self.queue.get_nowait())
+                except Empty:
+                    break
+                processed += 1
+            return processed
+        finally:
+            self._lock.release()
+
+
+class TestStreamScheduler(unittest.TestCase):
+    from neon_hana.stream_scheduler import StreamScheduler
+
+    def test_many_streams(self):
+        scheduler = self.StreamScheduler(workers=2)
+        streams = [FakeStream(scheduler) for _ in range(50)]
+
+        def _feed(stream):
+            for i in range(100):
+                stream.on_audio(i)
+
+        feeders = [Thread(target=_feed, args=(stream,)) for stream in streams]
+        for feeder in feeders:
+            feeder.start()
+        for feeder in feeders:
+            feeder.join()
+        for _ in range(100):
+            if all(len(stream.processed) == 100 for stream in streams):
+                break
+            sleep(0.05)
+        for stream in streams:
+            # All audio is processed in order by one worker at a time
+            self.assertEqual(stream.processed, list(range(100)))
+            self.assertFalse(stream.concurrent)
+        self.assertEqual(scheduler.stats["chunks"], 5000)
+        self.assertEqual(len(scheduler._workers), 2)
+        scheduler.shutdown()
+        self.assertEqual(scheduler._workers, list())
+
+    def test_fair_turns(self):
+        scheduler = self.StreamScheduler(workers=1, chunks_per_turn=2)
+        busy = FakeStream(scheduler)
+        quiet = FakeStream(scheduler)
+        block = Event()
+        blocker = Mock(has_audio=False,
+                       process_audio=Mock(side_effect=lambda _: block.wait()))
+        scheduler.notify(blocker)
+        for i in range(10):
+            busy.queue.put(i)
+        scheduler.notify(busy)
+        quiet.on_audio("quiet")
+        block.set()
+        for _ in range(100):
+            if len(busy.processed) == 10:
+                break
+            sleep(0.01)
+        # The quiet stream is processed after one turn of the busy stream
+        self.assertEqual(quiet.processed, ["quiet"])
+        self.assertEqual(scheduler.stats["turns"], 1 + 5 + 1)
+        scheduler.shutdown()
+
+    def test_errors(self):
+        scheduler = self.StreamScheduler(workers=1)
+        stream = Mock(has_audio=False,
+                      process_audio=Mock(side_effect=RuntimeError()))
+        scheduler.notify(stream)
+        for _ in range(100):
+            if scheduler.stats["errors"]:
+                break
+            sleep(0.01)
+        self.assertEqual(scheduler.stats["errors"], 1)
+        # Stream can be scheduled again
+        scheduler.notify(stream)
+        for _ in range(100):
+            if scheduler.stats["errors"] == 2:
+                break
+            sleep(0.01)
+        self.assertEqual(scheduler.stats["errors"], 2)
+        scheduler.shutdown()
+
+
+class TestSteppedVoiceLoop(unittest.TestCase):
+    def test_process_chunk(self):
+        from ovos_dinkum_listener.voice_loop.voice_loop import ListeningState
+        from neon_hana.streaming_client import (SteppedVoiceLoop,
+                                                StreamMicrophone)
+        hotwords = Mock(found=Mock(return_value=None))
+        chunk_callback = Mock()
+        loop = SteppedVoiceLoop(mic=StreamMicrophone(), vad=Mock(),
+                                hotwords=hotwords, stt=Mock(),
+                                fallback_stt=Mock(), transformers=Mock(),
+                                chunk_callback=chunk_callback)
+        loop.start()
+        loop.prepare()
+        self.assertEqual(loop.state, ListeningState.DETECT_WAKEWORD)
+        loop.process_chunk(bytes(4096))
+        loop.process_chunk(bytes(4096))
+        hotwords.update.assert_called_with(bytes(4096))
+        self.assertEqual(chunk_callback.call_count, 2)
+        self.assertEqual(loop.state, ListeningState.DETECT_WAKEWORD)
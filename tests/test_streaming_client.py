@@ -0,0 +1,343 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import numpy as np
+
+from threading import Lock, Thread
+from unittest.mock import AsyncMock, Mock, patch
+
+
+class BatchEngine:
+    def __init__(self):
+        self.batches = list()
+
+    def new_stream_state(self):
+        return list()
+
+    def detect_batch(self, states, chunks):
+        self.batches.append(len(chunks))
+        results = list()
+        for state, chunk in zip(states, chunks):
+            state.append(chunk)
+            results.append(b"".join(state).endswith(b"hey neon"))
+        return results
+
+
+class TestHotwordBatcher(unittest.TestCase):
+    from neon_hana.streaming_client import HotwordBatcher
+
+    def _detect_concurrently(self, batcher, engine, chunks):
+        results = dict()
+
+        def _detect(i, chunk):
+            results[i] = batcher.detect([engine], [engine.new_stream_state()],
+                                        chunk)
+
+        threads = [Thread(target=_detect, args=(i, chunk))
+                   for i, chunk in enumerate(chunks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_batch_engine(self):
+        batcher = self.HotwordBatcher(max_batch_size=4, max_latency=0.5)
+        engine = BatchEngine()
+        chunks = [b"hey neon", b"audio", b"hey neon", b"audio"]
+        results = self._detect_concurrently(batcher, engine, chunks)
+        self.assertEqual(results, {0: [True], 1: [False],
+                                   2: [True], 3: [False]})
+        # All chunks ran in one batch without waiting for `max_latency`
+        self.assertEqual(engine.batches, [4])
+        self.assertEqual(batcher.stats["vectorized"], 1)
+        self.assertEqual(batcher.stats["requests"], 4)
+
+    def test_max_batch_size(self):
+        batcher = self.HotwordBatcher(max_batch_size=2, max_latency=0.05)
+        engine = BatchEngine()
+        self._detect_concurrently(batcher, engine, [b"audio"] * 5)
+        self.assertEqual(sum(engine.batches), 5)
+        self.assertTrue(all(size <= 2 for size in engine.batches))
+
+    def test_per_stream_state(self):
+        batcher = self.HotwordBatcher(max_latency=0)
+        engine = BatchEngine()
+        first = engine.new_stream_state()
+        second = engine.new_stream_state()
+        self.assertEqual(batcher.detect([engine], [first], b"hey "), [False])
+        self.assertEqual(batcher.detect([engine], [second], b"neon"), [False])
+        self.assertEqual(batcher.detect([engine], [first], b"neon"), [True])
+
+    def test_plain_engine(self):
+        batcher = self.HotwordBatcher(max_latency=0)
+        engine = Mock(spec=["update", "found_wake_word"])
+        # Engines without per-stream state must not run for several streams
+        with self.assertRaises(ValueError):
+            batcher.detect([engine], [None], b"audio")
+        engine.update.assert_not_called()
+        self.assertEqual(batcher.stats["requests"], 0)
+
+    def test_errors(self):
+        batcher = self.HotwordBatcher(max_latency=0)
+        engine = BatchEngine()
+        engine.detect_batch = Mock(side_effect=RuntimeError())
+        self.assertEqual(batcher.detect([engine], [[]], b"audio"), [False])
+        self.assertEqual(batcher.stats["errors"], 1)
+        self.assertEqual(batcher.detect([], [], b"audio"), [])
+
+
+def _get_audio(amplitude: float, samples: int = 2048) -> bytes:
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, amplitude, samples).clip(-32768, 32767)
+    return audio.astype(np.int16).tobytes()
+
+
+class TestEnergyGate(unittest.TestCase):
+    from neon_hana.streaming_client import EnergyGate
+
+    def test_get_rms(self):
+        self.assertEqual(self.EnergyGate.get_rms(b""), 0)
+        self.assertEqual(self.EnergyGate.get_rms(bytes(4096)), 0)
+        square = np.array([1000, -1000] * 100, dtype=np.int16).tobytes()
+        self.assertAlmostEqual(self.EnergyGate.get_rms(square), 1000)
+
+    def test_gate(self):
+        gate = self.EnergyGate(pre_roll_chunks=2, hangover_chunks=2)
+        silence = [_get_audio(200) for _ in range(5)]
+        for chunk in silence:
+            self.assertEqual(gate.process(chunk), [])
+        self.assertFalse(gate.is_open)
+        self.assertEqual(gate.gated, 3)
+
+        # Speech is released with pre-roll
+        speech = _get_audio(5000)
+        self.assertEqual(gate.process(speech), silence[-2:] + [speech])
+        self.assertTrue(gate.is_open)
+
+        # Quiet audio passes until the hangover ends
+        self.assertEqual(gate.process(silence[0]), [silence[0]])
+        self.assertEqual(gate.process(silence[1]), [silence[1]])
+        self.assertEqual(gate.process(silence[2]), [])
+        self.assertEqual(gate.passed, 5)
+
+    def test_adaptive_noise_floor(self):
+        gate = self.EnergyGate()
+        for _ in range(5):
+            gate.process(_get_audio(200))
+        quiet_floor = gate.noise_floor
+        # Audio that is speech in a quiet room opens the gate
+        self.assertTrue(gate.process(_get_audio(1000)))
+
+        noisy_gate = self.EnergyGate()
+        for _ in range(5):
+            noisy_gate.process(_get_audio(800))
+        self.assertGreater(noisy_gate.noise_floor, quiet_floor)
+        # The same audio is background noise in a noisy room
+        self.assertEqual(noisy_gate.process(_get_audio(1000)), [])
+
+    def test_release(self):
+        gate = self.EnergyGate()
+        silence = _get_audio(200)
+        gate.process(silence)
+        self.assertEqual(gate.release(b"chunk"), [silence, b"chunk"])
+        self.assertEqual(gate.release(), [])
+
+    def test_stream_gate(self):
+        from ovos_dinkum_listener.voice_loop.voice_loop import ListeningState
+        from neon_hana.streaming_client import RemoteStreamHandler
+        handler = Mock(energy_gate=self.EnergyGate(),
+                       voice_loop=Mock(state=ListeningState.DETECT_WAKEWORD))
+        silence = _get_audio(200)
+        self.assertEqual(RemoteStreamHandler._gate(handler, silence), [])
+        # Silence is processed while recording a command
+        handler.voice_loop.state = ListeningState.IN_COMMAND
+        self.assertEqual(RemoteStreamHandler._gate(handler, silence),
+                         [silence, silence])
+        handler.energy_gate = None
+        self.assertEqual(RemoteStreamHandler._gate(handler, silence),
+                         [silence])
+
+
+class TestResponseAudio(unittest.TestCase):
+    def test_frame_response_audio(self):
+        from neon_hana.streaming_client import (frame_response_audio,
+                                                RESPONSE_AUDIO_HEADER,
+                                                RESPONSE_AUDIO_FINAL)
+        audio = bytes(range(250))
+        chunks = list(frame_response_audio(audio, 7, 100))
+        self.assertEqual(len(chunks), 3)
+        headers = [RESPONSE_AUDIO_HEADER.unpack_from(c) for c in chunks]
+        self.assertEqual(headers, [(7, 0, 0), (7, 1, 0),
+                                   (7, 2, RESPONSE_AUDIO_FINAL)])
+        size = RESPONSE_AUDIO_HEADER.size
+        self.assertEqual(b"".join(c[size:] for c in chunks), audio)
+
+        chunks = list(frame_response_audio(audio, 8, 250))
+        self.assertEqual(chunks, [RESPONSE_AUDIO_HEADER.pack(
+            8, 0, RESPONSE_AUDIO_FINAL) + audio])
+
+    def test_on_response_audio(self):
+        from base64 import b64encode
+        from neon_hana.streaming_client import (RemoteStreamHandler,
+                                                RESPONSE_AUDIO_HEADER)
+        audio = bytes(range(250))
+        data = {"responses": {"en-us": {"audio": {
+            "female": b64encode(audio).decode("utf-8"),
+            "male": b64encode(audio[:50]).decode("utf-8")}}}}
+        handler = Mock(response_chunk_size=0, _response_id=0)
+        RemoteStreamHandler.on_response_audio(handler, data)
+        sent = [call.args[0] for call in
+                handler.client_socket.send_group.call_args_list]
+        self.assertEqual(sent, [[audio], [audio[:50]]])
+        self.assertEqual(handler.dispatcher.dispatch.call_count, 2)
+
+        handler = Mock(response_chunk_size=100, _response_id=0)
+        RemoteStreamHandler.on_response_audio(handler, data)
+        sent = [[RESPONSE_AUDIO_HEADER.unpack_from(c)[:2] for c in call.args[0]]
+                for call in handler.client_socket.send_group.call_args_list]
+        self.assertEqual(sent, [[(1, 0), (1, 1), (1, 2)], [(2, 0)]])
+        self.assertEqual(handler.dispatcher.dispatch.call_count, 2)
+
+    def test_on_response_audio_queue_limit(self):
+        import asyncio
+        from base64 import b64encode
+        from neon_hana.streaming_client import (RemoteStreamHandler,
+                                                RESPONSE_AUDIO_HEADER)
+        from neon_hana.websocket_dispatcher import (SessionWriter,
+                                                    WebSocketDispatcher)
+        audio = bytes(1000)
+        data = {"responses": {"en-us": {"audio": {
+            "female": b64encode(audio).decode("utf-8")}}}}
+
+        async def _test():
+            sent = []
+            socket = Mock(send_bytes=AsyncMock(side_effect=sent.append))
+            writer = SessionWriter(socket, max_queued=4)
+            dispatcher = WebSocketDispatcher()
+            dispatcher.bind()
+            handler = Mock(response_chunk_size=10, _response_id=0,
+                           client_socket=writer, dispatcher=dispatcher)
+            # More chunks than the writer queues must all be delivered
+            await asyncio.to_thread(RemoteStreamHandler.on_response_audio,
+                                    handler, data)
+            await asyncio.sleep(0.01)
+            writer.close()
+            return sent, writer.stats
+
+        sent, stats = asyncio.run(_test())
+        self.assertEqual(len(sent), 100)
+        self.assertEqual([RESPONSE_AUDIO_HEADER.unpack_from(c)[1]
+                          for c in sent], list(range(100)))
+        self.assertEqual(stats["dropped"], 0)
+
+
+class TestRemoteStreamHandler(unittest.TestCase):
+    @patch("neon_hana.streaming_client.model_registry")
+    def test_shutdown(self, registry):
+        from ovos_dinkum_listener.voice_loop.hotwords import HotwordContainer
+        from neon_hana.model_registry import StreamHotwords
+        from neon_hana.streaming_client import (RemoteStreamHandler,
+                                                StreamMicrophone)
+        # Set when the registry loads hotwords
+        HotwordContainer._loaded.set()
+        engine = Mock(spec=["update", "found_wake_word", "shutdown"])
+        registry.get_hotwords.side_effect = lambda bus, _: StreamHotwords(
+            {"hey_neon": {"engine": engine, "listen": True}}, bus, Lock())
+        vad = Mock()
+        registry.get_vad.return_value = vad
+        handler = RemoteStreamHandler(StreamMicrophone(), "session",
+                                      input_audio_callback=Mock(),
+                                      client_socket=Mock(),
+                                      ww_callback=Mock())
+        handler.start()
+        handler.shutdown()
+        self.assertFalse(handler.voice_loop.running)
+        # Engines loaded for the stream are released on disconnect
+        engine.shutdown.assert_called_once()
+        self.assertEqual(handler.hotwords.plugins, [])
+        registry.release_vad.assert_called_once_with(vad)
+
+
+class TestUtteranceSegmenter(unittest.TestCase):
+    def test_segments(self):
+        from neon_hana.streaming_client import UtteranceSegmenter
+        callback = Mock()
+        segmenter = UtteranceSegmenter(10, callback)
+        # Audio outside an utterance is ignored
+        segmenter.stream_data(bytes(20))
+        self.assertFalse(segmenter.finish())
+        callback.assert_not_called()
+
+        segmenter.stream_start()
+        utterance_id = segmenter.utterance_id
+        segmenter.stream_data(b"abcdef")
+        callback.assert_not_called()
+        segmenter.stream_data(b"ghijkl")
+        callback.assert_called_once_with(b"abcdefghijkl", utterance_id, 0,
+                                         False)
+        segmenter.stream_data(b"mn")
+        self.assertEqual(segmenter.transcribe(lang="en-us"), [])
+        self.assertTrue(segmenter.finish())
+        callback.assert_called_with(b"mn", utterance_id, 1, True)
+        self.assertIsNone(segmenter.utterance_id)
+
+        segmenter.stream_start()
+        self.assertNotEqual(segmenter.utterance_id, utterance_id)
+
+    def test_stream_segments(self):
+        from base64 import b64decode
+        from neon_hana.streaming_client import (RemoteStreamHandler,
+                                                UtteranceSegmenter)
+        handler = Mock(lang="en-us", session_id="session",
+                       mic=Mock(sample_rate=16000, sample_width=2))
+        handler.segmenter = UtteranceSegmenter(
+            4, lambda *args: RemoteStreamHandler.on_input_segment(handler,
+                                                                  *args))
+        handler.segmenter.stream_start()
+        handler.segmenter.stream_data(bytes(4))
+        data = handler.input_audio_callback.call_args.args[0]["data"]
+        self.assertEqual(data["sequence"], 0)
+        self.assertFalse(data["final"])
+        self.assertTrue(b64decode(data["audio_data"]).startswith(b"RIFF"))
+
+        # The end of the utterance only sends the remaining audio
+        handler.segmenter.stream_data(bytes(2))
+        RemoteStreamHandler.on_input_audio(handler, bytes(6), {})
+        self.assertEqual(handler.input_audio_callback.call_count, 2)
+        data = handler.input_audio_callback.call_args.args[0]["data"]
+        self.assertEqual(data["sequence"], 1)
+        self.assertTrue(data["final"])
+        self.assertEqual(data["utterance_id"],
+                         handler.input_audio_callback.call_args_list[0]
+                         .args[0]["data"]["utterance_id"])
+
+        handler.segmenter = None
+        RemoteStreamHandler.on_input_audio(handler, bytes(6), {})
+        data = handler.input_audio_callback.call_args.args[0]["data"]
+        self.assertNotIn("utterance_id", data)
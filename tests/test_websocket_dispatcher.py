@@ -0,0 +1,217 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import unittest
+
+from threading import Event, Thread
+from unittest.mock import AsyncMock, Mock
+
+
+class TestWebSocketDispatcher(unittest.TestCase):
+    from neon_hana.websocket_dispatcher import WebSocketDispatcher
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_dispatch_from_thread(self):
+        dispatcher = self.WebSocketDispatcher()
+        dispatcher.bind(self.loop)
+        sent = list()
+
+        async def _send(value):
+            self.assertIs(asyncio.get_running_loop(), self.loop)
+            sent.append(value)
+
+        futures = [dispatcher.dispatch(_send(i)) for i in range(10)]
+        for future in futures:
+            future.result(timeout=1)
+        self.assertEqual(sent, list(range(10)))
+        self.assertEqual(dispatcher.stats["sent"], 10)
+
+    def test_dispatch_from_loop(self):
+        dispatcher = self.WebSocketDispatcher(max_pending=1)
+        dispatcher.bind(self.loop)
+        sent = Event()
+
+        async def _send():
+            sent.set()
+
+        async def _dispatch():
+            dispatcher.dispatch(_send())
+
+        asyncio.run_coroutine_threadsafe(_dispatch(), self.loop).result(1)
+        self.assertTrue(sent.wait(1))
+
+    def test_errors(self):
+        dispatcher = self.WebSocketDispatcher()
+        dispatcher.bind(self.loop)
+
+        async def _send():
+            raise ConnectionError("Socket closed")
+
+        dispatcher.dispatch(_send()).result(timeout=1)
+        self.assertEqual(dispatcher.stats["errors"], 1)
+
+    def test_bounded(self):
+        dispatcher = self.WebSocketDispatcher(max_pending=1, put_timeout=0.1)
+        dispatcher.bind(self.loop)
+        release = asyncio.Event()
+
+        async def _blocked_send():
+            await release.wait()
+
+        async def _send():
+            pass
+
+        first = dispatcher.dispatch(_blocked_send())
+        self.assertIsNone(dispatcher.dispatch(_send()))
+        self.assertEqual(dispatcher.stats["dropped"], 1)
+        self.loop.call_soon_threadsafe(release.set)
+        first.result(timeout=1)
+        dispatcher.dispatch(_send()).result(timeout=1)
+        self.assertEqual(dispatcher.stats["sent"], 2)
+
+    def test_unbound(self):
+        dispatcher = self.WebSocketDispatcher()
+
+        async def _send():
+            pass
+
+        self.assertIsNone(dispatcher.dispatch(_send()))
+        self.assertEqual(dispatcher.stats["dropped"], 1)
+
+
+class TestSessionWriter(unittest.IsolatedAsyncioTestCase):
+    from neon_hana.websocket_dispatcher import SessionWriter
+
+    def _get_socket(self) -> Mock:
+        self.sent = list()
+        self.release = asyncio.Event()
+        self.release.set()
+
+        async def _send(data):
+            await self.release.wait()
+            self.sent.append(data)
+
+        return Mock(send_text=AsyncMock(side_effect=_send),
+                    send_bytes=AsyncMock(side_effect=_send),
+                    close=AsyncMock())
+
+    async def test_send_in_order(self):
+        writer = self.SessionWriter(self._get_socket())
+        await writer.send_text("text")
+        await writer.send_bytes(b"audio")
+        await writer.send_text("more text")
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.sent, ["text", b"audio", "more text"])
+        self.assertEqual(writer.stats["sent"], 3)
+        self.assertEqual(writer.stats["depth"], 0)
+        writer.close()
+
+    async def test_drop_oldest(self):
+        writer = self.SessionWriter(self._get_socket(), max_queued=2)
+        self.release.clear()
+        await writer.send_text("0")
+        await asyncio.sleep(0)
+        for i in range(1, 4):
+            await writer.send_text(str(i))
+        self.assertEqual(writer.stats["depth"], 2)
+        self.assertEqual(writer.stats["max_depth"], 2)
+        self.release.set()
+        await asyncio.sleep(0.01)
+        # First message was already being sent when the queue filled
+        self.assertEqual(self.sent, ["0", "2", "3"])
+        self.assertEqual(writer.stats["dropped"], 1)
+        writer.close()
+
+    async def test_send_group(self):
+        writer = self.SessionWriter(self._get_socket(), max_queued=2)
+        self.release.clear()
+        await writer.send_text("sending")
+        await asyncio.sleep(0)
+        await writer.send_group(["response 1", b"audio 1", b"audio 2"])
+        await writer.send_text("status")
+        await writer.send_group(["response 2", b"audio 3"])
+        self.assertEqual(writer.stats["depth"], 2)
+        self.release.set()
+        await asyncio.sleep(0.01)
+        # The oldest group is dropped whole, never split from its audio
+        self.assertEqual(self.sent, ["sending", "status", "response 2",
+                                     b"audio 3"])
+        self.assertEqual(writer.stats["dropped"], 1)
+        self.assertEqual(writer.stats["sent"], 3)
+        writer.close()
+
+    async def test_coalesce(self):
+        writer = self.SessionWriter(self._get_socket(), max_queued=2,
+                                    overflow_policy="coalesce")
+        self.release.clear()
+        await writer.send_text("sending")
+        await asyncio.sleep(0)
+        await writer.send_text("status 1", "status")
+        await writer.send_text("response", "response")
+        await writer.send_text("status 2", "status")
+        self.release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.sent, ["sending", "status 2", "response"])
+        self.assertEqual(writer.stats["coalesced"], 1)
+        self.assertEqual(writer.stats["dropped"], 0)
+        writer.close()
+
+    async def test_disconnect(self):
+        socket = self._get_socket()
+        writer = self.SessionWriter(socket, max_queued=1,
+                                    overflow_policy="disconnect")
+        self.release.clear()
+        await writer.send_text("sending")
+        await asyncio.sleep(0)
+        await writer.send_text("queued")
+        await writer.send_text("overflow")
+        await asyncio.sleep(0.01)
+        socket.close.assert_awaited_once()
+        await writer.send_text("after close")
+        self.assertEqual(writer.stats["dropped"], 3)
+
+    async def test_failed_send(self):
+        socket = self._get_socket()
+        socket.send_text.side_effect = RuntimeError("Socket closed")
+        writer = self.SessionWriter(socket)
+        await writer.send_text("text")
+        await asyncio.sleep(0.01)
+        await writer.send_text("text")
+        self.assertEqual(writer.stats["dropped"], 2)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            self.SessionWriter(Mock(), overflow_policy="block")